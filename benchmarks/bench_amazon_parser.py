@@ -0,0 +1,58 @@
+'''
+Compares the fast and full paths of AmazonPriceParser
+on the sample product pages in benchmarks/fixtures.
+
+Usage:
+    python benchmarks/bench_amazon_parser.py [--number N]
+'''
+import argparse
+import os
+import sys
+import timeit
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from playground.helpers.amazon_parser import AmazonPriceParser
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, "fixtures")
+PAGES = ["amazon_product_B003EM8008.html",
+         "amazon_product_AAAAAAAAAA.html"]
+
+
+def load_page(name):
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return f.read()
+
+
+def best_time(func, number, repeat=5):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20,
+                        help="calls per timing run")
+    args = parser.parse_args()
+
+    APP = AmazonPriceParser
+
+    print("%-32s %10s %12s %12s %9s" % ("page", "size (KB)", "full (ms)", "fast (ms)", "speedup"))
+    for name in PAGES:
+        html = load_page(name)
+
+        full_result = APP.find_price_string_full(html)
+        fast_result = APP.find_price_string(html)
+        if full_result != fast_result:
+            sys.exit("%s: fast path returned %r, full parse returned %r"
+                     % (name, fast_result, full_result))
+
+        full = best_time(lambda: APP.find_price_string_full(html), args.number)
+        fast = best_time(lambda: APP.find_price_string(html), args.number)
+
+        print("%-32s %10.1f %12.3f %12.3f %8.0fx" % (name, len(html) / 1024.0,
+                                                    full * 1000, fast * 1000, full / fast))
+
+
+if __name__ == "__main__":
+    main()
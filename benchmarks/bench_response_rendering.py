@@ -0,0 +1,67 @@
+'''
+Compares the cost of rendering a cryptocurrencies response
+with JsonResponse against ResponseRenderer, cold (template
+only) and memoized.
+
+Usage:
+    python benchmarks/bench_response_rendering.py [--number N]
+'''
+import argparse
+import os
+import sys
+import timeit
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "currencies.settings")
+
+import django
+django.setup()
+
+from django.http import HttpResponse, JsonResponse
+
+from playground.helpers.cryptocurrencies_helper import CryptocurrenciesHelper
+from playground.helpers.response_renderer import ResponseRenderer
+
+
+def best_time(func, number, repeat=5):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20000,
+                        help="responses per timing run")
+    args = parser.parse_args()
+
+    CH = CryptocurrenciesHelper
+
+    response = CH.build_response("BTC", 7540.35, 119.99, "B01MQWUXZS", 1346236702)
+    if ResponseRenderer().render(response) != JsonResponse(response).content:
+        sys.exit("ResponseRenderer output differs from JsonResponse")
+
+    cold = ResponseRenderer(max_entries=0)
+    memoized = ResponseRenderer()
+
+    def respond(renderer, response):
+        return HttpResponse(renderer.render(response), content_type="application/json").content
+
+    timings = [
+        ("JsonResponse(build_response(...))", lambda: JsonResponse(
+            CH.build_response("BTC", 7540.35, 119.99, "B01MQWUXZS", 1346236702)).content),
+        ("renderer, template only", lambda: respond(cold,
+            CH.build_response("BTC", 7540.35, 119.99, "B01MQWUXZS", 1346236702))),
+        ("renderer, memoized", lambda: respond(memoized,
+            CH.build_response("BTC", 7540.35, 119.99, "B01MQWUXZS", 1346236702))),
+        ("JsonResponse serialization only", lambda: JsonResponse(response).content),
+        ("renderer serialization only, template", lambda: respond(cold, response)),
+        ("renderer serialization only, memoized", lambda: respond(memoized, response)),
+    ]
+
+    print("%-40s %12s" % ("path", "us/response"))
+    for (name, func) in timings:
+        print("%-40s %12.2f" % (name, best_time(func, args.number) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+'''
+A local stand-in for cryptocompare and amazon, for load tests.
+
+Serves /data/price, /data/pricehistorical, /data/pricemulti,
+/data/histoday and /gp/product/<id> from the recorded fixtures in
+benchmarks/fixtures, after a configurable latency with random
+jitter. A configurable fraction of requests fails with a 503.
+GET /__stats returns the number of requests per path as JSON.
+
+Usage:
+    python benchmarks/fake_upstream.py [--port 8100] [--latency MS]
+        [--jitter MS] [--error-rate FRACTION]
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixture_http import FixtureUpstream
+
+
+class FakeUpstreamServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=0.0, jitter=0.0, error_rate=0.0):
+        HTTPServer.__init__(self, address, FakeUpstreamHandler)
+        self.upstream = FixtureUpstream()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = {}
+        self.errors = 0
+        self.stats_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://%s:%s" % self.server_address[:2]
+
+    def count(self, path, error):
+        with self.stats_lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+            if error:
+                self.errors += 1
+
+    def stats(self):
+        with self.stats_lock:
+            return dict(calls=dict(self.calls), total=sum(self.calls.values()), errors=self.errors)
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.calls = {}
+            self.errors = 0
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+
+        if parts.path == "/__stats":
+            return self.send(200, "application/json", json.dumps(self.server.stats()))
+
+        path = "/gp/product" if parts.path.startswith("/gp/product/") else parts.path
+        delay = self.server.latency + random.uniform(-self.server.jitter, self.server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        error = random.random() < self.server.error_rate
+        self.server.count(path, error)
+        if error:
+            return self.send(503, "text/plain", "Service Unavailable")
+
+        (status, content_type, body) = self.server.upstream.respond(parts.path, dict(parse_qsl(parts.query)))
+        self.send(status, content_type, body)
+
+    def send(self, status, content_type, body):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+'''
+Starts a FakeUpstreamServer in a daemon thread and
+returns it. Latency and jitter are in seconds.
+'''
+def start_fake_upstream(port=0, latency=0.0, jitter=0.0, error_rate=0.0):
+    server = FakeUpstreamServer(("127.0.0.1", port), latency, jitter, error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=100, help="milliseconds")
+    parser.add_argument("--jitter", type=float, default=50, help="milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeUpstreamServer(("127.0.0.1", args.port), args.latency / 1000.0,
+                                args.jitter / 1000.0, args.error_rate)
+    print("Fake upstream listening on %s" % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
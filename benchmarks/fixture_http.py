@@ -0,0 +1,126 @@
+'''
+Answers upstream requests from the recorded fixtures in
+benchmarks/fixtures, so benchmarks and load tests run offline.
+
+FixtureHttpClient stands in for CryptocurrenciesHelper.http.
+FixtureUpstream.respond is shared with the fake upstream
+server of the load test harness.
+'''
+import json
+import os
+import threading
+from urllib.parse import parse_qsl, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class FixtureUpstream():
+
+    MISSING_PRODUCT_IDS = ("AAAAAAAAAA",)
+    FIAT_RATES = {"USD" : 1.0, "EUR" : 0.92, "GBP" : 0.79}
+
+    def __init__(self, fixtures_dir=FIXTURES_DIR):
+        with open(os.path.join(fixtures_dir, "cryptocompare.json")) as f:
+            self.cryptocompare = json.load(f)
+        with open(os.path.join(fixtures_dir, "amazon_product_B003EM8008.html")) as f:
+            self.product_page = f.read()
+        with open(os.path.join(fixtures_dir, "amazon_product_AAAAAAAAAA.html")) as f:
+            self.missing_product_page = f.read()
+
+
+    '''
+    Returns (status, content_type, body) for an upstream
+    path and query dict, imitating cryptocompare's
+    /data/price, /data/pricehistorical, /data/pricemulti
+    and /data/histoday, and amazon's /gp/product/<id> pages.
+    '''
+    def respond(self, path, query):
+        fsym = query.get("fsym", "")
+
+        if path == "/data/price":
+            body = self.cryptocompare["price"].get(fsym)
+            if body is None:
+                body = dict(Response="Error", Message="There is no data for the symbol %s ." % fsym)
+            return (200, "application/json", json.dumps(body))
+
+        if path == "/data/pricehistorical":
+            body = self.cryptocompare["pricehistorical"].get(fsym)
+            if body is None:
+                body = dict(Response="Error", Message="There is no data for the symbol %s ." % fsym)
+            return (200, "application/json", json.dumps(body))
+
+        if path == "/data/pricemulti":
+            return (200, "application/json", json.dumps(self.pricemulti(query)))
+
+        if path == "/data/histoday":
+            return (200, "application/json", json.dumps(self.histoday(query)))
+
+        if path.startswith("/gp/product/"):
+            product_id = path[len("/gp/product/"):]
+            if product_id in self.MISSING_PRODUCT_IDS:
+                return (404, "text/html", self.missing_product_page)
+            return (200, "text/html", self.product_page)
+
+        return (404, "text/plain", "Not Found")
+
+
+    '''
+    Returns a pricemulti body for the fsyms and tsyms of
+    the query, converting the recorded USD prices with
+    fixed fiat rates.
+    '''
+    def pricemulti(self, query):
+        body = {}
+        for fsym in query.get("fsyms", "").split(","):
+            usd = self.cryptocompare["price"].get(fsym, {}).get("USD")
+            if usd is not None:
+                body[fsym] = dict((tsym, round(usd * self.FIAT_RATES[tsym], 2))
+                                  for tsym in query.get("tsyms", "").split(",") if tsym in self.FIAT_RATES)
+        return body
+
+
+    '''
+    Returns a histoday body with limit + 1 daily points
+    ending at toTs, cycling through the recorded closes.
+    '''
+    def histoday(self, query):
+        recorded = self.cryptocompare["histoday"]
+        closes = [point["close"] for point in recorded["Data"]]
+        to_timestamp = int(query.get("toTs", recorded["TimeTo"]))
+        to_timestamp -= to_timestamp % 86400
+        limit = int(query.get("limit", 30))
+
+        data = []
+        for days in range(limit, -1, -1):
+            timestamp = to_timestamp - days * 86400
+            data.append(dict(time=timestamp, close=closes[(timestamp // 86400) % len(closes)],
+                             high=0, low=0, open=0, volumefrom=0, volumeto=0))
+
+        return dict(recorded, TimeTo=to_timestamp, TimeFrom=data[0]["time"], Data=data)
+
+
+class FixtureResponse():
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.encoding = "utf-8"
+        self.content = text.encode(self.encoding)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FixtureHttpClient():
+
+    def __init__(self, upstream=None):
+        self.upstream = upstream or FixtureUpstream()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        with self._lock:
+            self.calls += 1
+        parts = urlsplit(url)
+        (status, content_type, body) = self.upstream.respond(parts.path, dict(parse_qsl(parts.query)))
+        return FixtureResponse(status, body)
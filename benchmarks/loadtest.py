@@ -0,0 +1,306 @@
+'''
+End-to-end load test of /playground/cryptocurrencies.
+
+Starts the fake upstream server (benchmarks/fake_upstream.py),
+migrates a scratch database, serves the app with gunicorn (or
+waitress, or a threaded wsgiref server if neither is installed)
+and drives concurrent traffic at it. Reports throughput,
+p50/p99 latency per query type, the response statuses and the
+number of upstream calls made during the run.
+
+The traffic mix is a comma separated list of query types with
+weights, from spot, dated, product, dated_product, range and
+fiat (a spot query in EUR or GBP).
+
+Usage:
+    python benchmarks/loadtest.py [--concurrency 16] [--duration 30]
+        [--requests N] [--mix spot=4,dated=3,product=2,dated_product=1]
+        [--latency MS] [--jitter MS] [--error-rate FRACTION]
+        [--server auto|gunicorn|waitress|wsgiref] [--workers 2] [--threads 8]
+        [--json results.json]
+'''
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fake_upstream import start_fake_upstream
+
+CURRENCIES = ["BTC", "LTC", "ETH"]
+PRODUCT_IDS = ["B0%08d" % n for n in range(50)]
+QUERY_TYPES = ("spot", "dated", "product", "dated_product", "range", "fiat")
+
+
+'''
+Returns random query parameters for a query type. Dates are
+drawn from a few years so that the database and the caches
+see both hits and misses.
+'''
+def make_query(query_type, rng):
+    today = datetime.date.today()
+
+    def random_date():
+        return (today - datetime.timedelta(days=rng.randint(1, 1500))).isoformat()
+
+    params = {"currency" : rng.choice(CURRENCIES)}
+    if query_type in ("dated", "dated_product"):
+        params["date"] = random_date()
+    if query_type == "fiat":
+        params["fiat"] = rng.choice(["EUR", "GBP"])
+    if query_type in ("product", "dated_product", "range"):
+        params["amz_product_id"] = rng.choice(PRODUCT_IDS)
+    if query_type == "range":
+        end = today - datetime.timedelta(days=rng.randint(1, 1500))
+        params["start"] = (end - datetime.timedelta(days=rng.randint(7, 90))).isoformat()
+        params["end"] = end.isoformat()
+    return params
+
+
+def parse_mix(text):
+    mix = []
+    for item in text.split(","):
+        (query_type, _, weight) = item.partition("=")
+        query_type = query_type.strip()
+        if query_type not in QUERY_TYPES:
+            raise argparse.ArgumentTypeError("unknown query type '%s'" % query_type)
+        mix.append((query_type, float(weight or 1)))
+    return mix
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+'''
+Returns the command that serves the app on the port with
+the requested server, falling back from gunicorn to waitress
+to a threaded wsgiref server.
+'''
+def server_command(server, port, workers, threads):
+    if server == "auto":
+        server = "gunicorn" if installed("gunicorn") else "waitress" if installed("waitress") else "wsgiref"
+        if server == "wsgiref":
+            print("warning: neither gunicorn nor waitress is installed, "
+                  "serving with wsgiref; results will not match production")
+
+    if server == "gunicorn":
+        return (server, [sys.executable, "-m", "gunicorn", "currencies.wsgi:application",
+                         "--bind", "127.0.0.1:%d" % port, "--workers", str(workers),
+                         "--worker-class", "gthread", "--threads", str(threads),
+                         "--backlog", "2048", "--log-level", "warning"])
+    if server == "waitress":
+        return (server, [sys.executable, "-m", "waitress", "--listen=127.0.0.1:%d" % port,
+                         "--threads=%d" % threads, "--backlog=2048", "currencies.wsgi:application"])
+    return (server, [sys.executable, os.path.abspath(__file__), "--serve-wsgiref", str(port)])
+
+
+'''
+Serves the app with a threaded wsgiref server; only used
+when no production WSGI server is installed.
+'''
+def serve_wsgiref(port):
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+    from currencies.wsgi import application
+
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+        request_queue_size = 2048
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    make_server("127.0.0.1", port, application, ThreadingWSGIServer, QuietHandler).serve_forever()
+
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit("the app server exited with status %s" % process.returncode)
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    sys.exit("the app server did not start within %s seconds" % timeout)
+
+
+'''
+Sends requests from `concurrency` threads until the duration
+has passed or `total` requests were sent, and returns
+(elapsed, samples) with one (query_type, status, latency)
+sample per request. A status of None is a client error.
+'''
+def drive(url, mix, concurrency, duration, total, seed):
+    samples = []
+    samples_lock = threading.Lock()
+    remaining = [total]
+    deadline = time.perf_counter() + duration
+    query_types = [query_type for (query_type, _) in mix]
+    weights = [weight for (_, weight) in mix]
+
+    def take():
+        if time.perf_counter() >= deadline:
+            return False
+        if total is None:
+            return True
+        with samples_lock:
+            remaining[0] -= 1
+            return remaining[0] >= 0
+
+    def run(worker):
+        rng = random.Random(seed + worker)
+        session = requests.Session()
+        local = []
+        while take():
+            query_type = rng.choices(query_types, weights)[0]
+            params = make_query(query_type, rng)
+            start = time.perf_counter()
+            try:
+                status = session.get(url, params=params, timeout=60).status_code
+            except requests.RequestException:
+                status = None
+            local.append((query_type, status, time.perf_counter() - start))
+        with samples_lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=run, args=(worker,)) for worker in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (time.perf_counter() - start, samples)
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = (len(sorted_values) - 1) * percent / 100.0
+    lower = int(index)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (index - lower)
+
+
+def summarize(elapsed, samples, upstream_stats):
+    def latency_summary(latencies):
+        latencies = sorted(latencies)
+        return dict(requests=len(latencies), p50_ms=percentile(latencies, 50) * 1000,
+                    p99_ms=percentile(latencies, 99) * 1000)
+
+    by_type = {}
+    statuses = {}
+    for (query_type, status, latency) in samples:
+        by_type.setdefault(query_type, []).append(latency)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    return dict(
+        elapsed=elapsed,
+        requests=len(samples),
+        throughput=len(samples) / elapsed if elapsed else 0.0,
+        latency=latency_summary(latency for (_, _, latency) in samples),
+        latency_by_type=dict((query_type, latency_summary(latencies))
+                             for (query_type, latencies) in by_type.items()),
+        statuses=statuses,
+        upstream=upstream_stats,
+    )
+
+
+def report(summary):
+    print("\n%d requests in %.1fs: %.1f requests/sec" % (summary["requests"], summary["elapsed"],
+                                                        summary["throughput"]))
+    print("\n%-16s %10s %10s %10s" % ("query type", "requests", "p50 (ms)", "p99 (ms)"))
+    rows = sorted(summary["latency_by_type"].items()) + [("all", summary["latency"])]
+    for (query_type, latency) in rows:
+        print("%-16s %10d %10.1f %10.1f" % (query_type, latency["requests"], latency["p50_ms"],
+                                           latency["p99_ms"]))
+    print("\nstatuses: %s" % ", ".join("%s=%d" % item for item in sorted(summary["statuses"].items())))
+    upstream = summary["upstream"]
+    print("upstream calls: %d (%s), injected errors: %d" % (
+        upstream["total"], ", ".join("%s=%d" % item for item in sorted(upstream["calls"].items())),
+        upstream["errors"]))
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--serve-wsgiref":
+        return serve_wsgiref(int(sys.argv[2]))
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("spot=4,dated=3,product=2,dated_product=1"))
+    parser.add_argument("--latency", type=float, default=100, help="upstream latency in milliseconds")
+    parser.add_argument("--jitter", type=float, default=50, help="upstream jitter in milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls that fail")
+    parser.add_argument("--server", choices=("auto", "gunicorn", "waitress", "wsgiref"), default="auto")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="threads per worker")
+    parser.add_argument("--settings", default="loadtest_settings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    upstream = start_fake_upstream(latency=args.latency / 1000.0, jitter=args.jitter / 1000.0,
+                                   error_rate=args.error_rate)
+    scratch = tempfile.mkdtemp(prefix="playground-loadtest-")
+    env = dict(os.environ,
+               DJANGO_SETTINGS_MODULE=args.settings,
+               PYTHONPATH=os.pathsep.join([REPO_DIR, BENCHMARKS_DIR, os.environ.get("PYTHONPATH", "")]),
+               PLAYGROUND_LOADTEST_UPSTREAM=upstream.url,
+               PLAYGROUND_LOADTEST_DB=os.path.join(scratch, "db.sqlite3"))
+
+    subprocess.check_call([sys.executable, os.path.join(REPO_DIR, "manage.py"), "migrate", "-v", "0"],
+                          env=env, cwd=REPO_DIR)
+
+    port = free_port()
+    (server, command) = server_command(args.server, port, args.workers, args.threads)
+    print("serving the app with %s on port %d, upstream at %s" % (server, port, upstream.url))
+    process = subprocess.Popen(command, env=env, cwd=REPO_DIR)
+
+    try:
+        wait_until_up("http://127.0.0.1:%d/playground/" % port, process)
+        upstream.reset_stats()
+        (elapsed, samples) = drive("http://127.0.0.1:%d/playground/cryptocurrencies" % port, args.mix,
+                                   args.concurrency, args.duration, args.requests, args.seed)
+    finally:
+        process.terminate()
+        process.wait()
+        upstream.shutdown()
+
+    summary = summarize(elapsed, samples, upstream.stats())
+    summary["config"] = dict(vars(args), server=server, mix=dict(args.mix))
+    report(summary)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+'''
+Settings for running the app under load tests.
+
+Upstream calls go to the fake upstream server at
+PLAYGROUND_LOADTEST_UPSTREAM, and the database is a scratch
+sqlite file at PLAYGROUND_LOADTEST_DB. Both are set by
+benchmarks/loadtest.py.
+'''
+import os
+
+from currencies.settings import *
+
+DEBUG = False
+
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get("PLAYGROUND_LOADTEST_DB", os.path.join(BASE_DIR, 'loadtest.sqlite3')),
+    }
+}
+
+PLAYGROUND_CRYPTOCOMPARE_URL = os.environ.get("PLAYGROUND_LOADTEST_UPSTREAM", "http://127.0.0.1:8100")
+
+PLAYGROUND_AMAZON_URL = PLAYGROUND_CRYPTOCOMPARE_URL
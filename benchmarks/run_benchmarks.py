@@ -0,0 +1,214 @@
+'''
+Microbenchmarks for the hot paths of CryptocurrenciesHelper.
+
+Runs offline: upstream calls are answered from the recorded
+fixtures in benchmarks/fixtures. Each benchmark runs `rounds`
+batches of `inner` calls and reports ops/sec over all calls.
+The p50/p90/p99 figures are round mean percentiles: the
+percentiles, over rounds, of the mean latency of a call in
+each round. They show how steady rounds are, not how slow
+single calls get, since a slow call is averaged with the
+others of its round.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--json results.json]
+        [--compare baseline.json] [--threshold 0.1] [--only NAME ...]
+
+With --compare, each result is compared with the same
+benchmark in an earlier results file; the exit status is 1
+if any benchmark got slower by more than --threshold.
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from unittest import mock
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "currencies.settings")
+
+import django
+django.setup()
+
+from django.core.cache import caches
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from fixture_http import FixtureHttpClient
+from playground.helpers.amazon_parser import AmazonPriceParser
+from playground.helpers.cryptocurrencies_helper import CryptocurrenciesHelper
+
+
+'''
+Returns the result of one benchmark: func is called
+inner times per round, for the given number of rounds,
+after a few warmup rounds. The percentiles are taken
+over the mean latency of a call in each round.
+'''
+def measure(func, rounds, inner, warmup=3):
+    for _ in range(warmup):
+        for _ in range(inner):
+            func()
+
+    latencies = []
+    total = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(inner):
+            func()
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        latencies.append(elapsed / inner)
+
+    latencies.sort()
+    return dict(
+        ops_per_sec=rounds * inner / total,
+        mean_us=total / (rounds * inner) * 1e6,
+        round_p50_us=percentile(latencies, 50) * 1e6,
+        round_p90_us=percentile(latencies, 90) * 1e6,
+        round_p99_us=percentile(latencies, 99) * 1e6,
+        rounds=rounds,
+        inner=inner,
+    )
+
+
+def percentile(sorted_values, percent):
+    index = (len(sorted_values) - 1) * percent / 100.0
+    lower = int(index)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (index - lower)
+
+
+def clear_caches():
+    CH = CryptocurrenciesHelper
+    CH.spot_price_cache.clear()
+    CH.product_price_cache.clear()
+    CH.renderer.clear()
+    caches["default"].clear()
+
+
+'''
+Returns the benchmarks as (name, func, rounds, inner).
+'''
+def benchmarks(client):
+    CH = CryptocurrenciesHelper
+
+    params = {"currency" : "BTC", "amz_product_id" : "B003EM8008", "date" : "2015-08-12"}
+    response = CH.build_response("BTC", 7540.35, 119.99, "B01MQWUXZS", 1346236702)
+    with open(os.path.join(BENCHMARKS_DIR, "fixtures", "amazon_product_B003EM8008.html")) as f:
+        product_page = f.read()
+
+    def view_cold():
+        clear_caches()
+        return client.get("/playground/cryptocurrencies", params)
+
+    return [
+        ("handle_request_params", lambda: CH.handle_request_params(params), 200, 2000),
+        ("get_date_timestamp_from_request", lambda: CH.get_date_timestamp_from_request(params), 200, 500),
+        ("compare_currency_value_and_product_price",
+         lambda: CH.compare_currency_value_and_product_price("BTC", 7540.35, 119.99, 1346236702), 200, 2000),
+        ("build_response",
+         lambda: CH.build_response("BTC", 7540.35, 119.99, "B01MQWUXZS", 1346236702), 200, 1000),
+        ("render_response", lambda: CH.renderer.render(response), 200, 2000),
+        ("amazon_price_parse_fast", lambda: AmazonPriceParser.find_price_string(product_page), 50, 5),
+        ("amazon_price_parse_full", lambda: AmazonPriceParser.find_price_string_full(product_page), 20, 1),
+        ("cryptocurrencies_view_warm",
+         lambda: client.get("/playground/cryptocurrencies", params), 100, 20),
+        ("cryptocurrencies_view_cold", view_cold, 50, 5),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+'''
+Prints the comparison of results with a baseline and
+returns the names of the benchmarks that regressed.
+'''
+def compare(results, baseline, threshold):
+    regressions = []
+    print("\n%-42s %14s %14s %9s" % ("benchmark", "baseline op/s", "current op/s", "change"))
+    for (name, result) in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = result["ops_per_sec"] / before["ops_per_sec"] - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("%-42s %14.1f %14.1f %+8.1f%%%s" % (name, before["ops_per_sec"],
+                                                  result["ops_per_sec"], change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="compare with the results in this file")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown (as a fraction of ops/sec) counted as a regression")
+    parser.add_argument("--only", nargs="*", help="run only these benchmarks")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+
+    http = FixtureHttpClient()
+    results = {}
+    try:
+        with mock.patch.object(CryptocurrenciesHelper, "http", http):
+            print("%-42s %12s %14s %14s %14s" % ("benchmark", "ops/sec", "round p50 (us)",
+                                                 "round p90 (us)", "round p99 (us)"))
+            for (name, func, rounds, inner) in benchmarks(Client()):
+                if args.only and name not in args.only:
+                    continue
+                clear_caches()
+                result = measure(func, rounds, inner)
+                results[name] = result
+                print("%-42s %12.1f %14.2f %14.2f %14.2f" % (name, result["ops_per_sec"], result["round_p50_us"],
+                                                             result["round_p90_us"], result["round_p99_us"]))
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+    output = dict(
+        meta=dict(
+            commit=git_commit(),
+            date=datetime.datetime.utcnow().isoformat() + "Z",
+            python=platform.python_version(),
+            django=django.get_version(),
+            platform=platform.platform(),
+        ),
+        results=results,
+    )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+"""
+ASGI config for currencies project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+Serving the project over ASGI requires Django 3.0 or later, and the
+async cryptocurrencies view requires Django 3.1 or later.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "currencies.settings")
+
+application = get_asgi_application()
@@ -37,7 +37,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'playground'
+    'playground.apps.PlaygroundConfig',
 ]
 
 MIDDLEWARE = [
@@ -119,3 +119,237 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.11/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Spot price cache
+# Seconds a cached spot price is served as fresh, and seconds it may
+# then be served stale while a background refresh runs.
+
+PLAYGROUND_SPOT_PRICE_TTL = 30
+
+PLAYGROUND_SPOT_PRICE_STALE_TTL = 300
+
+
+# Upstream HTTP client
+# Connections kept alive per upstream host, and (connect, read)
+# timeouts in seconds applied to every upstream call. With
+# PLAYGROUND_HTTP_POOL_BLOCK, callers wait for a free connection
+# instead of opening extra ones beyond the pool size.
+
+PLAYGROUND_HTTP_POOL_MAXSIZE = 10
+
+PLAYGROUND_HTTP_POOL_BLOCK = False
+
+PLAYGROUND_HTTP_CONNECT_TIMEOUT = 3.05
+
+PLAYGROUND_HTTP_READ_TIMEOUT = 10
+
+
+# Amazon product price cache
+# Seconds a found price is cached, seconds a failed lookup is
+# cached, and the most ASINs kept before evicting the least
+# recently used one.
+
+PLAYGROUND_PRODUCT_PRICE_TTL = 3600
+
+PLAYGROUND_PRODUCT_PRICE_NEGATIVE_TTL = 60
+
+PLAYGROUND_PRODUCT_PRICE_MAX_ENTRIES = 1024
+
+
+# Amazon price extraction
+# When enabled, only the price element of a product page is parsed;
+# the full-page html.parser parse is kept as a fallback.
+
+PLAYGROUND_AMAZON_FAST_PARSE = True
+
+
+# Upstream fetch concurrency
+# Threads used to fetch the currency value and the product price
+# at the same time.
+
+PLAYGROUND_UPSTREAM_WORKERS = 10
+
+
+# Batch endpoint
+# Most queries accepted in one batch, and threads used to run the
+# distinct upstream lookups of a batch concurrently.
+
+PLAYGROUND_BATCH_MAX_QUERIES = 100
+
+PLAYGROUND_BATCH_WORKERS = 8
+
+
+# Date range series
+# Most days a start/end request may span.
+
+PLAYGROUND_RANGE_MAX_DAYS = 3660
+
+
+# Price prewarmer
+# Seconds between background refreshes of each cached price, the
+# random jitter applied to them (as a fraction of the interval), and
+# the longest backoff after repeated failures. The cached prices live
+# in the memory of each process, so the prewarmer runs inside every
+# process serving the app, when PLAYGROUND_PREWARM_ON_STARTUP is set.
+# It is not started by other management commands, like migrate or test.
+
+PLAYGROUND_PREWARM_INTERVAL = 20
+
+PLAYGROUND_PREWARM_JITTER = 0.1
+
+PLAYGROUND_PREWARM_MAX_BACKOFF = 300
+
+# Seconds between refreshes of each product price. By default, a bit
+# less than PLAYGROUND_PRODUCT_PRICE_TTL, so every page is scraped
+# about once per TTL.
+
+PLAYGROUND_PREWARM_PRODUCT_INTERVAL = None
+
+PLAYGROUND_PREWARM_ON_STARTUP = False
+
+
+# Response rendering
+# JSON encoder for responses that are not rendered from a template:
+# "json" matches JsonResponse byte for byte, "orjson" is faster (if
+# installed) but compact. Rendered bodies are memoized up to
+# PLAYGROUND_RENDERED_BODIES_MAX_ENTRIES.
+
+PLAYGROUND_JSON_ENCODER = "json"
+
+PLAYGROUND_RENDERED_BODIES_MAX_ENTRIES = 4096
+
+
+# HTTP caching of the cryptocurrencies endpoint
+# Cache-Control max-age, in seconds, for answers about the current
+# price and for answers about a given product on past dates. Set PLAYGROUND_RESPONSE_CACHE
+# to an alias in CACHES to also keep rendered responses server-side.
+
+PLAYGROUND_SPOT_MAX_AGE = 30
+
+PLAYGROUND_DATED_MAX_AGE = 86400
+
+PLAYGROUND_RESPONSE_CACHE = None
+
+
+# Upstream price sources
+# Base URLs of cryptocompare and amazon. The load test harness points
+# these at a local stand-in server.
+
+PLAYGROUND_CRYPTOCOMPARE_URL = "https://min-api.cryptocompare.com"
+
+PLAYGROUND_AMAZON_URL = "https://www.amazon.com"
+
+
+# Upstream failure isolation
+# Each upstream host has a circuit breaker: when at least
+# PLAYGROUND_BREAKER_FAILURE_RATE of the calls in the last
+# PLAYGROUND_BREAKER_WINDOW seconds failed (and there were at least
+# PLAYGROUND_BREAKER_MIN_CALLS), calls fail fast for
+# PLAYGROUND_BREAKER_OPEN_SECONDS, then PLAYGROUND_BREAKER_HALF_OPEN_TRIALS
+# calls are let through to probe it. Failed calls are retried up to
+# PLAYGROUND_HTTP_MAX_RETRIES times, but retries are limited to
+# PLAYGROUND_RETRY_BUDGET_RATIO of the calls, plus
+# PLAYGROUND_RETRY_BUDGET_MIN_PER_SECOND.
+
+PLAYGROUND_BREAKER_FAILURE_RATE = 0.5
+
+PLAYGROUND_BREAKER_MIN_CALLS = 20
+
+PLAYGROUND_BREAKER_WINDOW = 30
+
+PLAYGROUND_BREAKER_OPEN_SECONDS = 30
+
+PLAYGROUND_BREAKER_HALF_OPEN_TRIALS = 3
+
+PLAYGROUND_HTTP_MAX_RETRIES = 1
+
+PLAYGROUND_RETRY_BUDGET_RATIO = 0.1
+
+PLAYGROUND_RETRY_BUDGET_MIN_PER_SECOND = 1
+
+
+# Cryptocurrency price providers
+# Sources of currency values, in order of preference, from
+# "cryptocompare", "coinbase" and "fake" (fixed prices, no network).
+# Each one's base URL is PLAYGROUND_<NAME>_URL. With
+# PLAYGROUND_PRICE_HEDGE_DELAY set, a lookup the first provider has
+# not answered within that many seconds is also sent to the next
+# one, and the first valid answer wins; otherwise the next provider
+# is only tried after a failure. Daily histories for date ranges
+# always come from cryptocompare.
+
+PLAYGROUND_PRICE_PROVIDERS = ["cryptocompare"]
+
+PLAYGROUND_COINBASE_URL = "https://api.coinbase.com"
+
+PLAYGROUND_PRICE_HEDGE_DELAY = 0.5
+
+PLAYGROUND_PRICE_HEDGE_WORKERS = 10
+
+
+# Affordability exports
+# Most products an export may have; each one adds a row per currency
+# and day. Exports are streamed, so their date range is not limited.
+
+PLAYGROUND_EXPORT_MAX_PRODUCTS = 20
+
+
+# Product catalog
+# Seconds before the in-memory copy of the Product table, used for
+# random products and affordable queries, is reloaded. Products are
+# added with `manage.py load_products`.
+
+PLAYGROUND_PRODUCT_CATALOG_MAX_AGE = 300
+
+
+# Units queries
+# First day of the daily price series that units queries search.
+# The series is read from the HistoricalPrice table (fetching any
+# missing days once) and indexed in memory until the next day.
+
+PLAYGROUND_SERIES_START = "2010-07-17"
+
+
+# Price tracker
+# ASINs whose amazon price is scraped every PLAYGROUND_TRACKER_INTERVAL
+# seconds by a pool of PLAYGROUND_TRACKER_WORKERS threads, taking jobs
+# from a queue of at most PLAYGROUND_TRACKER_QUEUE_SIZE, and sending
+# at most PLAYGROUND_TRACKER_RATE_PER_HOST requests per second to each
+# host (bursts of PLAYGROUND_TRACKER_BURST). Requests use tracked prices
+# up to PLAYGROUND_TRACKED_PRICE_MAX_AGE seconds old instead of scraping.
+# The tracker runs with `manage.py track_prices`, or in every process
+# serving the app (not in migrate, test or other management commands)
+# when PLAYGROUND_TRACK_ON_STARTUP is set.
+
+PLAYGROUND_TRACKED_PRODUCTS = ["B01MQWUXZS", "B00EMKLSSM", "B06XDP7B71", "B01LMHI37Q", "B01J24C0TI"]
+
+PLAYGROUND_TRACKER_INTERVAL = 3600
+
+PLAYGROUND_TRACKER_WORKERS = 4
+
+PLAYGROUND_TRACKER_QUEUE_SIZE = 100
+
+PLAYGROUND_TRACKER_RATE_PER_HOST = 1.0
+
+PLAYGROUND_TRACKER_BURST = 1
+
+PLAYGROUND_TRACKED_PRICE_MAX_AGE = 86400
+
+PLAYGROUND_TRACK_ON_STARTUP = False
+
+
+# Amazon page parsing
+# Number of worker processes that read prices out of amazon pages, so
+# parsing does not hold the GIL of the serving threads; 0 parses in
+# the requesting thread. When PLAYGROUND_PARSER_MAX_PENDING pages
+# (the number of processes by default) are already being parsed, the
+# next one is parsed in its thread. With PLAYGROUND_PARSER_WARM_START,
+# the workers are started and warmed up when a process serving the
+# app loads.
+
+PLAYGROUND_PARSER_PROCESSES = 0
+
+PLAYGROUND_PARSER_MAX_PENDING = None
+
+PLAYGROUND_PARSER_WARM_START = True
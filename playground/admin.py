@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import HistoricalPrice
+
+
+@admin.register(HistoricalPrice)
+class HistoricalPriceAdmin(admin.ModelAdmin):
+    list_display = ("currency", "day", "usd")
+    list_filter = ("currency",)
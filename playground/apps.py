@@ -1,5 +1,48 @@
+import os
+import sys
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
+
+
+'''
+Returns whether the running process serves requests: a WSGI
+or ASGI server, or the process of runserver that handles
+requests, rather than its autoreloader or another management
+command like migrate or test.
+'''
+def serving_requests(argv=None, environ=None):
+    argv = sys.argv if argv is None else argv
+    environ = os.environ if environ is None else environ
+
+    program = os.path.basename(argv[0]) if argv else ""
+    if program not in ("manage.py", "django-admin", "django-admin.py"):
+        return True
+
+    if len(argv) < 2 or argv[1] != "runserver":
+        return False
+
+    return "--noreload" in argv or environ.get("RUN_MAIN") == "true"
 
 
 class PlaygroundConfig(AppConfig):
     name = 'playground'
+
+    def ready(self):
+        if not serving_requests():
+            return
+
+        if getattr(settings, "PLAYGROUND_PREWARM_ON_STARTUP", False):
+            from .helpers.price_prewarmer import PricePrewarmer
+            PricePrewarmer.shared().start()
+
+        if getattr(settings, "PLAYGROUND_TRACK_ON_STARTUP", False):
+            from .helpers.price_tracker import PriceTracker
+            PriceTracker.shared().start()
+
+        if getattr(settings, "PLAYGROUND_PARSER_PROCESSES", 0) and \
+           getattr(settings, "PLAYGROUND_PARSER_WARM_START", True):
+            from .helpers.cryptocurrencies_helper import CryptocurrenciesHelper
+            threading.Thread(target=CryptocurrenciesHelper.parser_pool.start,
+                             name="parser-pool-start", daemon=True).start()
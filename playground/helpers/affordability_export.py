@@ -0,0 +1,203 @@
+import csv
+import datetime
+import io
+import json
+import time
+
+from django.conf import settings
+
+from .bulk_affordability import BulkAffordability
+from .cryptocurrencies_helper import CryptocurrenciesHelper
+
+
+'''
+Defines a streamed export of affordability series.
+
+An export has one row per (currency, day, product) from start
+to end, in that order, as NDJSON or CSV. Rows are produced by
+a generator: the history of each currency is read one page of
+HISTODAY_PAGE_SIZE days at a time through get_currency_history,
+so the database, upstream and the client all see one page at
+a time, memory use does not depend on the size of the range,
+and the first rows go out as soon as the first page is ready.
+
+Product prices are looked up before streaming starts, so
+invalid requests still get a regular error response. Without
+amz_product_id, the export covers RANDOM_PRODUCTS at the
+prices the product catalog already knows, so it never waits
+on amazon. If a
+page of history cannot be loaded mid-stream, an error line is
+written and the stream ends.
+'''
+
+class AffordabilityExport():
+
+    FORMATS = {"ndjson" : "application/x-ndjson", "csv" : "text/csv"}
+    FIELDS = ("currency", "date", "amz_product_id", "product_price", "currency_value", "units", "change")
+
+    def __init__(self, currencies, start_day, end_day, products, format="ndjson"):
+        self.currencies = currencies
+        self.start_day = start_day
+        self.end_day = end_day
+        self.products = products
+        self.format = format
+
+
+    @property
+    def content_type(self):
+        return AffordabilityExport.FORMATS[self.format]
+
+
+    '''
+    Builds an export from the request parameters:
+    currency (one or more, repeated or comma separated),
+    start, end, amz_product_id (optional, one or more;
+    every product in RANDOM_PRODUCTS, at its known
+    price, by default) and
+    format (ndjson or csv).
+
+    Returns (export, msg); export is None on error.
+    '''
+    @staticmethod
+    def from_request(params):
+        CH = CryptocurrenciesHelper
+        AE = AffordabilityExport
+
+        currencies = AE.get_list(params, "currency")
+        if not currencies:
+            return (None, "The only parameter required is currency. Ex(currency=BTC)")
+
+        for currency in currencies:
+            (currency, msg) = CH.get_currency_from_request(dict(currency=currency))
+            if currency == None:
+                return (None, msg)
+
+        (start_timestamp, msg) = CH.get_date_timestamp_from_request(params, "start")
+        if start_timestamp == None:
+            return (None, msg)
+
+        (end_timestamp, msg) = CH.get_date_timestamp_from_request(params, "end")
+        if end_timestamp == None:
+            return (None, msg)
+
+        if start_timestamp > end_timestamp:
+            return (None, "The start date cannot be after the end date.")
+
+        (fiat, msg) = CH.get_fiat_from_request(params, dated=True)
+        if fiat == None:
+            return (None, msg)
+
+        format = params.get("format", "ndjson")
+        if format not in AE.FORMATS:
+            return (None, "The format must be one of: %s" % ", ".join(sorted(AE.FORMATS)))
+
+        product_ids = AE.get_list(params, "amz_product_id")
+        max_products = getattr(settings, "PLAYGROUND_EXPORT_MAX_PRODUCTS", 20)
+        if len(product_ids) > max_products:
+            return (None, "An export can have at most %s products." % max_products)
+
+        if product_ids:
+            products = []
+            for (product_price, amz_product_id, msg) in CH.batch_executor.map(CH.metrics.bind(CH.get_amz_product_price), product_ids):
+                if product_price == None:
+                    return (None, msg)
+                products.append((amz_product_id, product_price))
+        else:
+            products = sorted(CH.product_catalog.known_prices(CH.RANDOM_PRODUCTS).items())
+
+        return (AE(currencies,
+                   datetime.date.fromtimestamp(start_timestamp),
+                   datetime.date.fromtimestamp(end_timestamp),
+                   products,
+                   format), "")
+
+
+    '''
+    Returns the values of a parameter, which can be
+    repeated or comma separated, without duplicates.
+    '''
+    @staticmethod
+    def get_list(params, key):
+        if hasattr(params, "getlist"):
+            raw = params.getlist(key)
+        else:
+            raw = [params[key]] if key in params else []
+
+        values = []
+        for value in raw:
+            for item in str(value).split(","):
+                item = item.strip()
+                if item and item not in values:
+                    values.append(item)
+        return values
+
+
+    '''
+    Yields the export as text chunks: the CSV header, then
+    the rows of each page of each currency.
+    '''
+    def stream(self):
+        if self.format == "csv":
+            yield self.encode_csv([AffordabilityExport.FIELDS])
+
+        for currency in self.currencies:
+            for (history, msg) in self.pages(currency):
+                if history == None:
+                    yield self.encode_error(msg)
+                    return
+                yield self.encode(self.rows(currency, history))
+
+
+    '''
+    Yields (history, msg) for each page of HISTODAY_PAGE_SIZE
+    days of a currency, as returned by get_currency_history.
+    '''
+    def pages(self, currency):
+        CH = CryptocurrenciesHelper
+
+        page_start = self.start_day
+        while page_start <= self.end_day:
+            page_end = min(page_start + datetime.timedelta(days=CH.HISTODAY_PAGE_SIZE - 1), self.end_day)
+            yield CH.get_currency_history(currency,
+                                          time.mktime(page_start.timetuple()),
+                                          time.mktime(page_end.timetuple()))
+            page_start = page_end + datetime.timedelta(days=1)
+
+
+    '''
+    Returns the rows for a page of (timestamp, value)
+    history, ordered by day and then by product.
+    '''
+    def rows(self, currency, history):
+        days = [str(datetime.date.fromtimestamp(timestamp)) for (timestamp, value) in history]
+        values = [value for (timestamp, value) in history]
+
+        columns = []
+        for (amz_product_id, product_price) in self.products:
+            results = BulkAffordability.results(currency, values, product_price, with_messages=False)
+            columns.append((amz_product_id, product_price, results))
+
+        rows = []
+        for (index, (day, value)) in enumerate(zip(days, values)):
+            for (amz_product_id, product_price, results) in columns:
+                (units, change, _) = results[index]
+                rows.append((currency, day, amz_product_id, product_price, value, units, change))
+        return rows
+
+
+    def encode(self, rows):
+        if self.format == "csv":
+            return self.encode_csv(rows)
+        return "".join(json.dumps(dict(zip(AffordabilityExport.FIELDS, row))) + "\n" for row in rows)
+
+
+    def encode_csv(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        return buffer.getvalue()
+
+
+    def encode_error(self, msg):
+        if self.format == "csv":
+            return "# error: %s\n" % msg
+        return json.dumps(dict(msg=msg, response="error")) + "\n"
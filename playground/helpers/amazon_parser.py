@@ -0,0 +1,129 @@
+import os
+import re
+
+from bs4 import BeautifulSoup as bs
+
+
+'''
+Defines how the price is read from an amazon product page.
+
+The fast path locates the price element with a regular
+expression and only hands that element's markup to
+BeautifulSoup, instead of building a tree for the whole
+multi-hundred-KB page. If the element cannot be located that
+way, the full html.parser parse is used as a fallback.
+'''
+
+class AmazonPriceParser():
+
+    PRICE_ELEMENT_ID = "priceblock_ourprice"
+
+    PRICE_ELEMENT_PATTERN = re.compile(
+        r"""<([a-zA-Z][a-zA-Z0-9]*)\b[^>]*?\sid\s*=\s*(["']?)priceblock_ourprice\2[\s/>]""")
+
+
+    '''
+    Returns the text of the price element of the page,
+    ex: "$8.39", or None if the page has no price element.
+    '''
+    @staticmethod
+    def find_price_string(html, fast=True):
+        APP = AmazonPriceParser
+
+        if APP.PRICE_ELEMENT_ID not in html:
+            return None
+
+        if fast:
+            price_string = APP.find_price_string_fast(html)
+            if price_string is not None:
+                return price_string
+
+        return APP.find_price_string_full(html)
+
+
+    '''
+    Like find_price_string, but takes the page as raw bytes
+    in the given encoding. This is what ParserPool runs in
+    its worker processes, so only the bytes and the price
+    string cross the process boundary.
+    '''
+    @staticmethod
+    def find_price_string_in_bytes(content, encoding=None, fast=True):
+        html = content.decode(encoding or "utf-8", errors="replace")
+
+        return AmazonPriceParser.find_price_string(html, fast)
+
+
+    '''
+    Parses a small page, so that a worker process has
+    imported and initialized BeautifulSoup before the first
+    real page arrives. Returns the process id.
+    '''
+    @staticmethod
+    def warm_up():
+        bs('<span id="%s">$0.00</span>' % AmazonPriceParser.PRICE_ELEMENT_ID, 'html.parser')
+
+        return os.getpid()
+
+
+    '''
+    Returns the text of the price element by parsing only
+    the element's own markup, or None if it could not be
+    located.
+    '''
+    @staticmethod
+    def find_price_string_fast(html):
+        APP = AmazonPriceParser
+
+        match = APP.PRICE_ELEMENT_PATTERN.search(html)
+        if match is None:
+            return None
+
+        end = APP.find_element_end(html, match.group(1), match.start())
+        if end is None:
+            return None
+
+        element = bs(html[match.start():end], 'html.parser').find(id=APP.PRICE_ELEMENT_ID)
+        if element is None:
+            return None
+
+        return element.get_text()
+
+
+    '''
+    Returns the text of the price element by parsing the
+    whole page, or None if it has no price element.
+    '''
+    @staticmethod
+    def find_price_string_full(html):
+        APP = AmazonPriceParser
+
+        element = bs(html, 'html.parser').find(id=APP.PRICE_ELEMENT_ID)
+        if element is None:
+            return None
+
+        return element.get_text()
+
+
+    '''
+    Given the name and start offset of an element, returns
+    the offset just past its matching closing tag, taking
+    nested elements with the same name into account.
+
+    Returns None if the closing tag is missing.
+    '''
+    @staticmethod
+    def find_element_end(html, tag, start):
+        tags = re.compile(r"<(/?)%s\b[^>]*>" % re.escape(tag), re.IGNORECASE)
+
+        depth = 0
+        for match in tags.finditer(html, start):
+            if match.group(1):
+                depth -= 1
+            elif not match.group(0).endswith("/>"):
+                depth += 1
+
+            if depth == 0:
+                return match.end()
+
+        return None
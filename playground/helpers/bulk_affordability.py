@@ -0,0 +1,206 @@
+import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+'''
+Defines a vectorized version of
+CryptocurrenciesHelper.compare_currency_value_and_product_price
+for many (currency_value, product_price) pairs at once.
+
+Results are rounded exactly like the scalar function. When
+NumPy is not installed, the same results are computed with
+plain Python loops.
+'''
+
+class BulkAffordability():
+
+    '''
+    Given sequences of currency values and product prices
+    (or a scalar for either), returns (units, change,
+    units_needed) as arrays, or lists without NumPy:
+
+    - units: whole units that can be bought when the
+    currency value covers the product price, otherwise
+    the fraction of a unit, rounded to 2 decimals.
+    - change: the spare change, rounded to 2 decimals,
+    or 0 when not even one unit can be bought.
+    - units_needed: units of the currency needed to buy
+    one unit of the product, rounded to 10 decimals, or
+    NaN when at least one unit can be bought or the
+    currency was worth nothing.
+    '''
+    @staticmethod
+    def compare(currency_values, product_prices):
+        BA = BulkAffordability
+
+        if np is None:
+            return BA.compare_without_numpy(currency_values, product_prices)
+
+        (values, prices) = np.broadcast_arrays(np.asarray(currency_values, dtype=float),
+                                               np.asarray(product_prices, dtype=float))
+
+        worthless = values == 0
+        affordable = (values >= prices) & ~worthless
+        short = ~affordable & ~worthless
+
+        units = np.zeros(values.shape)
+        change = np.zeros(values.shape)
+        units_needed = np.full(values.shape, np.nan)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = values / prices
+
+            units_int = np.trunc(ratio[affordable])
+            units[affordable] = units_int
+            change[affordable] = BA.round_like_format(
+                values[affordable] - units_int * prices[affordable], 2)
+
+            units[short] = BA.round_like_format(ratio[short], 2)
+            units_needed[short] = BA.round_like_format(1 / ratio[short], 10)
+
+        return (units, change, units_needed)
+
+
+    '''
+    Plain Python version of compare, used when NumPy
+    is not installed.
+    '''
+    @staticmethod
+    def compare_without_numpy(currency_values, product_prices):
+        if not hasattr(currency_values, "__iter__"):
+            currency_values = [currency_values] * len(product_prices)
+        if not hasattr(product_prices, "__iter__"):
+            product_prices = [product_prices] * len(currency_values)
+
+        units = []
+        change = []
+        units_needed = []
+
+        for (value, price) in zip(currency_values, product_prices):
+            if value == 0:
+                units.append(0.0)
+                change.append(0.0)
+                units_needed.append(float("nan"))
+            elif value >= price:
+                units_int = int(value / price)
+                units.append(float(units_int))
+                change.append(round(value - (units_int * price), 2))
+                units_needed.append(float("nan"))
+            else:
+                ratio = value / price
+                units.append(round(ratio, 2))
+                change.append(0.0)
+                units_needed.append(round(1 / ratio, 10))
+
+        return (units, change, units_needed)
+
+
+    '''
+    Rounds an array to the given number of decimals,
+    giving the same result as Python's round(x, N), which
+    is correctly rounded like float("{0:.Nf}".format(x)).
+
+    NumPy rounds by scaling, which can differ from the
+    correctly rounded string when the scaled value lands
+    within a few ulps of a half. Those few elements are
+    rounded with round() instead.
+    '''
+    @staticmethod
+    def round_like_format(values, decimals):
+        rounded = np.round(values, decimals)
+
+        scaled = values * 10.0 ** decimals
+        distance_to_half = np.abs(scaled - np.floor(scaled) - 0.5)
+        ambiguous = np.flatnonzero(distance_to_half <= 4 * np.spacing(np.abs(scaled)))
+
+        for i in ambiguous:
+            rounded[i] = round(float(values[i]), decimals)
+
+        return rounded
+
+
+    '''
+    Builds the messages compare_currency_value_and_product_price
+    would return for the results of compare.
+
+    If timestamps are given (one per value), the messages
+    refer to those dates.
+    '''
+    @staticmethod
+    def messages(currency, currency_values, units, units_needed, timestamps=None):
+        # Imported here, since the helper imports this module.
+        from .cryptocurrencies_helper import CryptocurrenciesHelper as CH
+        BA = BulkAffordability
+
+        dates = {}
+        messages = []
+        for (i, (value, unit, needed)) in enumerate(zip(BA.to_list(currency_values),
+                                                        BA.to_list(units),
+                                                        BA.to_list(units_needed))):
+            date_value = None
+            if timestamps is not None:
+                date_value = dates.get(timestamps[i])
+                if date_value is None:
+                    date_value = dates[timestamps[i]] = datetime.date.fromtimestamp(timestamps[i])
+
+            if value == 0:
+                messages.append(CH.MSG_WORTHLESS % currency)
+            elif needed != needed:
+                if date_value is not None:
+                    messages.append(CH.MSG_UNITS_ON_DATE % (int(unit), currency, date_value))
+                else:
+                    messages.append(CH.MSG_UNITS % (int(unit), currency))
+            else:
+                if date_value is not None:
+                    messages.append(CH.MSG_UNITS_NEEDED_ON_DATE % (needed, currency, date_value))
+                else:
+                    messages.append(CH.MSG_UNITS_NEEDED % (needed, currency))
+
+        return messages
+
+
+    '''
+    Returns a list of (units, change, msg) tuples equal to
+    what compare_currency_value_and_product_price returns
+    for each pair. If with_messages is False, msg is None.
+    '''
+    @staticmethod
+    def results(currency, currency_values, product_prices, timestamps=None,
+                with_messages=True):
+        BA = BulkAffordability
+
+        values = BA.to_list(currency_values)
+        (units, change, units_needed) = BA.compare(values, product_prices)
+        (units, change, units_needed) = (BA.to_list(units), BA.to_list(change),
+                                         BA.to_list(units_needed))
+
+        if with_messages:
+            messages = BA.messages(currency, values, units, units_needed, timestamps)
+        else:
+            messages = [None] * len(values)
+
+        results = []
+        for (value, unit, spare, needed, msg) in zip(values, units, change, units_needed, messages):
+            if value == 0:
+                results.append((0, 0, msg))
+            elif needed != needed:
+                results.append((int(unit), spare, msg))
+            else:
+                results.append((unit, 0, msg))
+
+        return results
+
+
+    '''
+    Returns a list of Python floats from an array or
+    any sequence.
+    '''
+    @staticmethod
+    def to_list(values):
+        if hasattr(values, "tolist"):
+            return values.tolist()
+        return list(values)
@@ -0,0 +1,170 @@
+import collections
+import threading
+import time
+
+
+'''
+Defines failure isolation for upstream price sources.
+
+A CircuitBreaker watches the calls to one upstream. When at
+least `failure_rate` of the calls in the last `window` seconds
+failed (errors, timeouts and 5xx responses), and there were at
+least `min_calls` of them, it opens: calls are rejected right
+away for `open_seconds`. Then it lets `half_open_trials` calls
+through; if they all succeed it closes, and if any fails it
+opens again.
+
+A RetryBudget caps retries to a fraction of the calls made,
+so retries cannot multiply the load on an upstream that is
+already failing.
+'''
+
+class CircuitBreaker():
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_rate=0.5, min_calls=20, window=30,
+                 open_seconds=30, half_open_trials=3):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_trials = half_open_trials
+        self.state = CircuitBreaker.CLOSED
+        self.opened_at = None
+        self._calls = collections.deque()
+        self._trials = 0
+        self._trial_successes = 0
+        self._lock = threading.Lock()
+        self._counters = dict(rejected=0, opened=0)
+
+
+    '''
+    Returns True if a call may go through now.
+    In the half-open state, only `half_open_trials`
+    calls are let through at a time.
+    '''
+    def allow(self):
+        with self._lock:
+            if self.state == CircuitBreaker.OPEN:
+                if time.time() - self.opened_at < self.open_seconds:
+                    self._counters["rejected"] += 1
+                    return False
+                self.state = CircuitBreaker.HALF_OPEN
+                self._trials = 0
+                self._trial_successes = 0
+
+            if self.state == CircuitBreaker.HALF_OPEN:
+                if self._trials >= self.half_open_trials:
+                    self._counters["rejected"] += 1
+                    return False
+                self._trials += 1
+
+            return True
+
+
+    '''
+    Records the outcome of a call that was allowed.
+    '''
+    def record(self, success):
+        now = time.time()
+
+        with self._lock:
+            if self.state == CircuitBreaker.HALF_OPEN:
+                if not success:
+                    self._open(now)
+                    return
+                self._trial_successes += 1
+                if self._trial_successes >= self.half_open_trials:
+                    self.state = CircuitBreaker.CLOSED
+                    self._calls.clear()
+                return
+
+            if self.state == CircuitBreaker.OPEN:
+                return
+
+            self._calls.append((now, success))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+
+            failures = sum(1 for (_, succeeded) in self._calls if not succeeded)
+            if len(self._calls) >= self.min_calls and failures >= self.failure_rate * len(self._calls):
+                self._open(now)
+
+
+    def _open(self, now):
+        self.state = CircuitBreaker.OPEN
+        self.opened_at = now
+        self._calls.clear()
+        self._counters["opened"] += 1
+
+
+    '''
+    Returns the state of the breaker, how many calls and
+    failures are in the window, how many calls were
+    rejected and how many times it opened.
+    '''
+    def status(self):
+        with self._lock:
+            status = dict(self._counters)
+            status["state"] = self.state
+            status["calls"] = len(self._calls)
+            status["failures"] = sum(1 for (_, succeeded) in self._calls if not succeeded)
+        return status
+
+
+class RetryBudget():
+
+    def __init__(self, ratio=0.1, min_per_second=1, max_tokens=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._refilled_at = time.time()
+        self._lock = threading.Lock()
+        self._counters = dict(retries=0, exhausted=0)
+
+
+    '''
+    Records a call, which earns `ratio` of a retry.
+    '''
+    def record_call(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+
+    '''
+    Returns True, and spends a retry, if the budget
+    allows one. Besides the share earned by calls,
+    `min_per_second` retries are always allowed.
+    '''
+    def try_retry(self):
+        now = time.time()
+
+        with self._lock:
+            self._tokens = min(self.max_tokens,
+                               self._tokens + (now - self._refilled_at) * self.min_per_second)
+            self._refilled_at = now
+
+            if self._tokens < 1:
+                self._counters["exhausted"] += 1
+                return False
+
+            self._tokens -= 1
+            self._counters["retries"] += 1
+            return True
+
+
+    def status(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+'''
+Raised instead of calling an upstream whose
+circuit breaker is open.
+'''
+class CircuitOpenError(Exception):
+    pass
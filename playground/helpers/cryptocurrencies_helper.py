@@ -1,9 +1,25 @@
+import asyncio
+import functools
 import math
 import time
 import datetime
-import requests
-from bs4 import BeautifulSoup as bs
-import random
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+
+from ..models import HistoricalPrice
+from .amazon_parser import AmazonPriceParser
+from .bulk_affordability import BulkAffordability
+from .http_client import HttpClient
+from .parser_pool import ParserPool
+from .price_cache import ProductPriceCache, SpotPriceCache
+from .price_providers import PriceProviderRegistry
+from .price_series_index import PriceSeriesIndex
+from .product_catalog import ProductCatalog
+from .request_metrics import RequestMetrics
+from .response_renderer import ResponseRenderer
+from .single_flight import SingleFlight
 
 
 '''
@@ -13,12 +29,67 @@ Defines a helper class for the cryptocurrencies view
 class CryptocurrenciesHelper():
 
     SUPPORTED_CURRENCIES = ["BTC", "LTC", "ETH"]
+    SUPPORTED_FIATS = ["USD", "EUR", "GBP"]
+    HISTODAY_PAGE_SIZE = 2000
+
+    CRYPTOCOMPARE_URL = getattr(settings, "PLAYGROUND_CRYPTOCOMPARE_URL",
+                                "https://min-api.cryptocompare.com")
+    AMAZON_URL = getattr(settings, "PLAYGROUND_AMAZON_URL", "https://www.amazon.com")
+
+    MSG_UNITS = "You can buy %s units of the product with 1 %s."
+    MSG_UNITS_ON_DATE = "You could have bought %s units of the product with 1 %s on %s."
+    MSG_UNITS_NEEDED = "You need %s %s to buy one unit of the product."
+    MSG_UNITS_NEEDED_ON_DATE = "You would have needed %s %s to buy one unit of the product on %s."
+    MSG_WORTHLESS = "At this point in time %s was worth nothing."
+    MSG_FIAT_NOT_DATED = "Dates are only supported with USD prices."
+    MSG_AFFORDABLE = "You can buy %s of the products with 1 %s."
+    MSG_UNITS_FIRST_LAST = "You could first buy %s units of the product with 1 %s on %s, and last on %s."
+    MSG_UNITS_NEVER = "You could never buy %s units of the product with 1 %s."
     RANDOM_PRODUCTS = { "B01MQWUXZS" : 159.99,
                         "B00EMKLSSM" : 94.75,
                         "B06XDP7B71" : 9.99,
                         "B01LMHI37Q" : 689.00,
                         "B01J24C0TI" : 229.99 }
 
+    metrics = RequestMetrics()
+
+    http = HttpClient.from_settings(settings, metrics=metrics)
+
+    price_providers = PriceProviderRegistry.from_settings(settings)
+
+    executor = ThreadPoolExecutor(
+        max_workers=getattr(settings, "PLAYGROUND_UPSTREAM_WORKERS", 10))
+
+    single_flight = SingleFlight()
+
+    renderer = ResponseRenderer(
+        encoder=getattr(settings, "PLAYGROUND_JSON_ENCODER", "json"),
+        max_entries=getattr(settings, "PLAYGROUND_RENDERED_BODIES_MAX_ENTRIES", 4096))
+
+    batch_executor = ThreadPoolExecutor(
+        max_workers=getattr(settings, "PLAYGROUND_BATCH_WORKERS", 8))
+
+    spot_price_cache = SpotPriceCache(
+        ttl=getattr(settings, "PLAYGROUND_SPOT_PRICE_TTL", 30),
+        stale_ttl=getattr(settings, "PLAYGROUND_SPOT_PRICE_STALE_TTL", 300))
+
+    rate_matrix_cache = SpotPriceCache(
+        ttl=getattr(settings, "PLAYGROUND_SPOT_PRICE_TTL", 30),
+        stale_ttl=getattr(settings, "PLAYGROUND_SPOT_PRICE_STALE_TTL", 300))
+
+    parser_pool = ParserPool.from_settings(settings)
+
+    price_series_indexes = {}
+
+    product_catalog = ProductCatalog(
+        fallback=RANDOM_PRODUCTS,
+        max_age=getattr(settings, "PLAYGROUND_PRODUCT_CATALOG_MAX_AGE", 300))
+
+    product_price_cache = ProductPriceCache(
+        ttl=getattr(settings, "PLAYGROUND_PRODUCT_PRICE_TTL", 3600),
+        negative_ttl=getattr(settings, "PLAYGROUND_PRODUCT_PRICE_NEGATIVE_TTL", 60),
+        max_entries=getattr(settings, "PLAYGROUND_PRODUCT_PRICE_MAX_ENTRIES", 1024))
+
     '''
     Determines what type of response should be provided
     based on the parameters included in the request.
@@ -28,11 +99,20 @@ class CryptocurrenciesHelper():
     currency_date
     currency_product
     currency_date_product
+    currency_range
+    currency_affordable
+    currency_units
     params_not_provided
     '''
     @staticmethod
     def handle_request_params(params):
-        if "currency" in params and "date" in params and "amz_product_id" in params:
+        if "currency" in params and "affordable" in params:
+            return "currency_affordable"
+        elif "currency" in params and "units" in params:
+            return "currency_units"
+        elif "currency" in params and "start" in params and "end" in params:
+            return "currency_range"
+        elif "currency" in params and "date" in params and "amz_product_id" in params:
             return "currency_date_product"
         elif "currency" in params and "date" in params:
             return "currency_date"
@@ -57,6 +137,14 @@ class CryptocurrenciesHelper():
         if currency == None:
             return dict(msg=msg, response="error")
 
+        (fiat, msg) = CH.get_fiat_from_request(request)
+
+        if fiat == None:
+            return dict(msg=msg, response="error")
+
+        if fiat != "USD":
+            return CH.response_in_fiat(currency, fiat)
+
         (currency_value, msg) = CH.get_currency_value(currency)
 
         if currency_value == None:
@@ -93,6 +181,11 @@ class CryptocurrenciesHelper():
         if timestamp == None:
             return dict(msg=msg, response="error")
 
+        (fiat, msg) = CH.get_fiat_from_request(request, dated=True)
+
+        if fiat == None:
+            return dict(msg=msg, response="error")
+
         (currency_value, msg) = CH.get_currency_value(currency, timestamp)
 
         if currency_value == None:
@@ -125,20 +218,272 @@ class CryptocurrenciesHelper():
         if currency == None:
             return dict(msg=msg, response="error")
 
+        (fiat, msg) = CH.get_fiat_from_request(request)
+
+        if fiat == None:
+            return dict(msg=msg, response="error")
+
+        if fiat != "USD":
+            return CH.response_in_fiat(currency, fiat, request.get("amz_product_id"))
+
+        prices = CH.get_currency_value_and_product_price(currency,
+                                                         amz_product_id=request.get("amz_product_id"))
+
+        return CH.response_from_prices(currency, prices)
+
+
+    '''
+    Create response based on having the currency, start
+    and end parameters provided, and optionally
+    amz_product_id.
+
+    Returns the units of the product that could be
+    bought with 1 unit of the currency on every day
+    from start to end, computed with BulkAffordability:
+    {
+        "data": {
+            "amz_product_id": "B01J24C0TI",
+            "product_url": "https://www.amazon.com/gp/product/B01J24C0TI",
+            "product_price": 229.99,
+            "series": [
+                {
+                    "date": "2017-11-01",
+                    "currency_value": 6737.78,
+                    "units": 29,
+                    "change": 68.07,
+                    "msg": "You could have bought 29 units of the product with 1 BTC on 2017-11-01."
+                },
+                ...
+            ]
+        },
+        "response": "ok"
+    }
+    '''
+    @staticmethod
+    def response_for_currency_range(request):
+        CH = CryptocurrenciesHelper
+
+        (currency, msg) = CH.get_currency_from_request(request)
+
+        if currency == None:
+            return dict(msg=msg, response="error")
+
+        (start_timestamp, msg) = CH.get_date_timestamp_from_request(request, "start")
+
+        if start_timestamp == None:
+            return dict(msg=msg, response="error")
+
+        (end_timestamp, msg) = CH.get_date_timestamp_from_request(request, "end")
+
+        if end_timestamp == None:
+            return dict(msg=msg, response="error")
+
+        (fiat, msg) = CH.get_fiat_from_request(request, dated=True)
+
+        if fiat == None:
+            return dict(msg=msg, response="error")
+
+        max_days = getattr(settings, "PLAYGROUND_RANGE_MAX_DAYS", 3660)
+
+        if start_timestamp > end_timestamp:
+            return dict(msg="The start date cannot be after the end date.", response="error")
+
+        if (end_timestamp - start_timestamp) / 86400 >= max_days:
+            return dict(msg="A date range can span at most %s days." % max_days, response="error")
+
+        prices = CH.get_currency_history_and_product_price(currency,
+                                                           start_timestamp,
+                                                           end_timestamp,
+                                                           request.get("amz_product_id"))
+        ((history, msg), (product_price, amz_product_id, product_msg)) = prices
+
+        if history == None:
+            return dict(msg=msg, response="error")
+
+        if product_price == None:
+            return dict(msg=product_msg, response="error")
+
+        with CH.metrics.stage("compute"):
+            timestamps = [timestamp for (timestamp, currency_value) in history]
+            currency_values = [currency_value for (timestamp, currency_value) in history]
+            results = BulkAffordability.results(currency, currency_values, product_price, timestamps)
+
+            series = []
+            for (timestamp, currency_value, (units, change, msg)) in zip(timestamps, currency_values, results):
+                series.append(dict(
+                        date=str(datetime.date.fromtimestamp(timestamp)),
+                        currency_value=currency_value,
+                        units=units,
+                        change=change,
+                        msg=msg,
+                    ))
+
+        response = dict(
+                response="ok",
+                data=dict(
+                        amz_product_id=amz_product_id,
+                        product_url="https://www.amazon.com/gp/product/" + amz_product_id,
+                        product_price=product_price,
+                        series=series,
+                    )
+                )
+
+        return response
+
+
+    '''
+    Create response based on having the currency and
+    affordable parameters provided
+
+    Lists the products of the catalog that 1 unit of the
+    currency can buy at its current value, the most
+    expensive first: all of them with affordable=all, or
+    the top N with affordable=N. Prices are in USD.
+
+    Ex data:
+    {
+        "currency": "BTC",
+        "currency_value": 7540.35,
+        "count": 5,
+        "products": [{"amz_product_id": "B01LMHI37Q", "product_price": 689.0,
+                      "units": 10, "change": 650.35, "product_url": ...}, ...],
+        "msg": "You can buy 5 of the products with 1 BTC."
+    }
+    '''
+    @staticmethod
+    def response_for_currency_affordable(request):
+        CH = CryptocurrenciesHelper
+
+        (currency, msg) = CH.get_currency_from_request(request)
+
+        if currency == None:
+            return dict(msg=msg, response="error")
+
+        (limit, msg) = CH.get_affordable_limit_from_request(request)
+
+        if msg:
+            return dict(msg=msg, response="error")
+
+        (fiat, msg) = CH.get_fiat_from_request(request)
+
+        if fiat == None:
+            return dict(msg=msg, response="error")
+
+        if fiat != "USD":
+            return dict(msg="Affordable products are only listed in USD.", response="error")
+
         (currency_value, msg) = CH.get_currency_value(currency)
 
         if currency_value == None:
             return dict(msg=msg, response="error")
 
-        (product_price, amz_product_id, msg) = CH.get_amz_product_price(request.get("amz_product_id"))
+        with CH.metrics.stage("compute"):
+            (count, products) = CH.product_catalog.affordable(currency_value, limit)
 
-        if product_price == None:
+            data = dict(currency=currency,
+                        currency_value=currency_value,
+                        count=count,
+                        products=[],
+                        msg=CH.MSG_AFFORDABLE % (count, currency))
+
+            for (amz_product_id, product_price) in products:
+                units = int(currency_value / product_price)
+                data["products"].append(dict(
+                        amz_product_id=amz_product_id,
+                        product_url="https://www.amazon.com/gp/product/" + amz_product_id,
+                        product_price=product_price,
+                        units=units,
+                        change=round(currency_value - (units * product_price), 2),
+                    ))
+
+        return dict(response="ok", data=data)
+
+
+    '''
+    Create response based on having the currency and
+    units parameters provided (and optionally amz_product_id)
+
+    Answers when 1 unit of the currency could first and
+    last buy that many units of the product, at its current
+    price, from the daily price series of the currency (see
+    get_price_series_index). affordable_since is the first
+    day of the latest stretch of days, up to yesterday, on
+    which it always could, or None if it could not yesterday.
+
+    Ex data:
+    {
+        "amz_product_id": "B01MQWUXZS",
+        "product_price": 159.99,
+        "units": 10,
+        "target_value": 1599.9,
+        "first_date": "2017-03-02",
+        "last_date": "2024-06-30",
+        "affordable_since": "2020-10-21",
+        "msg": "You could first buy 10 units of the product with 1 BTC on 2017-03-02, and last on 2024-06-30.",
+        ...
+    }
+    '''
+    @staticmethod
+    def response_for_currency_units(request):
+        CH = CryptocurrenciesHelper
+
+        (currency, msg) = CH.get_currency_from_request(request)
+
+        if currency == None:
             return dict(msg=msg, response="error")
 
-        response = CH.build_response(currency,
-                                     currency_value,
-                                     product_price,
-                                     amz_product_id)
+        (units, msg) = CH.get_units_from_request(request)
+
+        if units == None:
+            return dict(msg=msg, response="error")
+
+        (fiat, msg) = CH.get_fiat_from_request(request, dated=True)
+
+        if fiat == None:
+            return dict(msg=msg, response="error")
+
+        index_future = CH.executor.submit(CH.metrics.bind(CH.get_price_series_index), currency)
+        (product_price, amz_product_id, product_msg) = CH.get_amz_product_price(request.get("amz_product_id"))
+        (index, msg) = index_future.result()
+
+        if index == None:
+            return dict(msg=msg, response="error")
+
+        if product_price == None:
+            return dict(msg=product_msg, response="error")
+
+        with CH.metrics.stage("compute"):
+            target_value = units * product_price
+            first_day = index.first_at_least(target_value)
+            last_day = index.last_at_least(target_value)
+            last_day_below = index.last_below(target_value)
+
+            if last_day_below == None:
+                affordable_since = index.start_day
+            elif last_day_below < index.end_day:
+                affordable_since = last_day_below + datetime.timedelta(days=1)
+            else:
+                affordable_since = None
+
+            if first_day == None:
+                msg = CH.MSG_UNITS_NEVER % (units, currency)
+            else:
+                msg = CH.MSG_UNITS_FIRST_LAST % (units, currency, first_day, last_day)
+
+        response = dict(
+                response="ok",
+                data=dict(
+                        amz_product_id=amz_product_id,
+                        product_url="https://www.amazon.com/gp/product/" + amz_product_id,
+                        product_price=product_price,
+                        units=units,
+                        target_value=round(target_value, 2),
+                        first_date=str(first_day) if first_day else None,
+                        last_date=str(last_day) if last_day else None,
+                        affordable_since=str(affordable_since) if affordable_since else None,
+                        msg=msg,
+                    )
+                )
 
         return response
 
@@ -161,16 +506,94 @@ class CryptocurrenciesHelper():
         if timestamp == None:
             return dict(msg=msg, response="error")
 
-        (currency_value, msg) = CH.get_currency_value(currency, timestamp)
+        (fiat, msg) = CH.get_fiat_from_request(request, dated=True)
 
-        if currency_value == None:
+        if fiat == None:
             return dict(msg=msg, response="error")
 
-        (product_price, amz_product_id, msg) = CH.get_amz_product_price(request.get("amz_product_id"))
+        prices = CH.get_currency_value_and_product_price(currency,
+                                                         timestamp,
+                                                         request.get("amz_product_id"))
 
-        if product_price == None:
+        return CH.response_from_prices(currency, prices, timestamp)
+
+
+    '''
+    Async version of response_for_currency_product
+    '''
+    @staticmethod
+    async def response_for_currency_product_async(request):
+        CH = CryptocurrenciesHelper
+
+        (currency, msg) = CH.get_currency_from_request(request)
+
+        if currency == None:
             return dict(msg=msg, response="error")
 
+        (fiat, msg) = CH.get_fiat_from_request(request)
+
+        if fiat == None:
+            return dict(msg=msg, response="error")
+
+        if fiat != "USD":
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, CH.metrics.bind(CH.response_in_fiat), currency,
+                                              fiat, request.get("amz_product_id"))
+
+        prices = await CH.get_currency_value_and_product_price_async(currency,
+                                                                     amz_product_id=request.get("amz_product_id"))
+
+        return CH.response_from_prices(currency, prices)
+
+
+    '''
+    Async version of response_for_currency_date_product
+    '''
+    @staticmethod
+    async def response_for_currency_date_product_async(request):
+        CH = CryptocurrenciesHelper
+
+        (currency, msg) = CH.get_currency_from_request(request)
+
+        if currency == None:
+            return dict(msg=msg, response="error")
+
+        (timestamp, msg) = CH.get_date_timestamp_from_request(request)
+
+        if timestamp == None:
+            return dict(msg=msg, response="error")
+
+        (fiat, msg) = CH.get_fiat_from_request(request, dated=True)
+
+        if fiat == None:
+            return dict(msg=msg, response="error")
+
+        prices = await CH.get_currency_value_and_product_price_async(currency,
+                                                                     timestamp,
+                                                                     request.get("amz_product_id"))
+
+        return CH.response_from_prices(currency, prices, timestamp)
+
+
+    '''
+    Builds the response from the results of
+    get_currency_value_and_product_price.
+
+    The currency error, if any, takes precedence over
+    the product error.
+    '''
+    @staticmethod
+    def response_from_prices(currency, prices, timestamp=None):
+        CH = CryptocurrenciesHelper
+
+        ((currency_value, msg), (product_price, amz_product_id, product_msg)) = prices
+
+        if currency_value == None:
+            return dict(msg=msg, response="error")
+
+        if product_price == None:
+            return dict(msg=product_msg, response="error")
+
         response = CH.build_response(currency,
                                      currency_value,
                                      product_price,
@@ -180,6 +603,221 @@ class CryptocurrenciesHelper():
         return response
 
 
+    '''
+    Create the response for a currency and a product, with
+    both prices in a fiat currency other than USD.
+
+    The currency value is read from the rate matrix, which
+    is fetched on CryptocurrenciesHelper.executor while the
+    product price is fetched in the calling thread, and the
+    product's USD price is converted through the same matrix.
+    '''
+    @staticmethod
+    def response_in_fiat(currency, fiat, amz_product_id=None):
+        CH = CryptocurrenciesHelper
+
+        matrix_future = CH.executor.submit(CH.metrics.bind(CH.get_rate_matrix))
+        (product_price, amz_product_id, product_msg) = CH.get_amz_product_price(amz_product_id)
+        (matrix, msg) = matrix_future.result()
+
+        if matrix == None:
+            return dict(msg=msg, response="error")
+
+        if product_price == None:
+            return dict(msg=product_msg, response="error")
+
+        response = CH.build_response(currency,
+                                     matrix[currency][fiat],
+                                     CH.convert_from_usd(matrix, product_price, fiat),
+                                     amz_product_id)
+        response["data"]["fiat"] = fiat
+
+        return response
+
+
+    '''
+    Fetches the currency value and the product price at
+    the same time, so the latency is the slower of the two
+    upstream calls instead of their sum.
+
+    The currency value is fetched on CryptocurrenciesHelper.executor
+    while the product price is fetched in the calling thread.
+
+    Returns ((currency_value, msg), (product_price, amz_product_id, msg))
+    '''
+    @staticmethod
+    def get_currency_value_and_product_price(currency, timestamp=None,
+                                             amz_product_id=None):
+        CH = CryptocurrenciesHelper
+
+        currency_future = CH.executor.submit(CH.metrics.bind(CH.get_currency_value), currency, timestamp)
+        product = CH.get_amz_product_price(amz_product_id)
+
+        return (currency_future.result(), product)
+
+
+    '''
+    Like get_currency_value_and_product_price, but fetches
+    the daily history of the currency from start_timestamp
+    to end_timestamp instead of a single value.
+
+    Returns ((history, msg), (product_price, amz_product_id, msg))
+    '''
+    @staticmethod
+    def get_currency_history_and_product_price(currency, start_timestamp,
+                                               end_timestamp, amz_product_id=None):
+        CH = CryptocurrenciesHelper
+
+        history_future = CH.executor.submit(CH.metrics.bind(CH.get_currency_history), currency,
+                                            start_timestamp, end_timestamp)
+        product = CH.get_amz_product_price(amz_product_id)
+
+        return (history_future.result(), product)
+
+
+    '''
+    Async version of get_currency_value_and_product_price.
+
+    Both blocking fetches run on CryptocurrenciesHelper.executor
+    so the event loop is never blocked.
+    '''
+    @staticmethod
+    async def get_currency_value_and_product_price_async(currency, timestamp=None,
+                                                         amz_product_id=None):
+        CH = CryptocurrenciesHelper
+
+        loop = asyncio.get_running_loop()
+        (currency_result, product) = await asyncio.gather(
+            loop.run_in_executor(CH.executor, CH.metrics.bind(CH.get_currency_value), currency, timestamp),
+            loop.run_in_executor(CH.executor, CH.metrics.bind(CH.get_amz_product_price), amz_product_id))
+
+        return (currency_result, product)
+
+
+    '''
+    Create the response for a batch of queries, each one
+    a dict with the same parameters as a single request.
+
+    Identical upstream lookups within the batch are done
+    once, and the remaining ones run concurrently on
+    CryptocurrenciesHelper.batch_executor.
+
+    Returns a list with one response per query, in the
+    same order, each one shaped like the response of a
+    single request.
+    '''
+    @staticmethod
+    def response_for_batch(queries):
+        CH = CryptocurrenciesHelper
+
+        plans = [CH.plan_batch_query(query) for query in queries]
+
+        lookups = []
+        seen = set()
+        for plan in plans:
+            for lookup in plan.get("lookups", ()):
+                if lookup is not None and lookup not in seen:
+                    seen.add(lookup)
+                    lookups.append(lookup)
+
+        results = dict(zip(lookups, CH.batch_executor.map(CH.metrics.bind(CH.run_batch_lookup), lookups)))
+
+        responses = []
+        for plan in plans:
+            if "error" in plan:
+                responses.append(plan["error"])
+                continue
+
+            (currency_lookup, product_lookup) = plan["lookups"]
+            if product_lookup is None:
+                product = CH.get_random_amazon_product()
+            else:
+                product = results[product_lookup]
+
+            responses.append(CH.response_from_prices(plan["currency"],
+                                                     (results[currency_lookup], product),
+                                                     plan["timestamp"]))
+
+        return responses
+
+
+    '''
+    Validates a single query of a batch.
+
+    Returns either dict(error=<error response>), or a dict
+    with the currency, the timestamp (or None) and the
+    upstream lookups the query needs:
+    (("currency", currency, timestamp), ("product", amz_product_id))
+    where the product lookup is None for a random product.
+    '''
+    @staticmethod
+    def plan_batch_query(query):
+        CH = CryptocurrenciesHelper
+
+        if not isinstance(query, dict):
+            return dict(error=dict(msg="Each query must be an object with the "
+                                   "request parameters.", response="error"))
+
+        if not all(isinstance(value, str) for value in query.values()):
+            return dict(error=dict(msg="Every request parameter must be a string.",
+                                   response="error"))
+
+        response_type = CH.handle_request_params(query)
+
+        if response_type == "currency_range":
+            return dict(error=dict(msg="Date ranges are not supported in batch queries.",
+                                   response="error"))
+
+        if response_type == "currency_affordable":
+            return dict(error=dict(msg="Affordable product lists are not supported in batch queries.",
+                                   response="error"))
+
+        if response_type == "currency_units":
+            return dict(error=dict(msg="Units queries are not supported in batch queries.",
+                                   response="error"))
+
+        if query.get("fiat", "USD") != "USD":
+            return dict(error=dict(msg="Batch queries only support USD prices.",
+                                   response="error"))
+
+        if response_type == "params_not_provided":
+            return dict(error=dict(msg="The only parameter required is currency. "
+                                   "Ex(currency=BTC)", response="error"))
+
+        (currency, msg) = CH.get_currency_from_request(query)
+
+        if currency == None:
+            return dict(error=dict(msg=msg, response="error"))
+
+        timestamp = None
+        if response_type in ("currency_date", "currency_date_product"):
+            (timestamp, msg) = CH.get_date_timestamp_from_request(query)
+
+            if timestamp == None:
+                return dict(error=dict(msg=msg, response="error"))
+
+        product_lookup = None
+        if response_type in ("currency_product", "currency_date_product"):
+            product_lookup = ("product", query.get("amz_product_id"))
+
+        return dict(currency=currency,
+                    timestamp=timestamp,
+                    lookups=(("currency", currency, timestamp), product_lookup))
+
+
+    '''
+    Runs one upstream lookup planned by plan_batch_query.
+    '''
+    @staticmethod
+    def run_batch_lookup(lookup):
+        CH = CryptocurrenciesHelper
+
+        if lookup[0] == "currency":
+            return CH.get_currency_value(lookup[1], lookup[2])
+        else:
+            return CH.get_price_from_amazon(lookup[1])
+
+
     '''
     Gets the currency value from the params dict.
 
@@ -201,6 +839,79 @@ class CryptocurrenciesHelper():
                     "cryptocurrencies: %s" % CH.SUPPORTED_CURRENCIES)
 
 
+    '''
+    Gets the fiat value from the params dict.
+
+    Returns the name of the fiat currency if it is one
+    of the SUPPORTED_FIATS, or USD if none is given.
+    Fiat currencies other than USD are only available
+    for current prices, so for dated requests they
+    return None.
+
+    Otherwise, it returns None.
+    '''
+    @staticmethod
+    def get_fiat_from_request(request, dated=False):
+        CH = CryptocurrenciesHelper
+
+        fiat = request.get("fiat", "USD")
+
+        if fiat not in CH.SUPPORTED_FIATS:
+            return (None, "This endpoint only supports the following "
+                    "fiat currencies: %s" % CH.SUPPORTED_FIATS)
+        elif dated and fiat != "USD":
+            return (None, CH.MSG_FIAT_NOT_DATED)
+        else:
+            return (fiat, "")
+
+
+    '''
+    Gets the affordable value from the params dict.
+
+    Returns (None, "") for affordable=all, or the number
+    of products to list if it is a positive integer.
+
+    Otherwise, it returns an error message.
+    '''
+    @staticmethod
+    def get_affordable_limit_from_request(request):
+        affordable = request.get("affordable")
+
+        if affordable == "all":
+            return (None, "")
+
+        try:
+            limit = int(affordable)
+        except (TypeError, ValueError):
+            limit = 0
+
+        if limit < 1:
+            return (None, "affordable must be all or a positive number of products.")
+
+        return (limit, "")
+
+
+    '''
+    Gets the units value from the params dict.
+
+    Returns the number of units if it is a positive
+    integer.
+
+    Otherwise, it returns None.
+    '''
+    @staticmethod
+    def get_units_from_request(request):
+        try:
+            units = int(request.get("units"))
+        except (TypeError, ValueError):
+            units = 0
+
+        if units < 1:
+            return (None, "units must be a positive number of units.")
+
+        return (units, "")
+
+
     '''
     Gets the date value from the params dict
     and converts it to epoch timestamp.
@@ -212,10 +923,13 @@ class CryptocurrenciesHelper():
 
     If date cannot be converted to epoch,
     returns None.
+
+    The date is read from the "date" parameter
+    unless another key is given, ex: "start".
     '''
     @staticmethod
-    def get_date_timestamp_from_request(request):
-        date_string = request.get("date")
+    def get_date_timestamp_from_request(request, key="date"):
+        date_string = request.get(key)
         try:
             timestamp = time.mktime(datetime.datetime.strptime(date_string, "%Y-%m-%d").timetuple())
         except Exception:
@@ -253,6 +967,7 @@ class CryptocurrenciesHelper():
     }
     '''
     @staticmethod
+    @metrics.stage("compute")
     def build_response(currency, currency_value, product_price,
                        amz_product_id, timestamp=None):
         CH = CryptocurrenciesHelper
@@ -299,52 +1014,59 @@ class CryptocurrenciesHelper():
                                                  currency_value,
                                                  product_price,
                                                  timestamp=None):
+        CH = CryptocurrenciesHelper
+
         if currency_value == 0:
-            msg = "At this point in time %s was worth nothing." % currency
-            return (0, 0, msg)
+            return (0, 0, CH.MSG_WORTHLESS % currency)
 
         units = currency_value / product_price
-        timestamp_now = time.mktime(datetime.datetime.now().timetuple())
-
-        msg = ""
 
         if currency_value >= product_price:
             units_int = int(units)
-            change = currency_value - (units_int * product_price)
-            change = float("{0:.2f}".format(change))
+            change = round(currency_value - (units_int * product_price), 2)
 
             if timestamp != None:
-                date_value = datetime.date.fromtimestamp(timestamp)
-                msg = "You could have bought %s units of the product with 1 %s on %s." % (units_int, currency, date_value)
+                msg = CH.MSG_UNITS_ON_DATE % (units_int, currency, CH.date_from_timestamp(timestamp))
             else:
-                msg = "You can buy %s units of the product with 1 %s." % (units_int, currency)
+                msg = CH.MSG_UNITS % (units_int, currency)
 
             return (units_int, change, msg)
         else:
-            currency_units_needed = float("{0:.10f}".format(1/units))
-            units = float("{0:.2f}".format(units))
+            currency_units_needed = round(1/units, 10)
+            units = round(units, 2)
 
             if timestamp != None:
-                date_value = datetime.date.fromtimestamp(timestamp)
-                msg = "You would have needed %s %s to buy one unit of the product on %s." % (currency_units_needed, currency, date_value)
+                msg = CH.MSG_UNITS_NEEDED_ON_DATE % (currency_units_needed, currency, CH.date_from_timestamp(timestamp))
             else:
-                msg = "You need %s %s to buy one unit of the product." % (currency_units_needed, currency)
+                msg = CH.MSG_UNITS_NEEDED % (currency_units_needed, currency)
             return (units, 0, msg)
 
 
+    '''
+    Returns the local date of a timestamp as a
+    YYYY-MM-DD string. Results are memoized.
+    '''
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def date_from_timestamp(timestamp):
+        return str(datetime.date.fromtimestamp(timestamp))
+
+
     '''
     Given a cryptocurrency, and optionally a timestamp,
     returns the current USD value of the cryptocurrency
     as a float.
 
     If a timestamp is provided, it returns the price
-    at the given time.
+    at the given time, read through the HistoricalPrice table.
 
-    If no timestamp is provided, it returns the latest price.
+    If no timestamp is provided, it returns the latest price,
+    served from CryptocurrenciesHelper.spot_price_cache.
 
     Ex: "BTC" -> 7533.53
     '''
     @staticmethod
+    @metrics.stage("currency_fetch")
     def get_currency_value(currency, timestamp=None):
         CH = CryptocurrenciesHelper
 
@@ -352,26 +1074,321 @@ class CryptocurrenciesHelper():
             return (None, "This endpoint only supports the "
                 "following cryptocurrencies: %s" % CH.SUPPORTED_CURRENCIES)
 
-        value = None
         if timestamp is not None:
+            return CH.get_historical_currency_value(currency, timestamp)
+
+        return CH.spot_price_cache.get(currency,
+                                       lambda: CH.fetch_currency_value(currency))
+
+
+    '''
+    Returns the USD value of a currency on the day of the
+    given timestamp.
+
+    Past days are looked up in the HistoricalPrice table first,
+    and stored there after being fetched from upstream. The
+    current day (or a future one) is always fetched, since
+    its price is not final yet.
+    '''
+    @staticmethod
+    def get_historical_currency_value(currency, timestamp):
+        CH = CryptocurrenciesHelper
+
+        day = datetime.date.fromtimestamp(timestamp)
+        if day >= datetime.date.today():
+            return CH.fetch_currency_value(currency, timestamp)
+
+        try:
+            value = (HistoricalPrice.objects
+                     .filter(currency=currency, day=day)
+                     .values_list("usd", flat=True)
+                     .first())
+        except DatabaseError:
+            return CH.fetch_currency_value(currency, timestamp)
+
+        if value is not None:
+            return (value, "")
+
+        (value, msg) = CH.fetch_currency_value(currency, timestamp)
+
+        if value is not None:
             try:
-                r = requests.get("https://min-api.cryptocompare.com"
-                    "/data/pricehistorical?fsym=%s&tsyms=USD&ts=%s" % (currency, timestamp))
-                value = r.json().get(currency).get("USD")
-            except Exception:
-                return (None, "There was an error getting the currency value.")
-        else:
+                with transaction.atomic():
+                    HistoricalPrice.objects.create(currency=currency, day=day, usd=value)
+            except (IntegrityError, DatabaseError):
+                pass
+
+        return (value, msg)
+
+
+    '''
+    Returns the daily USD values of a currency from the
+    day of start_timestamp to the day of end_timestamp,
+    as a list of (timestamp, value) tuples.
+
+    If every day of the range is stored in the
+    HistoricalPrice table, the values are read from it.
+    Otherwise they are fetched from upstream with
+    fetch_currency_history and the past days are stored.
+
+    Returns (history, msg); history is None on error.
+    '''
+    @staticmethod
+    @metrics.stage("currency_fetch")
+    def get_currency_history(currency, start_timestamp, end_timestamp):
+        CH = CryptocurrenciesHelper
+
+        start_day = datetime.date.fromtimestamp(start_timestamp)
+        end_day = datetime.date.fromtimestamp(end_timestamp)
+        days = (end_day - start_day).days + 1
+
+        try:
+            stored = list(HistoricalPrice.objects
+                          .filter(currency=currency, day__range=(start_day, end_day))
+                          .order_by("day")
+                          .values_list("day", "usd"))
+        except DatabaseError:
+            stored = []
+
+        if len(stored) == days:
+            return ([(time.mktime(day.timetuple()), usd) for (day, usd) in stored], "")
+
+        (history, msg) = CH.fetch_currency_history(currency, start_timestamp, end_timestamp)
+
+        if history is not None:
+            CH.store_currency_history(currency, history, set(day for (day, usd) in stored))
+
+        return (history, msg)
+
+
+    '''
+    Returns (index, msg) with the PriceSeriesIndex of the
+    daily values of a currency from PLAYGROUND_SERIES_START
+    to yesterday, read through get_currency_history.
+
+    Indexes are kept in CryptocurrenciesHelper.price_series_indexes
+    and only rebuilt once a day, when yesterday changes.
+    Concurrent callers share one build.
+    '''
+    @staticmethod
+    def get_price_series_index(currency):
+        CH = CryptocurrenciesHelper
+
+        end_day = datetime.date.today() - datetime.timedelta(days=1)
+
+        cached = CH.price_series_indexes.get(currency)
+        if cached is not None and cached[0] == end_day:
+            return (cached[1], "")
+
+        return CH.single_flight.do(("series", currency, end_day),
+                                   lambda: CH.load_price_series_index(currency, end_day))
+
+
+    @staticmethod
+    def load_price_series_index(currency, end_day):
+        CH = CryptocurrenciesHelper
+
+        start_day = datetime.datetime.strptime(
+            getattr(settings, "PLAYGROUND_SERIES_START", "2010-07-17"), "%Y-%m-%d").date()
+
+        (history, msg) = CH.get_currency_history(currency,
+                                                 time.mktime(start_day.timetuple()),
+                                                 time.mktime(end_day.timetuple()))
+
+        if history == None:
+            return (None, msg)
+
+        index = PriceSeriesIndex(history)
+        CH.price_series_indexes[currency] = (end_day, index)
+
+        return (index, "")
+
+
+    '''
+    Stores the past days of a (timestamp, value) history
+    in the HistoricalPrice table, skipping the days in
+    stored_days.
+    '''
+    @staticmethod
+    def store_currency_history(currency, history, stored_days=()):
+        today = datetime.date.today()
+
+        prices = []
+        for (timestamp, value) in history:
+            day = datetime.date.fromtimestamp(timestamp)
+            if day < today and day not in stored_days:
+                prices.append(HistoricalPrice(currency=currency, day=day, usd=value))
+
+        try:
+            with transaction.atomic():
+                HistoricalPrice.objects.bulk_create(prices)
+        except (IntegrityError, DatabaseError):
+            pass
+
+
+    '''
+    Fetches the daily USD values of a currency from
+    upstream, bypassing any cache.
+
+    Concurrent callers asking for the same range share
+    one upstream request.
+
+    Returns (history, msg) like get_currency_history.
+    '''
+    @staticmethod
+    def fetch_currency_history(currency, start_timestamp, end_timestamp):
+        CH = CryptocurrenciesHelper
+
+        return CH.single_flight.do(("history", currency, start_timestamp, end_timestamp),
+                                   lambda: CH.request_currency_history(currency,
+                                                                       start_timestamp,
+                                                                       end_timestamp))
+
+
+    '''
+    Requests the daily USD values of a currency from
+    cryptocompare with the bulk histoday call. Long ranges
+    are requested in pages of HISTODAY_PAGE_SIZE days,
+    newest first.
+
+    Returns (history, msg) like get_currency_history.
+    '''
+    @staticmethod
+    def request_currency_history(currency, start_timestamp, end_timestamp):
+        CH = CryptocurrenciesHelper
+
+        history = []
+        to_timestamp = int(end_timestamp)
+
+        while to_timestamp >= start_timestamp:
+            limit = max(1, min(CH.HISTODAY_PAGE_SIZE, int((to_timestamp - start_timestamp) // 86400)))
             try:
-                r = requests.get("https://min-api.cryptocompare.com"
-                    "/data/price?fsym=%s&tsyms=USD" % currency)
-                value = r.json().get("USD")
+                r = CH.http.get(CH.CRYPTOCOMPARE_URL +
+                    "/data/histoday?fsym=%s&tsym=USD&limit=%s&toTs=%s" % (currency, limit, to_timestamp))
+                data = r.json()["Data"]
+                page = [(point["time"], float(point["close"])) for point in data
+                        if start_timestamp <= point["time"] <= end_timestamp]
             except Exception:
                 return (None, "There was an error getting the currency value.")
 
+            if not data:
+                break
+
+            # Upstream must page backwards, or the loop would never end.
+            if data[0]["time"] - 86400 >= to_timestamp:
+                return (None, "There was an error getting the currency value.")
+
+            history = page + history
+            to_timestamp = data[0]["time"] - 86400
+
+        return (history, "")
+
+
+    '''
+    Fetches the USD value of a supported cryptocurrency
+    from upstream, bypassing any cache.
+
+    Concurrent callers asking for the same currency and
+    timestamp share one upstream request.
+
+    Returns (value, msg) like get_currency_value.
+    '''
+    @staticmethod
+    def fetch_currency_value(currency, timestamp=None):
+        CH = CryptocurrenciesHelper
+
+        return CH.single_flight.do(("currency", currency, timestamp),
+                                   lambda: CH.request_currency_value(currency, timestamp))
+
+
+    '''
+    Requests the USD value of a supported cryptocurrency
+    from the providers in CryptocurrenciesHelper.price_providers,
+    hedging across them if PLAYGROUND_PRICE_HEDGE_DELAY is set.
+
+    Returns (value, msg) like get_currency_value.
+    '''
+    @staticmethod
+    def request_currency_value(currency, timestamp=None):
+        CH = CryptocurrenciesHelper
+
+        value = CH.price_providers.get_value(CH.http, currency, timestamp)
+
+        if value is None:
+            return (None, "There was an error getting the currency value.")
 
         return (value, "")
 
 
+    '''
+    Returns the current value of every supported
+    cryptocurrency in every supported fiat currency:
+    {"BTC": {"USD": 7533.53, "EUR": 6401.2, "GBP": 5689.1}, ...}
+
+    Served from CryptocurrenciesHelper.rate_matrix_cache.
+
+    Returns (matrix, msg); matrix is None on error.
+    '''
+    @staticmethod
+    @metrics.stage("currency_fetch")
+    def get_rate_matrix():
+        CH = CryptocurrenciesHelper
+
+        return CH.rate_matrix_cache.get("matrix", CH.fetch_rate_matrix)
+
+
+    '''
+    Fetches the rate matrix from upstream, bypassing
+    any cache. Concurrent callers share one request.
+
+    Returns (matrix, msg) like get_rate_matrix.
+    '''
+    @staticmethod
+    def fetch_rate_matrix():
+        CH = CryptocurrenciesHelper
+
+        return CH.single_flight.do(("rates",), CH.request_rate_matrix)
+
+
+    '''
+    Requests the rate matrix from cryptocompare with a
+    single pricemulti call for every supported
+    cryptocurrency and fiat currency.
+
+    Returns (matrix, msg) like get_rate_matrix.
+    '''
+    @staticmethod
+    def request_rate_matrix():
+        CH = CryptocurrenciesHelper
+
+        try:
+            r = CH.http.get(CH.CRYPTOCOMPARE_URL + "/data/pricemulti?fsyms=%s&tsyms=%s"
+                            % (",".join(CH.SUPPORTED_CURRENCIES), ",".join(CH.SUPPORTED_FIATS)))
+            data = r.json()
+            matrix = dict((currency, dict((fiat, float(data[currency][fiat])) for fiat in CH.SUPPORTED_FIATS))
+                          for currency in CH.SUPPORTED_CURRENCIES)
+        except Exception:
+            return (None, "There was an error getting the currency value.")
+
+        return (matrix, "")
+
+
+    '''
+    Converts a USD price to a fiat currency with the cross
+    rate implied by the rate matrix: the value of every
+    supported cryptocurrency in the fiat currency over
+    its value in USD.
+
+    Returns the price rounded to cents.
+    '''
+    @staticmethod
+    def convert_from_usd(matrix, usd, fiat):
+        rate = (sum(rates[fiat] for rates in matrix.values()) /
+                sum(rates["USD"] for rates in matrix.values()))
+
+        return round(usd * rate, 2)
+
+
     '''
     Gets the price of an amazon product.
 
@@ -401,16 +1418,70 @@ class CryptocurrenciesHelper():
 
     If for any reason, the price cannot be found,
     it returns an error message.
+
+    Products tracked by PriceTracker are answered with
+    their latest tracked price, unless it is older than
+    PLAYGROUND_TRACKED_PRICE_MAX_AGE. Other results,
+    including failures, are served from
+    CryptocurrenciesHelper.product_price_cache.
     '''
     @staticmethod
+    @metrics.stage("product_fetch")
     def get_price_from_amazon(amz_product_id):
+        CH = CryptocurrenciesHelper
+
+        price = CH.product_catalog.tracked_price(
+            amz_product_id, getattr(settings, "PLAYGROUND_TRACKED_PRICE_MAX_AGE", 86400))
+
+        if price is not None:
+            return (price, amz_product_id, "")
+
+        return CH.product_price_cache.get(amz_product_id,
+                                          lambda: CH.fetch_price_from_amazon(amz_product_id))
+
+
+    '''
+    Fetches the price of an amazon product page,
+    bypassing any cache.
+
+    Concurrent callers asking for the same product share
+    one page download.
+
+    Returns (price, amz_product_id, msg) like
+    get_price_from_amazon.
+    '''
+    @staticmethod
+    def fetch_price_from_amazon(amz_product_id):
+        CH = CryptocurrenciesHelper
+
+        return CH.single_flight.do(("product", amz_product_id),
+                                   lambda: CH.request_price_from_amazon(amz_product_id))
+
+
+    '''
+    Downloads an amazon product page and reads the
+    price from it, in CryptocurrenciesHelper.parser_pool
+    if it is enabled.
+
+    Returns (price, amz_product_id, msg) like
+    get_price_from_amazon.
+    '''
+    @staticmethod
+    def request_price_from_amazon(amz_product_id):
+        CH = CryptocurrenciesHelper
+
         price = None
 
         try:
-            r = requests.get("https://www.amazon.com/gp/product/%s" % amz_product_id)
-            html = r.text
-            soup = bs(html, 'html.parser')
-            price_string = soup.find(id="priceblock_ourprice").get_text()
+            r = CH.http.get(CH.AMAZON_URL + "/gp/product/%s" % amz_product_id)
+            fast = getattr(settings, "PLAYGROUND_AMAZON_FAST_PARSE", True)
+            with CH.metrics.stage("html_parse"):
+                if CH.parser_pool.enabled:
+                    price_string = CH.parser_pool.find_price_string(r.content, r.encoding, fast)
+                else:
+                    price_string = AmazonPriceParser.find_price_string(r.text, fast)
+            if price_string is None:
+                raise ValueError("price element not found")
         except Exception:
             return (None, amz_product_id, "The price for the given product could not be found.")
 
@@ -423,11 +1494,14 @@ class CryptocurrenciesHelper():
 
 
     '''
-    Returns a random product from CryptocurrenciesHelper.RANDOM_PRODUCTS
+    Returns a random product from CryptocurrenciesHelper.product_catalog
     '''
     @staticmethod
     def get_random_amazon_product():
-        amz_product_id, price = random.choice(list(CryptocurrenciesHelper.RANDOM_PRODUCTS.items()))
+        (price, amz_product_id) = CryptocurrenciesHelper.product_catalog.random()
+
+        if price == None:
+            return (None, None, "There are no products to choose from.")
 
         return (price, amz_product_id, "")
 
@@ -0,0 +1,143 @@
+import datetime
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+
+'''
+Defines HTTP-level caching for the cryptocurrencies endpoint.
+
+Every response carries an ETag and a Cache-Control header, and
+conditional GETs with a matching If-None-Match get a 304.
+Answers about a given product on past dates never change, so
+they get PLAYGROUND_DATED_MAX_AGE. Answers about the current
+price, or about a random product, get PLAYGROUND_SPOT_MAX_AGE,
+and errors must be revalidated.
+
+If PLAYGROUND_RESPONSE_CACHE names a cache in CACHES, rendered
+bodies are also kept there for their max-age, keyed by the
+normalized query parameters.
+'''
+
+class HttpCacheHelper():
+
+    # currency_date, like a range without amz_product_id, picks a
+    # random product, so its answer changes.
+    DATED_RESPONSE_TYPES = ("currency_date_product", )
+
+    '''
+    Returns how many seconds a response may be cached,
+    based on the type of the request and the response.
+    '''
+    @staticmethod
+    def max_age_for(params, response_type, response):
+        HC = HttpCacheHelper
+
+        if response.get("response") != "ok":
+            return 0
+
+        spot_max_age = getattr(settings, "PLAYGROUND_SPOT_MAX_AGE", 30)
+        dated_max_age = getattr(settings, "PLAYGROUND_DATED_MAX_AGE", 86400)
+
+        if response_type in HC.DATED_RESPONSE_TYPES:
+            return dated_max_age if HC.is_past(params.get("date")) else spot_max_age
+
+        if response_type == "currency_range" and params.get("amz_product_id"):
+            return dated_max_age if HC.is_past(params.get("end")) else spot_max_age
+
+        return spot_max_age
+
+
+    '''
+    Returns whether a YYYY-MM-DD date is before today.
+    '''
+    @staticmethod
+    def is_past(date_string):
+        try:
+            day = datetime.datetime.strptime(date_string, "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            return False
+
+        return day < datetime.date.today()
+
+
+    '''
+    Returns the cache key for the query parameters,
+    independent of their order.
+    '''
+    @staticmethod
+    def cache_key(params):
+        if hasattr(params, "lists"):
+            items = params.lists()
+        else:
+            items = ((key, [value]) for (key, value) in params.items())
+
+        query = urlencode(sorted((key, sorted(values)) for (key, values) in items), doseq=True)
+
+        return "playground:cryptocurrencies:%s" % hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+
+    '''
+    Returns the configured response cache, or None if
+    server-side caching is disabled.
+    '''
+    @staticmethod
+    def response_cache():
+        alias = getattr(settings, "PLAYGROUND_RESPONSE_CACHE", None)
+        if alias is None:
+            return None
+        return caches[alias]
+
+
+    '''
+    Returns the (body, max_age) cached for the query
+    parameters, or None.
+    '''
+    @staticmethod
+    def get_cached(params):
+        HC = HttpCacheHelper
+
+        cache = HC.response_cache()
+        if cache is None:
+            return None
+
+        return cache.get(HC.cache_key(params))
+
+
+    '''
+    Caches a rendered body for its max-age.
+    Bodies that may not be cached are skipped.
+    '''
+    @staticmethod
+    def set_cached(params, body, max_age):
+        HC = HttpCacheHelper
+
+        cache = HC.response_cache()
+        if cache is None or max_age <= 0:
+            return
+
+        cache.set(HC.cache_key(params), (body, max_age), max_age)
+
+
+    '''
+    Returns the JSON response for a rendered body with its
+    ETag and Cache-Control headers, or a 304 if the request's
+    If-None-Match matches the ETag.
+    '''
+    @staticmethod
+    def conditional_response(request, body, max_age):
+        response = HttpResponse(body, content_type="application/json")
+
+        if max_age > 0:
+            patch_cache_control(response, public=True, max_age=max_age)
+        else:
+            patch_cache_control(response, no_cache=True, max_age=0)
+
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        response["ETag"] = etag
+
+        return get_conditional_response(request, etag=etag, response=response)
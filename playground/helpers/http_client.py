@@ -0,0 +1,221 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, RetryBudget
+
+
+'''
+Defines a shared HTTP client for upstream price sources.
+
+Each upstream host gets its own requests.Session mounted with
+a pooled HTTPAdapter, so connections are kept alive and reused
+across requests and threads. Every call carries a
+(connect, read) timeout so a slow upstream cannot hold a
+worker forever.
+
+If a RequestMetrics is given, every call is counted for its
+host, as an error if it raised or got a 5xx status.
+
+If breaker_options are given, each host also gets a
+CircuitBreaker built with them, and calls to a host whose
+breaker is open raise CircuitOpenError right away. Failed
+calls are retried up to max_retries times, as long as the
+host's RetryBudget allows it.
+'''
+
+class HttpClient():
+
+    def __init__(self, pool_maxsize=10, connect_timeout=3.05,
+                 read_timeout=10, pool_block=False, metrics=None,
+                 breaker_options=None, max_retries=0, retry_budget_options=None):
+        self.pool_maxsize = pool_maxsize
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_block = pool_block
+        self.metrics = metrics
+        self.breaker_options = breaker_options
+        self.max_retries = max_retries
+        self.retry_budget_options = retry_budget_options or {}
+        self._sessions = {}
+        self._breakers = {}
+        self._retry_budgets = {}
+        self._lock = threading.Lock()
+
+
+    '''
+    Builds a client from the PLAYGROUND_HTTP_*,
+    PLAYGROUND_BREAKER_* and PLAYGROUND_RETRY_BUDGET_*
+    values in the given settings object.
+    '''
+    @classmethod
+    def from_settings(cls, settings, metrics=None):
+        return cls(
+            pool_maxsize=getattr(settings, "PLAYGROUND_HTTP_POOL_MAXSIZE", 10),
+            connect_timeout=getattr(settings, "PLAYGROUND_HTTP_CONNECT_TIMEOUT", 3.05),
+            read_timeout=getattr(settings, "PLAYGROUND_HTTP_READ_TIMEOUT", 10),
+            pool_block=getattr(settings, "PLAYGROUND_HTTP_POOL_BLOCK", False),
+            metrics=metrics,
+            breaker_options=dict(
+                failure_rate=getattr(settings, "PLAYGROUND_BREAKER_FAILURE_RATE", 0.5),
+                min_calls=getattr(settings, "PLAYGROUND_BREAKER_MIN_CALLS", 20),
+                window=getattr(settings, "PLAYGROUND_BREAKER_WINDOW", 30),
+                open_seconds=getattr(settings, "PLAYGROUND_BREAKER_OPEN_SECONDS", 30),
+                half_open_trials=getattr(settings, "PLAYGROUND_BREAKER_HALF_OPEN_TRIALS", 3)),
+            max_retries=getattr(settings, "PLAYGROUND_HTTP_MAX_RETRIES", 1),
+            retry_budget_options=dict(
+                ratio=getattr(settings, "PLAYGROUND_RETRY_BUDGET_RATIO", 0.1),
+                min_per_second=getattr(settings, "PLAYGROUND_RETRY_BUDGET_MIN_PER_SECOND", 1)))
+
+
+    '''
+    Performs a GET request through the session for the
+    url's host. A timeout is applied unless one is given.
+
+    Raises CircuitOpenError if the host's breaker is open.
+    Errors and 5xx responses are retried within the host's
+    retry budget; the last one is raised or returned.
+    '''
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+
+        if self.breaker_options is None and self.max_retries == 0:
+            return self.send(url, **kwargs)
+
+        breaker = self.breaker_for(url)
+        retry_budget = self.retry_budget_for(url)
+        retry_budget.record_call()
+        retries = 0
+
+        while True:
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError("The circuit breaker for %s is open." % urlsplit(url).netloc)
+
+            try:
+                response = self.send(url, **kwargs)
+            except Exception:
+                if breaker is not None:
+                    breaker.record(False)
+                if retries < self.max_retries and retry_budget.try_retry():
+                    retries += 1
+                    continue
+                raise
+
+            failed = response.status_code >= 500
+            if breaker is not None:
+                breaker.record(not failed)
+            if failed and retries < self.max_retries and retry_budget.try_retry():
+                retries += 1
+                continue
+            return response
+
+
+    '''
+    Performs a single GET request, counting it in
+    metrics if there are any.
+    '''
+    def send(self, url, **kwargs):
+        if self.metrics is None:
+            return self.session_for(url).get(url, **kwargs)
+
+        try:
+            response = self.session_for(url).get(url, **kwargs)
+        except Exception:
+            self.metrics.count_upstream(url, error=True)
+            raise
+        self.metrics.count_upstream(url, error=response.status_code >= 500)
+        return response
+
+
+    '''
+    Returns the circuit breaker for the url's host,
+    or None if breakers are disabled.
+    '''
+    def breaker_for(self, url):
+        if self.breaker_options is None:
+            return None
+
+        host = urlsplit(url).netloc
+
+        breaker = self._breakers.get(host)
+        if breaker is not None:
+            return breaker
+
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(**self.breaker_options)
+
+        return breaker
+
+
+    '''
+    Returns the retry budget for the url's host.
+    '''
+    def retry_budget_for(self, url):
+        host = urlsplit(url).netloc
+
+        retry_budget = self._retry_budgets.get(host)
+        if retry_budget is not None:
+            return retry_budget
+
+        with self._lock:
+            retry_budget = self._retry_budgets.get(host)
+            if retry_budget is None:
+                retry_budget = self._retry_budgets[host] = RetryBudget(**self.retry_budget_options)
+
+        return retry_budget
+
+
+    '''
+    Returns the breaker state and retry counts per host:
+    {host: dict(state=..., calls=..., failures=..., rejected=...,
+                opened=..., retries=..., exhausted=...)}
+    '''
+    def status(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+            retry_budgets = dict(self._retry_budgets)
+
+        status = {}
+        for (host, retry_budget) in retry_budgets.items():
+            status[host] = retry_budget.status()
+        for (host, breaker) in breakers.items():
+            status.setdefault(host, {}).update(breaker.status())
+        return status
+
+
+    '''
+    Returns the session that owns the connection pool
+    for the url's scheme and host, creating it if needed.
+    '''
+    def session_for(self, url):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+
+        session = self._sessions.get(key)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self.pool_maxsize,
+                                      pool_block=self.pool_block)
+                session.mount("%s://" % parts.scheme, adapter)
+                self._sessions[key] = session
+
+        return session
+
+
+    '''
+    Closes every session and its pooled connections.
+    '''
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
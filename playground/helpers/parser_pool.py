@@ -0,0 +1,153 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .amazon_parser import AmazonPriceParser
+
+
+'''
+Defines an optional pool of processes that read prices out
+of amazon product pages.
+
+Parsing a page is CPU bound and holds the GIL, so in a
+threaded server it stalls every other request of the same
+process. With a pool, the raw page bytes are sent to one of
+`processes` worker processes and only the price string comes
+back, so parsing runs on other cores.
+
+At most `max_pending` pages are handed to the pool at once.
+When it is saturated, or if its processes died, the page is
+parsed in the calling thread instead, so a burst never waits
+on the pool. Workers are started with the spawn method, so
+they do not inherit the locks and threads of the server.
+
+With `warm_start`, start() launches every worker and has it
+import BeautifulSoup before returning, so the first requests
+do not pay for it. Otherwise the pool starts on first use.
+A pool with 0 processes is disabled.
+'''
+
+class ParserPool():
+
+    def __init__(self, processes=0, max_pending=None, warm_start=True):
+        self.processes = processes
+        self.max_pending = max_pending or processes
+        self.warm_start = warm_start
+        self.executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(self.max_pending, 1))
+        self._counters = dict(offloaded=0, inline=0, broken=0, pending=0)
+
+
+    '''
+    Builds a pool from the PLAYGROUND_PARSER_* settings.
+    '''
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(processes=getattr(settings, "PLAYGROUND_PARSER_PROCESSES", 0),
+                   max_pending=getattr(settings, "PLAYGROUND_PARSER_MAX_PENDING", None),
+                   warm_start=getattr(settings, "PLAYGROUND_PARSER_WARM_START", True))
+
+
+    @property
+    def enabled(self):
+        return self.processes > 0
+
+
+    '''
+    Starts the worker processes, warming them up if
+    warm_start is set, and returns the executor.
+    Does nothing if they are already running. If they
+    die while warming up, the executor is discarded and
+    BrokenProcessPool is raised.
+    '''
+    def start(self):
+        with self._lock:
+            if self.executor is not None:
+                return self.executor
+
+            self.executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                mp_context=multiprocessing.get_context("spawn"))
+            executor = self.executor
+
+        if self.warm_start:
+            try:
+                for future in [executor.submit(AmazonPriceParser.warm_up) for n in range(self.processes)]:
+                    future.result()
+            except BrokenProcessPool:
+                self._discard(executor)
+                raise
+
+        return executor
+
+
+    '''
+    Stops the worker processes.
+    '''
+    def stop(self):
+        with self._lock:
+            (executor, self.executor) = (self.executor, None)
+
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+    '''
+    Returns the price string of a page given as raw bytes,
+    like AmazonPriceParser.find_price_string, parsed in
+    the pool unless it is disabled or saturated.
+    '''
+    def find_price_string(self, content, encoding=None, fast=True):
+        APP = AmazonPriceParser
+
+        if not self.enabled or not self._slots.acquire(blocking=False):
+            self._count("inline")
+            return APP.find_price_string_in_bytes(content, encoding, fast)
+
+        executor = None
+        try:
+            self._count("pending")
+            executor = self.start()
+            price_string = executor.submit(APP.find_price_string_in_bytes, content, encoding, fast).result()
+        except BrokenProcessPool:
+            self._count("broken")
+            self._discard(executor)
+        else:
+            self._count("offloaded")
+            return price_string
+        finally:
+            self._count("pending", -1)
+            self._slots.release()
+
+        self._count("inline")
+        return APP.find_price_string_in_bytes(content, encoding, fast)
+
+
+    '''
+    Forgets an executor whose processes died, so the
+    next call starts a new one.
+    '''
+    def _discard(self, executor):
+        if executor is None:
+            return
+
+        with self._lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False)
+
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+
+    '''
+    Returns how many pages were parsed in the pool and
+    in the calling thread, how many are in the pool now,
+    and how many times the pool broke.
+    '''
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, processes=self.processes, max_pending=self.max_pending)
@@ -0,0 +1,267 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+import math
+import time
+
+from django.db import transaction
+
+from ..models import HistoricalPrice
+
+
+'''
+Defines a bulk import of daily prices into the
+HistoricalPrice table, which get_currency_value reads dated
+prices from.
+
+Dumps are CSV files with currency, date (or day) and usd
+columns, JSON arrays or JSON Lines of objects with the same
+keys, optionally gzipped. They are read row by row and
+written in chunks of `chunk_size` rows, each chunk in its
+own transaction, so memory use does not grow with the size
+of the dump.
+
+Rows already in the table are left alone, unless `update`
+is set and their value differs, so importing the same dump
+again changes nothing. Days from today on are skipped, like
+CryptocurrenciesHelper.store_currency_history does, since
+their price is not final.
+'''
+
+class PriceBackfill():
+
+    FORMATS = ("csv", "json", "jsonl")
+
+    def __init__(self, chunk_size=5000, update=False, progress=None, progress_interval=1.0):
+        self.chunk_size = chunk_size
+        self.update = update
+        self.progress = progress
+        self.progress_interval = progress_interval
+
+
+    '''
+    Imports a dump and returns its counts:
+    dict(read=..., inserted=..., updated=..., unchanged=...,
+         skipped=..., seconds=..., rows_per_sec=...)
+
+    If a progress callable was given, it is called with the
+    counts so far at most every progress_interval seconds.
+    Rows that cannot be parsed are counted as skipped.
+    '''
+    def import_file(self, path, format=None):
+        stats = dict(read=0, inserted=0, updated=0, unchanged=0, skipped=0)
+        start = time.perf_counter()
+        reported_at = start
+        today = datetime.date.today()
+        chunk = {}
+
+        with PriceBackfill.open_dump(path) as f:
+            for row in PriceBackfill.read_rows(f, format or PriceBackfill.format_for(path, f)):
+                stats["read"] += 1
+                try:
+                    (currency, day, usd) = PriceBackfill.parse_row(row)
+                except (KeyError, TypeError, ValueError):
+                    stats["skipped"] += 1
+                    continue
+
+                if day >= today:
+                    stats["skipped"] += 1
+                    continue
+
+                chunk[(currency, day)] = usd
+                if len(chunk) >= self.chunk_size:
+                    self.write_chunk(chunk, stats)
+                    chunk = {}
+
+                    now = time.perf_counter()
+                    if self.progress is not None and now - reported_at >= self.progress_interval:
+                        self.progress(PriceBackfill.with_rate(stats, now - start))
+                        reported_at = now
+
+        if chunk:
+            self.write_chunk(chunk, stats)
+
+        return PriceBackfill.with_rate(stats, time.perf_counter() - start)
+
+
+    @staticmethod
+    def with_rate(stats, seconds):
+        return dict(stats, seconds=seconds, rows_per_sec=stats["read"] / seconds if seconds else 0.0)
+
+
+    '''
+    Writes a chunk of {(currency, day): usd} in one
+    transaction, inserting the missing rows with a single
+    bulk insert, and adds its counts to stats.
+    '''
+    def write_chunk(self, chunk, stats):
+        currencies = set(currency for (currency, day) in chunk)
+        days = [day for (currency, day) in chunk]
+
+        with transaction.atomic():
+            existing = {}
+            for (currency, day, usd) in (HistoricalPrice.objects
+                                         .filter(currency__in=currencies, day__range=(min(days), max(days)))
+                                         .values_list("currency", "day", "usd")):
+                if (currency, day) in chunk:
+                    existing[(currency, day)] = usd
+
+            HistoricalPrice.objects.bulk_create(
+                [HistoricalPrice(currency=currency, day=day, usd=usd)
+                 for ((currency, day), usd) in chunk.items() if (currency, day) not in existing],
+                batch_size=self.chunk_size)
+
+            for ((currency, day), usd) in existing.items():
+                if not self.update or usd == chunk[(currency, day)]:
+                    stats["unchanged"] += 1
+                    continue
+                HistoricalPrice.objects.filter(currency=currency, day=day).update(usd=chunk[(currency, day)])
+                stats["updated"] += 1
+
+        stats["inserted"] += len(chunk) - len(existing)
+
+
+    '''
+    Returns (currency, day, usd) for a row read from a dump.
+    Raises KeyError, TypeError or ValueError if it is invalid.
+    '''
+    @staticmethod
+    def parse_row(row):
+        currency = PriceBackfill.get_string(row, "currency").strip().upper()
+        if not currency or len(currency) > 10:
+            raise ValueError("invalid currency %r" % row["currency"])
+
+        date = row.get("date", row.get("day"))
+        if not isinstance(date, str):
+            raise TypeError("invalid date %r" % date)
+        day = datetime.datetime.strptime(date.strip(), "%Y-%m-%d").date()
+
+        usd = float(row["usd"])
+        if math.isnan(usd) or usd < 0:
+            raise ValueError("invalid price %r" % row["usd"])
+
+        return (currency, day, usd)
+
+
+    '''
+    Returns the value of a column of a row, raising
+    TypeError if it is not a string.
+    '''
+    @staticmethod
+    def get_string(row, key):
+        value = row[key]
+        if not isinstance(value, str):
+            raise TypeError("invalid %s %r" % (key, value))
+        return value
+
+
+    '''
+    Opens a dump as text, decompressing it if its name
+    ends with .gz.
+    '''
+    @staticmethod
+    def open_dump(path):
+        if path.endswith(".gz"):
+            return gzip.open(path, "rt", encoding="utf-8", newline="")
+        return io.open(path, "r", encoding="utf-8", newline="")
+
+
+    '''
+    Returns the format of a dump from its extension: csv,
+    jsonl for .jsonl and .ndjson, and for .json either json
+    (an array) or jsonl, depending on its first character.
+    '''
+    @staticmethod
+    def format_for(path, f):
+        name = path[:-3] if path.endswith(".gz") else path
+        extension = name.rsplit(".", 1)[-1].lower()
+
+        if extension == "csv":
+            return "csv"
+        if extension in ("jsonl", "ndjson"):
+            return "jsonl"
+        if extension == "json":
+            first = f.read(1)
+            while first.isspace():
+                first = f.read(1)
+            f.seek(0)
+            return "json" if first == "[" else "jsonl"
+
+        raise ValueError("Cannot tell the format of %s, please give it." % path)
+
+
+    '''
+    Yields the rows of an open dump as dicts.
+    '''
+    @staticmethod
+    def read_rows(f, format):
+        if format == "csv":
+            return csv.DictReader(f)
+        if format == "jsonl":
+            return PriceBackfill.read_json_lines(f)
+        if format == "json":
+            return PriceBackfill.read_json_array(f)
+        raise ValueError("Unknown format %r, expected one of %s." % (format, PriceBackfill.FORMATS))
+
+
+    '''
+    Yields the object on each line of a JSON Lines dump,
+    or None for a line that is not valid JSON, so that
+    parse_row rejects it and the import goes on.
+    '''
+    @staticmethod
+    def read_json_lines(f):
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+    '''
+    Yields the items of a JSON array one at a time, reading
+    the file in blocks instead of loading it whole.
+    '''
+    @staticmethod
+    def read_json_array(f, block_size=65536):
+        decoder = json.JSONDecoder()
+        buffer = ""
+        position = 0
+        started = False
+
+        while True:
+            block = f.read(block_size)
+            buffer = buffer[position:] + block
+            position = 0
+
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position == len(buffer):
+                    break
+
+                if not started:
+                    if buffer[position] != "[":
+                        raise ValueError("Expected a JSON array.")
+                    started = True
+                    position += 1
+                    continue
+
+                if buffer[position] == "]":
+                    return
+
+                try:
+                    (item, end) = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    if not block:
+                        raise
+                    break
+                yield item
+                position = end
+
+            if not block:
+                raise ValueError("Unexpected end of the JSON array.")
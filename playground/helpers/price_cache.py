@@ -0,0 +1,198 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+'''
+Defines in-process caches for upstream prices.
+
+SpotPriceCache holds cryptocurrency spot prices.
+
+Its entries are served fresh for `ttl` seconds. After that, and
+for up to `stale_ttl` more seconds, the cached value is still
+returned immediately while a single background refresh runs.
+Entries older than ttl + stale_ttl are loaded synchronously.
+
+ProductPriceCache holds amazon product prices keyed by ASIN,
+including failed lookups for a shorter time.
+'''
+
+class SpotPriceCache():
+
+    def __init__(self, ttl=30, stale_ttl=300):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._counters = dict(hits=0, stale_hits=0, misses=0,
+                              refreshes=0, errors=0)
+
+
+    '''
+    Returns the (value, msg) tuple cached under key.
+
+    loader is called with no arguments and must return a
+    (value, msg) tuple, as CryptocurrenciesHelper does.
+    Only results with a value other than None are cached.
+    '''
+    def get(self, key, loader):
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                (value, stored_at) = entry
+                age = now - stored_at
+
+                if age < self.ttl:
+                    self._counters["hits"] += 1
+                    return (value, "")
+
+                if age < self.ttl + self.stale_ttl:
+                    self._counters["stale_hits"] += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(target=self._refresh,
+                                         args=(key, loader),
+                                         daemon=True).start()
+                    return (value, "")
+
+            self._counters["misses"] += 1
+
+        return self._load(key, loader)
+
+
+    '''
+    Stores a value as if it had just been loaded.
+    '''
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+
+
+    '''
+    Drops every cached entry. Counters are kept.
+    '''
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+    '''
+    Returns a copy of the hit/miss counters along with
+    the number of cached entries.
+    '''
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+        return stats
+
+
+    def _load(self, key, loader):
+        (value, msg) = loader()
+
+        with self._lock:
+            if value is not None:
+                self._entries[key] = (value, time.time())
+            else:
+                self._counters["errors"] += 1
+
+        return (value, msg)
+
+
+    def _refresh(self, key, loader):
+        try:
+            self._load(key, loader)
+            with self._lock:
+                self._counters["refreshes"] += 1
+        except Exception:
+            with self._lock:
+                self._counters["errors"] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+'''
+An LRU cache of amazon product price lookups.
+
+Results with a price are kept for `ttl` seconds. Failed
+lookups (no price) are kept for `negative_ttl` seconds so
+invalid ids do not cost a page download on every request.
+At most `max_entries` results are kept; the least recently
+used one is evicted first.
+'''
+class ProductPriceCache():
+
+    def __init__(self, ttl=3600, negative_ttl=60, max_entries=1024):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict(hits=0, negative_hits=0, misses=0,
+                              evictions=0)
+
+
+    '''
+    Returns the (price, amz_product_id, msg) tuple cached
+    under amz_product_id, calling loader on a miss.
+    '''
+    def get(self, amz_product_id, loader):
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(amz_product_id)
+            if entry is not None:
+                (result, expires_at) = entry
+                if now < expires_at:
+                    self._entries.move_to_end(amz_product_id)
+                    if result[0] is None:
+                        self._counters["negative_hits"] += 1
+                    else:
+                        self._counters["hits"] += 1
+                    return result
+                del self._entries[amz_product_id]
+
+            self._counters["misses"] += 1
+
+        result = loader()
+        self.set(amz_product_id, result)
+
+        return result
+
+
+    '''
+    Stores a lookup result, evicting the least recently
+    used entries beyond max_entries.
+    '''
+    def set(self, amz_product_id, result):
+        ttl = self.ttl if result[0] is not None else self.negative_ttl
+
+        with self._lock:
+            self._entries[amz_product_id] = (result, time.time() + ttl)
+            self._entries.move_to_end(amz_product_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+
+    '''
+    Drops every cached entry. Counters are kept.
+    '''
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+    '''
+    Returns a copy of the hit/miss counters along with
+    the number of cached entries.
+    '''
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+        return stats
@@ -0,0 +1,218 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .cryptocurrencies_helper import CryptocurrenciesHelper
+
+
+'''
+Defines a background refresher that keeps the spot price of
+every supported currency, the fiat rate matrix, and the price
+of every product in CryptocurrenciesHelper.RANDOM_PRODUCTS,
+fresh in the helper's caches, so request threads do not wait
+on upstream calls.
+
+Currency prices and rates are refreshed every `interval`
+seconds, and product prices every `product_interval` seconds,
+which by default is a bit less than the TTL of the product
+price cache, so each page is scraped about once per TTL and
+cached prices do not expire. Refreshes are spread by
+`jitter` (a fraction of the interval) so they do not line
+up. After a failure, the value is retried with an
+exponential backoff capped at `max_backoff` seconds.
+
+The helper's caches are in the memory of each process, so
+the prewarmer only helps the process it runs in. It is
+started by PlaygroundConfig.ready() in every process serving
+requests when PLAYGROUND_PREWARM_ON_STARTUP is set, and
+the status of each value is reported at the metrics
+endpoint.
+'''
+
+class PricePrewarmer():
+
+    shared_instance = None
+    shared_lock = threading.Lock()
+
+    def __init__(self, interval=20, jitter=0.1, max_backoff=300, product_interval=None):
+        self.interval = interval
+        self.product_interval = product_interval or \
+            CryptocurrenciesHelper.product_price_cache.ttl * (1 - jitter)
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._status = {}
+
+        for key in self.keys():
+            self._status[key] = dict(last_refreshed=None, last_error=None,
+                                     failures=0, next_run=0)
+
+
+    '''
+    Returns the prewarmer used by the running process,
+    built from the PLAYGROUND_PREWARM_* settings.
+    '''
+    @classmethod
+    def shared(cls):
+        with cls.shared_lock:
+            if cls.shared_instance is None:
+                cls.shared_instance = cls(
+                    interval=getattr(settings, "PLAYGROUND_PREWARM_INTERVAL", 20),
+                    jitter=getattr(settings, "PLAYGROUND_PREWARM_JITTER", 0.1),
+                    max_backoff=getattr(settings, "PLAYGROUND_PREWARM_MAX_BACKOFF", 300),
+                    product_interval=getattr(settings, "PLAYGROUND_PREWARM_PRODUCT_INTERVAL", None))
+        return cls.shared_instance
+
+
+    '''
+    Returns the keys of every value kept fresh:
+    ("currency", "BTC"), ..., ("rates", "matrix"),
+    ("product", "B01MQWUXZS"), ...
+    '''
+    @staticmethod
+    def keys():
+        CH = CryptocurrenciesHelper
+
+        return ([("currency", currency) for currency in CH.SUPPORTED_CURRENCIES] +
+                [("rates", "matrix")] +
+                [("product", amz_product_id) for amz_product_id in CH.RANDOM_PRODUCTS])
+
+
+    '''
+    Starts refreshing in a daemon thread.
+    Does nothing if it is already running.
+    '''
+    def start(self):
+        with self._lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self._stop.clear()
+            self.thread = threading.Thread(target=self.run, name="price-prewarmer", daemon=True)
+            self.thread.start()
+
+
+    '''
+    Asks the refresh loop to stop and waits for it.
+    '''
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+    '''
+    Refreshes values as they come due until stopped.
+
+    on_refresh, if given, is called with the key and the
+    status of every value after it is refreshed.
+    '''
+    def run(self, on_refresh=None):
+        while not self._stop.is_set():
+            for key in self.due_keys():
+                if self._stop.is_set():
+                    break
+                status = self.refresh(key)
+                if on_refresh is not None:
+                    on_refresh(key, status)
+
+            self._stop.wait(self.seconds_until_next_run())
+
+
+    '''
+    Refreshes every value once, regardless of schedule.
+
+    Returns the status of every value.
+    '''
+    def refresh_all(self):
+        for key in self.keys():
+            self.refresh(key)
+        return self.status()
+
+
+    '''
+    Fetches one value from upstream, stores it in the
+    helper's cache and schedules its next refresh.
+
+    Returns the status of the value.
+    '''
+    def refresh(self, key):
+        CH = CryptocurrenciesHelper
+
+        (kind, name) = key
+        error = None
+
+        try:
+            if kind == "currency":
+                (value, msg) = CH.fetch_currency_value(name)
+                if value is not None:
+                    CH.spot_price_cache.set(name, value)
+                else:
+                    error = msg
+            elif kind == "rates":
+                (matrix, msg) = CH.fetch_rate_matrix()
+                if matrix is not None:
+                    CH.rate_matrix_cache.set(name, matrix)
+                else:
+                    error = msg
+            else:
+                result = CH.fetch_price_from_amazon(name)
+                if result[0] is not None:
+                    CH.product_price_cache.set(name, result)
+                else:
+                    error = result[2]
+        except Exception as e:
+            error = str(e)
+
+        interval = self.product_interval if kind == "product" else self.interval
+
+        now = time.time()
+        with self._lock:
+            status = self._status[key]
+            if error is None:
+                status["last_refreshed"] = now
+                status["last_error"] = None
+                status["failures"] = 0
+                delay = interval
+            else:
+                status["last_error"] = error
+                status["failures"] += 1
+                delay = min(interval * 2 ** status["failures"], self.max_backoff)
+
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+            status["next_run"] = now + delay
+
+            return dict(status)
+
+
+    '''
+    Returns the keys whose next refresh is due.
+    '''
+    def due_keys(self):
+        now = time.time()
+        with self._lock:
+            return [key for (key, status) in self._status.items()
+                    if status["next_run"] <= now]
+
+
+    '''
+    Returns how long the loop can sleep before
+    the next refresh is due.
+    '''
+    def seconds_until_next_run(self):
+        with self._lock:
+            next_run = min(status["next_run"] for status in self._status.values())
+        return max(0, next_run - time.time())
+
+
+    '''
+    Returns a copy of the status of every value:
+    when it was last refreshed, the last error,
+    the consecutive failures and the next refresh.
+    '''
+    def status(self):
+        with self._lock:
+            return dict((key, dict(status)) for (key, status) in self._status.items())
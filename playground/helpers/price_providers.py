@@ -0,0 +1,221 @@
+import datetime
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+'''
+Defines the sources of cryptocurrency prices.
+
+A PriceProvider knows the URLs of one source and how to parse
+its responses. PriceProviderRegistry holds the providers in
+order of preference and looks prices up through them.
+
+With a hedge_delay, a lookup is sent to the first provider,
+and if it has not answered within hedge_delay seconds (or it
+failed), the same lookup is sent to the next one, and so on.
+The first valid answer wins. Without a hedge_delay, or with
+a single provider, the providers are only tried in turn after
+a failure, in the calling thread.
+'''
+
+class PriceProvider():
+
+    name = None
+
+    def __init__(self, url=None):
+        self.url = url
+
+
+    '''
+    Returns the USD value of the currency, now or on the
+    day of the timestamp, through the given HttpClient.
+    Raises on any error.
+    '''
+    def get_value(self, http, currency, timestamp=None):
+        if timestamp is None:
+            r = http.get(self.spot_url(currency))
+            return self.parse_spot(currency, r.json())
+
+        r = http.get(self.historical_url(currency, timestamp))
+        return self.parse_historical(currency, timestamp, r.json())
+
+
+class CryptoCompareProvider(PriceProvider):
+
+    name = "cryptocompare"
+
+    def spot_url(self, currency):
+        return self.url + "/data/price?fsym=%s&tsyms=USD" % currency
+
+    def historical_url(self, currency, timestamp):
+        return self.url + "/data/pricehistorical?fsym=%s&tsyms=USD&ts=%s" % (currency, timestamp)
+
+    def parse_spot(self, currency, data):
+        return float(data["USD"])
+
+    def parse_historical(self, currency, timestamp, data):
+        return float(data[currency]["USD"])
+
+
+class CoinbaseProvider(PriceProvider):
+
+    name = "coinbase"
+
+    def spot_url(self, currency):
+        return self.url + "/v2/prices/%s-USD/spot" % currency
+
+    def historical_url(self, currency, timestamp):
+        return self.url + "/v2/prices/%s-USD/spot?date=%s" % (currency, datetime.date.fromtimestamp(timestamp))
+
+    def parse_spot(self, currency, data):
+        return float(data["data"]["amount"])
+
+    def parse_historical(self, currency, timestamp, data):
+        return float(data["data"]["amount"])
+
+
+'''
+A provider that answers from a dict of prices without any
+network access, after an optional delay, or fails with the
+given error. For tests and offline development.
+'''
+class FakePriceProvider(PriceProvider):
+
+    name = "fake"
+
+    PRICES = {"BTC" : 7540.35, "LTC" : 61.47, "ETH" : 298.88}
+
+    def __init__(self, url=None, prices=None, delay=0, error=None):
+        PriceProvider.__init__(self, url)
+        self.prices = dict(prices if prices is not None else FakePriceProvider.PRICES)
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def get_value(self, http, currency, timestamp=None):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return float(self.prices[currency])
+
+
+class PriceProviderRegistry():
+
+    PROVIDER_CLASSES = {
+        "cryptocompare" : CryptoCompareProvider,
+        "coinbase" : CoinbaseProvider,
+        "fake" : FakePriceProvider,
+    }
+
+    def __init__(self, providers=(), hedge_delay=None, max_workers=10):
+        self.providers = list(providers)
+        self.hedge_delay = hedge_delay
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._counters = dict(lookups=0, hedges=0, failures=0, wins={})
+
+
+    '''
+    Builds a registry from PLAYGROUND_PRICE_PROVIDERS, a
+    list of provider names in order of preference, with
+    their URLs from PLAYGROUND_<NAME>_URL, and from the
+    PLAYGROUND_PRICE_HEDGE_* values.
+    '''
+    @classmethod
+    def from_settings(cls, settings):
+        registry = cls(
+            hedge_delay=getattr(settings, "PLAYGROUND_PRICE_HEDGE_DELAY", None),
+            max_workers=getattr(settings, "PLAYGROUND_PRICE_HEDGE_WORKERS", 10))
+
+        default_urls = {"cryptocompare" : "https://min-api.cryptocompare.com",
+                        "coinbase" : "https://api.coinbase.com"}
+
+        for name in getattr(settings, "PLAYGROUND_PRICE_PROVIDERS", ["cryptocompare"]):
+            url = getattr(settings, "PLAYGROUND_%s_URL" % name.upper(), default_urls.get(name))
+            registry.register(cls.PROVIDER_CLASSES[name](url))
+
+        return registry
+
+
+    '''
+    Adds a provider after the ones already registered.
+    '''
+    def register(self, provider):
+        self.providers.append(provider)
+
+
+    '''
+    Returns the USD value of the currency, now or on the
+    day of the timestamp, from the first provider to give
+    a valid answer, or None if none of them did.
+    With a single provider there is nothing to hedge
+    with, so it is asked in the calling thread.
+    '''
+    def get_value(self, http, currency, timestamp=None):
+        with self._lock:
+            self._counters["lookups"] += 1
+
+        if self.hedge_delay is None or len(self.providers) <= 1:
+            for provider in self.providers:
+                value = self._lookup(provider, http, currency, timestamp)
+                if value is not None:
+                    return self._won(provider, value)
+            return self._failed()
+
+        providers = iter(self.providers)
+        pending = {}
+        while True:
+            provider = next(providers, None)
+            if provider is not None:
+                if pending:
+                    with self._lock:
+                        self._counters["hedges"] += 1
+                pending[self.executor.submit(self._lookup, provider, http, currency, timestamp)] = provider
+            elif not pending:
+                return self._failed()
+
+            (done, _) = wait(pending, timeout=self.hedge_delay if provider is not None else None,
+                             return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = pending.pop(future)
+                if future.result() is not None:
+                    return self._won(provider, future.result())
+
+
+    def _lookup(self, provider, http, currency, timestamp):
+        try:
+            value = provider.get_value(http, currency, timestamp)
+        except Exception:
+            return None
+        if value is None or math.isnan(value) or value < 0:
+            return None
+        return value
+
+
+    def _won(self, provider, value):
+        with self._lock:
+            wins = self._counters["wins"]
+            wins[provider.name] = wins.get(provider.name, 0) + 1
+        return value
+
+
+    def _failed(self):
+        with self._lock:
+            self._counters["failures"] += 1
+        return None
+
+
+    '''
+    Returns how many lookups were made, how many hedged
+    requests were sent, how many lookups failed and how
+    many each provider won.
+    '''
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["wins"] = dict(stats["wins"])
+        return stats
@@ -0,0 +1,89 @@
+import bisect
+import datetime
+
+
+'''
+Defines an index over the daily price series of a currency
+that finds the first and last days its price reached a
+threshold.
+
+Next to the prices, the index keeps their running maximum
+from the first day (never decreasing), their running
+maximum from the last day backwards (never increasing),
+and their running minimum from the last day backwards
+(never decreasing). Each of those is sorted, so every
+question below is one binary search, however long the
+series is:
+
+- first day the price was at least the threshold:
+  the first running maximum that reaches it;
+- last day the price was at least the threshold:
+  the last backward running maximum that reaches it;
+- last day the price was below the threshold:
+  the last backward running minimum below it.
+
+Building the index is linear in the number of days.
+'''
+
+class PriceSeriesIndex():
+
+    def __init__(self, history):
+        self.days = [datetime.date.fromtimestamp(timestamp) for (timestamp, value) in history]
+        self.values = [value for (timestamp, value) in history]
+
+        self.running_max = []
+        highest = float("-inf")
+        for value in self.values:
+            highest = max(highest, value)
+            self.running_max.append(highest)
+
+        # Kept negated, so that bisect sees it in ascending order.
+        self.negated_max_after = [0.0] * len(self.values)
+        self.min_after = [0.0] * len(self.values)
+        (highest, lowest) = (float("-inf"), float("inf"))
+        for index in range(len(self.values) - 1, -1, -1):
+            highest = max(highest, self.values[index])
+            lowest = min(lowest, self.values[index])
+            self.negated_max_after[index] = -highest
+            self.min_after[index] = lowest
+
+
+    def __len__(self):
+        return len(self.days)
+
+
+    @property
+    def start_day(self):
+        return self.days[0] if self.days else None
+
+
+    @property
+    def end_day(self):
+        return self.days[-1] if self.days else None
+
+
+    '''
+    Returns the first day the price was at least the
+    threshold, or None if it never was.
+    '''
+    def first_at_least(self, threshold):
+        index = bisect.bisect_left(self.running_max, threshold)
+        return self.days[index] if index < len(self.days) else None
+
+
+    '''
+    Returns the last day the price was at least the
+    threshold, or None if it never was.
+    '''
+    def last_at_least(self, threshold):
+        index = bisect.bisect_right(self.negated_max_after, -threshold) - 1
+        return self.days[index] if index >= 0 else None
+
+
+    '''
+    Returns the last day the price was below the
+    threshold, or None if it never was.
+    '''
+    def last_below(self, threshold):
+        index = bisect.bisect_left(self.min_after, threshold) - 1
+        return self.days[index] if index >= 0 else None
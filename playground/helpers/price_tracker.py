@@ -0,0 +1,270 @@
+import collections
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from ..models import Product, TrackedPrice
+from .cryptocurrencies_helper import CryptocurrenciesHelper
+
+
+'''
+Defines a background tracker of amazon product prices.
+
+Every `interval` seconds, each tracked ASIN is put on a
+queue of at most `queue_size` jobs, which `workers` threads
+take from and scrape, so however many ASINs are tracked, at
+most that many pages are downloaded at once and at most
+that many wait. An ASIN already waiting or being scraped is
+not queued again, and jobs that do not fit are dropped until
+the next round.
+
+Before each download, a worker waits for the per-host
+RateLimiter, so amazon sees at most `rate_per_host` requests
+per second from the tracker, with bursts of `burst`.
+
+Each scraped price is added to the TrackedPrice history,
+written to the Product table, and handed to the helper's
+product catalog, which request paths read the latest tracked
+price from instead of scraping the page themselves.
+'''
+
+class PriceTracker():
+
+    shared_instance = None
+    shared_lock = threading.Lock()
+
+    THROUGHPUT_WINDOW = 60
+
+    def __init__(self, amz_product_ids, interval=3600, workers=4, queue_size=100,
+                 rate_per_host=1.0, burst=1):
+        self.amz_product_ids = list(amz_product_ids)
+        self.interval = interval
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.rate_limiter = RateLimiter(rate_per_host, burst)
+        self.threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._completed = collections.deque()
+        self._counters = dict(enqueued=0, dropped=0, scraped=0, failed=0, in_flight=0,
+                              rate_limited_seconds=0.0)
+
+
+    '''
+    Returns the tracker used by the running process,
+    built from the PLAYGROUND_TRACKER_* settings.
+    '''
+    @classmethod
+    def shared(cls):
+        with cls.shared_lock:
+            if cls.shared_instance is None:
+                cls.shared_instance = cls(
+                    getattr(settings, "PLAYGROUND_TRACKED_PRODUCTS",
+                            list(CryptocurrenciesHelper.RANDOM_PRODUCTS)),
+                    interval=getattr(settings, "PLAYGROUND_TRACKER_INTERVAL", 3600),
+                    workers=getattr(settings, "PLAYGROUND_TRACKER_WORKERS", 4),
+                    queue_size=getattr(settings, "PLAYGROUND_TRACKER_QUEUE_SIZE", 100),
+                    rate_per_host=getattr(settings, "PLAYGROUND_TRACKER_RATE_PER_HOST", 1.0),
+                    burst=getattr(settings, "PLAYGROUND_TRACKER_BURST", 1))
+        return cls.shared_instance
+
+
+    '''
+    Starts the worker threads and, unless schedule is
+    False, a thread queueing every ASIN each interval.
+    Does nothing if it is already running.
+    '''
+    def start(self, schedule=True):
+        with self._lock:
+            if any(thread.is_alive() for thread in self.threads):
+                return
+            self._stop.clear()
+            self.threads = [threading.Thread(target=self.work, name="price-tracker-%d" % n, daemon=True)
+                            for n in range(self.workers)]
+            if schedule:
+                self.threads.append(threading.Thread(target=self.schedule, name="price-tracker", daemon=True))
+            for thread in self.threads:
+                thread.start()
+
+
+    '''
+    Asks every thread to stop and waits for them.
+    Jobs still queued are discarded.
+    '''
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+
+    '''
+    Queues every tracked ASIN each interval until stopped.
+    '''
+    def schedule(self):
+        while not self._stop.is_set():
+            self.enqueue_all()
+            self._stop.wait(self.interval)
+
+
+    '''
+    Queues every tracked ASIN that is not already queued
+    or being scraped, and returns how many were queued.
+    '''
+    def enqueue_all(self):
+        return sum(self.enqueue(amz_product_id) for amz_product_id in self.amz_product_ids)
+
+
+    def enqueue(self, amz_product_id):
+        with self._lock:
+            if amz_product_id in self._pending:
+                return False
+            try:
+                self.queue.put_nowait(amz_product_id)
+            except queue.Full:
+                self._counters["dropped"] += 1
+                return False
+            self._pending.add(amz_product_id)
+            self._counters["enqueued"] += 1
+            return True
+
+
+    '''
+    Scrapes queued ASINs until stopped.
+    '''
+    def work(self):
+        while not self._stop.is_set():
+            try:
+                amz_product_id = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            try:
+                if not self._stop.is_set():
+                    self.track(amz_product_id)
+            finally:
+                with self._lock:
+                    self._pending.discard(amz_product_id)
+                self.queue.task_done()
+
+
+    '''
+    Scrapes one ASIN, once the rate limit of its host
+    allows it, and records its price.
+
+    Returns (price, amz_product_id, msg) like
+    CryptocurrenciesHelper.get_price_from_amazon.
+    '''
+    def track(self, amz_product_id):
+        CH = CryptocurrenciesHelper
+
+        delay = self.rate_limiter.reserve(urlsplit(CH.AMAZON_URL).netloc)
+        if delay > 0:
+            self._stop.wait(delay)
+
+        with self._lock:
+            self._counters["in_flight"] += 1
+            self._counters["rate_limited_seconds"] += delay
+
+        try:
+            result = CH.fetch_price_from_amazon(amz_product_id)
+            if result[0] is not None:
+                self.record(amz_product_id, result[0])
+        except Exception as e:
+            result = (None, amz_product_id, str(e))
+
+        now = time.time()
+        with self._lock:
+            self._counters["in_flight"] -= 1
+            self._counters["scraped" if result[0] is not None else "failed"] += 1
+            self._completed.append(now)
+            while self._completed and self._completed[0] < now - self.THROUGHPUT_WINDOW:
+                self._completed.popleft()
+
+        return result
+
+
+    '''
+    Stores a scraped price in the history and the
+    catalog, and serves it from the helper's caches.
+    '''
+    def record(self, amz_product_id, price):
+        CH = CryptocurrenciesHelper
+
+        tracked_at = timezone.now()
+
+        try:
+            with transaction.atomic():
+                TrackedPrice.objects.create(amz_product_id=amz_product_id, price=price, tracked_at=tracked_at)
+                Product.objects.update_or_create(amz_product_id=amz_product_id,
+                                                 defaults=dict(price=price, tracked_at=tracked_at))
+        except DatabaseError:
+            pass
+
+        CH.product_catalog.set_tracked(amz_product_id, price, tracked_at.timestamp())
+        CH.product_price_cache.set(amz_product_id, (price, amz_product_id, ""))
+
+
+    '''
+    Scrapes every tracked ASIN once with the worker
+    threads and waits for them to finish.
+    '''
+    def track_all(self):
+        self.start(schedule=False)
+        self.enqueue_all()
+        self.queue.join()
+
+
+    '''
+    Returns the pool's counters: how many jobs were
+    queued, dropped, scraped and failed, how many are
+    queued (queue_depth) and being scraped (in_flight),
+    the scrapes per second over the last minute, and the
+    seconds spent waiting for the rate limit.
+    '''
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            stats = dict(self._counters)
+            completed = sum(1 for finished in self._completed if finished >= now - self.THROUGHPUT_WINDOW)
+
+        stats.update(workers=self.workers,
+                     queue_depth=self.queue.qsize(),
+                     queue_size=self.queue.maxsize,
+                     throughput=completed / float(self.THROUGHPUT_WINDOW))
+        return stats
+
+
+'''
+A token bucket per host: each host gets `rate` requests
+per second, with bursts of up to `burst` requests.
+'''
+class RateLimiter():
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+
+    '''
+    Takes a request slot for the host and returns how many
+    seconds the caller must wait before using it. Slots
+    are handed out in order, so concurrent callers queue
+    up instead of all waking at once.
+    '''
+    def reserve(self, host):
+        now = time.time()
+
+        with self._lock:
+            (tokens, updated_at) = self._buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate) - 1
+            self._buckets[host] = (tokens, now)
+
+        return -tokens / self.rate if tokens < 0 else 0.0
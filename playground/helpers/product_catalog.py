@@ -0,0 +1,274 @@
+import bisect
+import math
+import random
+import threading
+import time
+
+from django.db import DatabaseError, transaction
+
+from ..models import Product
+from .price_backfill import PriceBackfill
+
+
+'''
+Defines an in-memory copy of the Product table.
+
+The catalog keeps two parallel lists, prices in ascending
+order and the matching product ids, loaded in one query
+over the indexed price column. Random picks are a single
+index lookup, and the products a budget can buy are the
+prefix of the price list found by binary search, so both
+stay fast however large the catalog gets.
+
+The lists are loaded on first use and reloaded once they
+are older than max_age seconds, so products added to the
+table show up without a restart. Only one thread reloads at
+a time, and the others keep using the old lists meanwhile.
+A load replaces both lists at once, so readers never see a
+half loaded catalog. If the table is empty or cannot be
+read, the fallback products are used instead.
+
+Products are added to the table with import_file, from CSV
+or JSON dumps of amz_product_id, price and optional title.
+
+The catalog also knows the latest price PriceTracker scraped
+for each tracked product, so requests can use it instead of
+scraping the product page themselves.
+'''
+
+class ProductCatalog():
+
+    def __init__(self, fallback=None, max_age=300):
+        self.fallback = dict(fallback or {})
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_at = None
+
+
+    '''
+    Reads the catalog from the Product table, sorted by
+    price, and returns the number of products loaded.
+    '''
+    def load(self):
+        try:
+            rows = list(Product.objects.filter(price__gt=0)
+                        .order_by("price", "amz_product_id")
+                        .values_list("price", "amz_product_id", "tracked_at"))
+        except DatabaseError:
+            rows = []
+
+        if not rows:
+            rows = sorted((price, amz_product_id, None) for (amz_product_id, price) in self.fallback.items())
+
+        prices = [price for (price, amz_product_id, tracked_at) in rows]
+        ids = [amz_product_id for (price, amz_product_id, tracked_at) in rows]
+        tracked = dict((amz_product_id, (price, tracked_at.timestamp()))
+                       for (price, amz_product_id, tracked_at) in rows if tracked_at is not None)
+
+        with self._lock:
+            self._snapshot = (prices, ids, tracked)
+            self._loaded_at = time.time()
+
+        return len(ids)
+
+
+    '''
+    Returns the (prices, ids, tracked) lists and dict,
+    where tracked is {amz_product_id: (price, tracked_at)},
+    loading them first if they were never loaded or are
+    older than max_age. While one thread reloads an old
+    snapshot, other threads get the old one.
+    '''
+    def snapshot(self):
+        (snapshot, fresh) = self._current()
+        if fresh:
+            return snapshot
+
+        # One thread reloads at a time; while an old snapshot
+        # exists, the others keep using it instead of waiting.
+        if not self._reload_lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            (snapshot, fresh) = self._current()
+            if not fresh:
+                self.load()
+                (snapshot, fresh) = self._current()
+        finally:
+            self._reload_lock.release()
+
+        return snapshot
+
+
+    def _current(self):
+        with self._lock:
+            snapshot = self._snapshot
+            fresh = (snapshot is not None
+                     and (self.max_age is None or time.time() - self._loaded_at < self.max_age))
+        return (snapshot, fresh)
+
+
+    def __len__(self):
+        return len(self.snapshot()[1])
+
+
+    '''
+    Returns (price, amz_product_id) for a random product,
+    or (None, None) if the catalog is empty.
+    '''
+    def random(self):
+        (prices, ids, tracked) = self.snapshot()
+
+        if not ids:
+            return (None, None)
+
+        index = random.randrange(len(ids))
+        return (prices[index], ids[index])
+
+
+    '''
+    Returns the number of products priced at most budget,
+    and a list of (amz_product_id, price) for up to limit
+    of them, the most expensive first. Without a limit,
+    every affordable product is listed.
+    '''
+    def affordable(self, budget, limit=None):
+        (prices, ids, tracked) = self.snapshot()
+
+        end = bisect.bisect_right(prices, budget)
+        start = 0 if limit is None else max(end - limit, 0)
+
+        return (end, [(ids[index], prices[index]) for index in range(end - 1, start - 1, -1)])
+
+
+    '''
+    Returns the latest tracked price of a product, or
+    None if it is not tracked or its price is older than
+    max_age seconds.
+    '''
+    def tracked_price(self, amz_product_id, max_age=None):
+        entry = self.snapshot()[2].get(amz_product_id)
+
+        if entry is None or (max_age is not None and time.time() - entry[1] > max_age):
+            return None
+
+        return entry[0]
+
+
+    '''
+    Returns {amz_product_id: price} for the given products,
+    without scraping: the latest tracked price, else the
+    price in the catalog, else the fallback price. Products
+    with no known price are left out.
+    '''
+    def known_prices(self, amz_product_ids):
+        (prices, ids, tracked) = self.snapshot()
+
+        wanted = set(amz_product_ids)
+        catalog = dict((amz_product_id, price) for (price, amz_product_id) in zip(prices, ids)
+                       if amz_product_id in wanted)
+
+        known = {}
+        for amz_product_id in amz_product_ids:
+            if amz_product_id in tracked:
+                known[amz_product_id] = tracked[amz_product_id][0]
+            elif amz_product_id in catalog:
+                known[amz_product_id] = catalog[amz_product_id]
+            elif amz_product_id in self.fallback:
+                known[amz_product_id] = self.fallback[amz_product_id]
+        return known
+
+
+    '''
+    Records a price just scraped for a product, so it is
+    served before the next load. Its place in the sorted
+    prices is only updated by the next load.
+    '''
+    def set_tracked(self, amz_product_id, price, tracked_at):
+        self.snapshot()[2][amz_product_id] = (price, tracked_at)
+
+
+    '''
+    Imports products from a dump, read like
+    PriceBackfill reads price dumps, and returns its
+    counts: dict(read=..., inserted=..., updated=...,
+    unchanged=..., skipped=...)
+
+    Products already in the table get the price and
+    title of the dump. The in-memory lists are not
+    reloaded; call load() for that.
+    '''
+    @staticmethod
+    def import_file(path, format=None, chunk_size=5000):
+        stats = dict(read=0, inserted=0, updated=0, unchanged=0, skipped=0)
+        chunk = {}
+
+        with PriceBackfill.open_dump(path) as f:
+            for row in PriceBackfill.read_rows(f, format or PriceBackfill.format_for(path, f)):
+                stats["read"] += 1
+                try:
+                    (amz_product_id, price, title) = ProductCatalog.parse_row(row)
+                except (KeyError, TypeError, ValueError):
+                    stats["skipped"] += 1
+                    continue
+
+                chunk[amz_product_id] = (price, title)
+                if len(chunk) >= chunk_size:
+                    ProductCatalog.write_chunk(chunk, stats)
+                    chunk = {}
+
+        if chunk:
+            ProductCatalog.write_chunk(chunk, stats)
+
+        return stats
+
+
+    '''
+    Writes a chunk of {amz_product_id: (price, title)} in
+    one transaction and adds its counts to stats.
+    '''
+    @staticmethod
+    def write_chunk(chunk, stats):
+        with transaction.atomic():
+            existing = dict((amz_product_id, (price, title)) for (amz_product_id, price, title)
+                            in Product.objects.filter(amz_product_id__in=list(chunk))
+                            .values_list("amz_product_id", "price", "title"))
+
+            Product.objects.bulk_create(
+                [Product(amz_product_id=amz_product_id, price=price, title=title)
+                 for (amz_product_id, (price, title)) in chunk.items() if amz_product_id not in existing],
+                batch_size=len(chunk))
+
+            for (amz_product_id, stored) in existing.items():
+                if stored == chunk[amz_product_id]:
+                    stats["unchanged"] += 1
+                    continue
+                (price, title) = chunk[amz_product_id]
+                Product.objects.filter(amz_product_id=amz_product_id).update(price=price, title=title)
+                stats["updated"] += 1
+
+        stats["inserted"] += len(chunk) - len(existing)
+
+
+    '''
+    Returns (amz_product_id, price, title) for a row read
+    from a dump. Raises KeyError, TypeError or ValueError
+    if it is invalid.
+    '''
+    @staticmethod
+    def parse_row(row):
+        amz_product_id = PriceBackfill.get_string(row, "amz_product_id").strip()
+        if not amz_product_id or len(amz_product_id) > 20:
+            raise ValueError("invalid product id %r" % row["amz_product_id"])
+
+        price = float(row["price"])
+        if math.isnan(price) or price <= 0:
+            raise ValueError("invalid price %r" % row["price"])
+
+        title = row.get("title") or ""
+        if not isinstance(title, str):
+            raise TypeError("invalid title %r" % title)
+        title = title.strip()[:200]
+
+        return (amz_product_id, price, title)
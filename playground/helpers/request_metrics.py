@@ -0,0 +1,384 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+'''
+Defines timing instrumentation for the stages of a request.
+
+Code runs a stage inside RequestMetrics.stage(name), as a
+with block or a decorator. Each run is observed in a
+histogram for that stage, and also added to the RequestTimer
+of the request being served, if any. The views send those
+durations back in a Server-Timing header.
+
+The current timer lives in a context variable, so concurrent
+requests (threads or asyncio tasks) keep their own timers.
+Functions handed to an executor must be wrapped with bind()
+to report to the caller's timer.
+
+Upstream HTTP calls are counted per host by HttpClient, and
+everything is rendered in the Prometheus text format by
+render_prometheus(), along with the circuit breaker and
+retry budget status of each host, and the PriceTracker pool
+counters, if given.
+'''
+
+class RequestMetrics():
+
+    STAGES = ("currency_fetch", "product_fetch", "html_parse", "compute", "serialize")
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._timer = contextvars.ContextVar("request_timer", default=None)
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._upstream = {}
+
+
+    '''
+    Times the code inside it as the given stage. Can be used
+    as a with block or as a function decorator.
+    '''
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+
+    '''
+    Records a duration, in seconds, for a stage.
+    '''
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+        timer = self._timer.get()
+        if timer is not None:
+            timer.add(name, seconds)
+
+
+    '''
+    Starts timing a request in the current context and
+    returns its RequestTimer.
+    '''
+    @contextlib.contextmanager
+    def request(self):
+        timer = RequestTimer()
+        token = self._timer.set(timer)
+        try:
+            yield timer
+        finally:
+            self._timer.reset(token)
+
+
+    '''
+    Returns func wrapped so that, wherever it runs, its
+    stages are added to the timer of the calling request.
+    '''
+    def bind(self, func):
+        timer = self._timer.get()
+
+        @functools.wraps(func)
+        def bound(*args, **kwargs):
+            token = self._timer.set(timer)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._timer.reset(token)
+
+        return bound
+
+
+    '''
+    Decorates a view, sync or async, to time the request
+    and send the durations of its stages in a Server-Timing
+    header.
+    '''
+    def server_timing(self, view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def timed_view(request, *args, **kwargs):
+                with self.request() as timer:
+                    response = await view(request, *args, **kwargs)
+                response["Server-Timing"] = timer.header()
+                return response
+        else:
+            @functools.wraps(view)
+            def timed_view(request, *args, **kwargs):
+                with self.request() as timer:
+                    response = view(request, *args, **kwargs)
+                response["Server-Timing"] = timer.header()
+                return response
+
+        return timed_view
+
+
+    '''
+    Counts a call to an upstream url, and whether it failed.
+    '''
+    def count_upstream(self, url, error=False):
+        host = urlsplit(url).netloc
+        with self._lock:
+            counters = self._upstream.setdefault(host, dict(requests=0, errors=0))
+            counters["requests"] += 1
+            if error:
+                counters["errors"] += 1
+
+
+    '''
+    Returns the upstream call and error counts per host.
+    '''
+    def upstream_stats(self):
+        with self._lock:
+            return dict((host, dict(counters)) for (host, counters) in self._upstream.items())
+
+
+    '''
+    Returns {stage: (bucket_counts, sum, count)}, with
+    cumulative bucket counts as Prometheus expects.
+    '''
+    def stage_stats(self):
+        with self._lock:
+            return dict((name, histogram.snapshot()) for (name, histogram) in self._histograms.items())
+
+
+    '''
+    Returns every metric in the Prometheus text
+    exposition format. upstream_status is the result
+    of HttpClient.status(), tracker_stats the result of
+    PriceTracker.stats(), prewarmer_status the result
+    of PricePrewarmer.status(), and cache_stats maps
+    cache names to the result of their stats(), if any.
+    '''
+    def render_prometheus(self, upstream_status=None, tracker_stats=None, prewarmer_status=None,
+                          cache_stats=None):
+        lines = [
+            "# HELP playground_stage_duration_seconds Time spent in each stage of a request.",
+            "# TYPE playground_stage_duration_seconds histogram",
+        ]
+        for (name, (bucket_counts, total, count)) in sorted(self.stage_stats().items()):
+            for (bound, bucket_count) in zip(self.buckets, bucket_counts):
+                lines.append('playground_stage_duration_seconds_bucket{stage="%s",le="%s"} %d'
+                             % (name, bound, bucket_count))
+            lines.append('playground_stage_duration_seconds_bucket{stage="%s",le="+Inf"} %d' % (name, count))
+            lines.append('playground_stage_duration_seconds_sum{stage="%s"} %r' % (name, total))
+            lines.append('playground_stage_duration_seconds_count{stage="%s"} %d' % (name, count))
+
+        upstream = sorted(self.upstream_stats().items())
+        lines.append("# HELP playground_upstream_requests_total Upstream HTTP calls per host.")
+        lines.append("# TYPE playground_upstream_requests_total counter")
+        for (host, counters) in upstream:
+            lines.append('playground_upstream_requests_total{host="%s"} %d' % (host, counters["requests"]))
+        lines.append("# HELP playground_upstream_errors_total Failed upstream HTTP calls per host.")
+        lines.append("# TYPE playground_upstream_errors_total counter")
+        for (host, counters) in upstream:
+            lines.append('playground_upstream_errors_total{host="%s"} %d' % (host, counters["errors"]))
+
+        if upstream_status:
+            lines.extend(self.render_upstream_status(upstream_status))
+
+        if tracker_stats:
+            lines.extend(self.render_tracker_stats(tracker_stats))
+
+        if prewarmer_status:
+            lines.extend(self.render_prewarmer_status(prewarmer_status))
+
+        if cache_stats:
+            lines.extend(self.render_cache_stats(cache_stats))
+
+        return "\n".join(lines) + "\n"
+
+
+    '''
+    Returns the Prometheus lines for the circuit breaker
+    state and retry counts per host.
+    '''
+    @staticmethod
+    def render_upstream_status(upstream_status):
+        hosts = sorted(upstream_status.items())
+        lines = []
+
+        lines.append("# HELP playground_circuit_breaker_state Circuit breaker state per host.")
+        lines.append("# TYPE playground_circuit_breaker_state gauge")
+        for (host, status) in hosts:
+            if "state" not in status:
+                continue
+            for state in ("closed", "open", "half_open"):
+                lines.append('playground_circuit_breaker_state{host="%s",state="%s"} %d'
+                             % (host, state, status["state"] == state))
+
+        counters = (
+            ("playground_circuit_breaker_rejected_total", "rejected", "Calls rejected by an open circuit breaker."),
+            ("playground_circuit_breaker_opened_total", "opened", "Times the circuit breaker opened."),
+            ("playground_upstream_retries_total", "retries", "Upstream calls retried."),
+            ("playground_retry_budget_exhausted_total", "exhausted", "Retries denied by the retry budget."),
+        )
+        for (metric, key, description) in counters:
+            lines.append("# HELP %s %s" % (metric, description))
+            lines.append("# TYPE %s counter" % metric)
+            for (host, status) in hosts:
+                if key in status:
+                    lines.append('%s{host="%s"} %d' % (metric, host, status[key]))
+
+        return lines
+
+
+    '''
+    Returns the Prometheus lines for the PriceTracker
+    worker pool.
+    '''
+    @staticmethod
+    def render_tracker_stats(tracker_stats):
+        metrics = (
+            ("playground_tracker_jobs_total", "counter", "enqueued", "Product scrapes queued by the price tracker."),
+            ("playground_tracker_dropped_total", "counter", "dropped", "Product scrapes dropped on a full queue."),
+            ("playground_tracker_scraped_total", "counter", "scraped", "Product prices scraped by the price tracker."),
+            ("playground_tracker_failed_total", "counter", "failed", "Product scrapes that failed."),
+            ("playground_tracker_rate_limited_seconds_total", "counter", "rate_limited_seconds",
+             "Seconds the price tracker waited for the per-host rate limit."),
+            ("playground_tracker_queue_depth", "gauge", "queue_depth", "Product scrapes waiting in the queue."),
+            ("playground_tracker_queue_size", "gauge", "queue_size", "Most product scrapes the queue holds."),
+            ("playground_tracker_in_flight", "gauge", "in_flight", "Product scrapes in progress."),
+            ("playground_tracker_workers", "gauge", "workers", "Price tracker worker threads."),
+            ("playground_tracker_throughput", "gauge", "throughput",
+             "Product scrapes per second over the last minute."),
+        )
+
+        lines = []
+        for (metric, kind, key, description) in metrics:
+            lines.append("# HELP %s %s" % (metric, description))
+            lines.append("# TYPE %s %s" % (metric, kind))
+            lines.append("%s %r" % (metric, tracker_stats[key]))
+        return lines
+
+
+    '''
+    Returns the Prometheus lines for the refresh status
+    of each value kept fresh by the PricePrewarmer.
+    '''
+    @staticmethod
+    def render_prewarmer_status(prewarmer_status):
+        values = sorted(prewarmer_status.items())
+        metrics = (
+            ("playground_prewarm_last_refreshed_timestamp_seconds", "last_refreshed",
+             "Unix time a prewarmed value was last refreshed."),
+            ("playground_prewarm_next_run_timestamp_seconds", "next_run",
+             "Unix time a prewarmed value is next refreshed."),
+            ("playground_prewarm_failures", "failures",
+             "Consecutive failed refreshes of a prewarmed value."),
+        )
+
+        lines = []
+        for (metric, key, description) in metrics:
+            lines.append("# HELP %s %s" % (metric, description))
+            lines.append("# TYPE %s gauge" % metric)
+            for ((kind, name), status) in values:
+                if status[key] is not None:
+                    lines.append('%s{kind="%s",name="%s"} %r' % (metric, kind, name, status[key]))
+        return lines
+
+
+    '''
+    Returns the Prometheus lines for the counters and
+    sizes of the price caches, so their TTLs can be tuned.
+    '''
+    @staticmethod
+    def render_cache_stats(cache_stats):
+        caches = sorted(cache_stats.items())
+        metrics = (
+            ("playground_cache_hits_total", "counter", "hits", "Lookups answered from a fresh cache entry."),
+            ("playground_cache_stale_hits_total", "counter", "stale_hits",
+             "Lookups answered from a stale entry while it is refreshed."),
+            ("playground_cache_negative_hits_total", "counter", "negative_hits",
+             "Lookups answered from a cached failure."),
+            ("playground_cache_misses_total", "counter", "misses", "Lookups that had to load the value."),
+            ("playground_cache_refreshes_total", "counter", "refreshes", "Stale entries refreshed in the background."),
+            ("playground_cache_errors_total", "counter", "errors", "Loads that failed."),
+            ("playground_cache_evictions_total", "counter", "evictions", "Entries evicted to make room."),
+            ("playground_cache_entries", "gauge", "entries", "Entries in the cache."),
+        )
+
+        lines = []
+        for (metric, kind, key, description) in metrics:
+            lines.append("# HELP %s %s" % (metric, description))
+            lines.append("# TYPE %s %s" % (metric, kind))
+            for (cache, stats) in caches:
+                if key in stats:
+                    lines.append('%s{cache="%s"} %d' % (metric, cache, stats[key]))
+        return lines
+
+
+    '''
+    Forgets every recorded metric.
+    '''
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._upstream.clear()
+
+
+'''
+The stage durations of one request.
+'''
+class RequestTimer():
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+
+    '''
+    Returns the Server-Timing header value, with the
+    durations in milliseconds and the request's total.
+    '''
+    def header(self):
+        with self._lock:
+            durations = dict(self.durations)
+
+        order = list(RequestMetrics.STAGES) + sorted(set(durations) - set(RequestMetrics.STAGES))
+        metrics = ["%s;dur=%.1f" % (name, durations[name] * 1000) for name in order if name in durations]
+        metrics.append("total;dur=%.1f" % ((time.perf_counter() - self.start) * 1000))
+
+        return ", ".join(metrics)
+
+
+class Histogram():
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        for (index, bound) in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[index] += 1
+                break
+        self.total += seconds
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = []
+        running = 0
+        for count in self.counts:
+            running += count
+            cumulative.append(running)
+        return (cumulative, self.total, self.count)
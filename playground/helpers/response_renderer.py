@@ -0,0 +1,139 @@
+import json
+import threading
+from collections import OrderedDict
+from json.encoder import encode_basestring_ascii
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+'''
+Defines a fast renderer for cryptocurrencies response bodies.
+
+The two shapes the endpoint answers with most often, the
+response of build_response and the error response, are
+rendered from precompiled templates. Their bodies are byte for
+byte what JsonResponse would produce, and are memoized for
+identical responses. Any other response is encoded with the
+stdlib encoder JsonResponse uses, or with orjson when
+`encoder` is "orjson" and it is installed. orjson output is
+compact, so it differs from JsonResponse in whitespace.
+'''
+
+class ResponseRenderer():
+
+    OK_TEMPLATE = ('{"response": "ok", "data": {"amz_product_id": %s, "product_url": %s, '
+                   '"product_price": %s, "units": %s, "change": %s, "msg": %s, '
+                   '"currency_value": %s}}')
+    OK_KEYS = ("response", "data")
+    OK_DATA_KEYS = ("amz_product_id", "product_url", "product_price", "units",
+                    "change", "msg", "currency_value")
+
+    ERROR_TEMPLATE = '{"msg": %s, "response": "error"}'
+    ERROR_KEYS = ("msg", "response")
+
+    def __init__(self, encoder="json", max_entries=4096):
+        self.use_orjson = encoder == "orjson" and orjson is not None
+        self.max_entries = max_entries
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    '''
+    Returns the JSON body of a response dict as bytes.
+    '''
+    def render(self, response):
+        RR = ResponseRenderer
+
+        key = RR.template_key(response)
+        if key is None:
+            return self.encode(response)
+
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is not None:
+                self._bodies.move_to_end(key)
+                return body
+
+        if key[0] == "ok":
+            body = RR.render_template(RR.OK_TEMPLATE, key[1:])
+        else:
+            body = RR.render_template(RR.ERROR_TEMPLATE, key[1:])
+
+        if body is None:
+            return self.encode(response)
+
+        with self._lock:
+            self._bodies[key] = body
+            while len(self._bodies) > self.max_entries:
+                self._bodies.popitem(last=False)
+
+        return body
+
+
+    '''
+    Encodes any response dict, the way JsonResponse does
+    unless orjson is in use.
+    '''
+    def encode(self, response):
+        if self.use_orjson:
+            try:
+                return orjson.dumps(response)
+            except TypeError:
+                pass
+        return json.dumps(response, cls=DjangoJSONEncoder).encode("utf-8")
+
+
+    '''
+    Returns a hashable key of the values of a response that
+    has one of the templated shapes, or None otherwise.
+    '''
+    @staticmethod
+    def template_key(response):
+        RR = ResponseRenderer
+
+        keys = tuple(response)
+
+        if keys == RR.OK_KEYS and response["response"] == "ok":
+            data = response["data"]
+            if type(data) is not dict or tuple(data) != RR.OK_DATA_KEYS:
+                return None
+            return ("ok",) + tuple((type(value), value) for value in data.values())
+
+        if keys == RR.ERROR_KEYS and response["response"] == "error":
+            return ("error", (type(response["msg"]), response["msg"]))
+
+        return None
+
+
+    '''
+    Fills a template with the JSON encoding of each
+    (type, value) pair, or returns None if a value is
+    not a plain str, int or finite float.
+    '''
+    @staticmethod
+    def render_template(template, typed_values):
+        encoded = []
+        for (value_type, value) in typed_values:
+            if value_type is str:
+                encoded.append(encode_basestring_ascii(value))
+            elif value_type is int:
+                encoded.append(int.__repr__(value))
+            elif value_type is float and value == value and value not in (float("inf"), float("-inf")):
+                encoded.append(float.__repr__(value))
+            else:
+                return None
+
+        return (template % tuple(encoded)).encode("utf-8")
+
+
+    '''
+    Drops every memoized body.
+    '''
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
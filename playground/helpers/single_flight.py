@@ -0,0 +1,76 @@
+import threading
+
+
+'''
+Defines request coalescing for upstream lookups.
+
+While a call for a key is in flight, any other thread asking
+for the same key waits for it and shares its result, or its
+exception, instead of starting its own upstream request.
+The async views run their lookups on executor threads, so
+they are coalesced with the WSGI threads the same way.
+'''
+
+class SingleFlight():
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = dict(calls=0, shared=0)
+
+
+    '''
+    Calls func and returns its result, unless a call for
+    the same key is already in flight, in which case it
+    waits for that call and returns its result instead.
+    '''
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = InFlightCall()
+                self._calls[key] = call
+                self._counters["calls"] += 1
+            else:
+                self._counters["shared"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+    '''
+    Returns how many calls were made and how many
+    callers shared an in-flight call instead.
+    '''
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+'''
+The state of a call shared by SingleFlight.
+'''
+class InFlightCall():
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from playground.helpers.price_backfill import PriceBackfill
+
+
+'''
+Imports daily (currency, date, usd) prices from CSV or JSON
+dumps into the HistoricalPrice table, so dated lookups are
+answered without calling upstream. Safe to run again on the
+same dumps.
+
+Usage:
+    python manage.py backfill_prices DUMP [DUMP ...] [--format csv|json|jsonl]
+        [--chunk-size ROWS] [--update]
+'''
+
+class Command(BaseCommand):
+    help = "Imports daily cryptocurrency prices from CSV or JSON dumps."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", metavar="DUMP",
+                            help="CSV, JSON or JSON Lines file, optionally gzipped.")
+        parser.add_argument("--format", choices=PriceBackfill.FORMATS,
+                            help="Format of the dumps, if their extension does not tell.")
+        parser.add_argument("--chunk-size", type=int, default=5000,
+                            help="Rows written per transaction.")
+        parser.add_argument("--update", action="store_true",
+                            help="Overwrite stored prices that differ from the dump.")
+
+    def handle(self, *args, **options):
+        backfill = PriceBackfill(chunk_size=options["chunk_size"], update=options["update"],
+                                 progress=self.report)
+
+        for path in options["paths"]:
+            try:
+                stats = backfill.import_file(path, options["format"])
+            except (IOError, ValueError) as error:
+                raise CommandError("Could not import %s: %s" % (path, error))
+
+            self.report(stats, path)
+
+    def report(self, stats, path=None):
+        line = ("%(read)d rows read, %(inserted)d inserted, %(updated)d updated, "
+                "%(unchanged)d unchanged, %(skipped)d skipped, %(rows_per_sec).0f rows/sec" % stats)
+        if path is not None:
+            line = "%s: %s in %.1fs" % (path, line, stats["seconds"])
+        self.stdout.write(line)
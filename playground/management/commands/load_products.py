@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from playground.helpers.price_backfill import PriceBackfill
+from playground.helpers.product_catalog import ProductCatalog
+
+
+'''
+Imports amazon products (amz_product_id, price and an
+optional title) from CSV or JSON dumps into the Product
+table that random products and affordable queries are
+drawn from. Safe to run again on the same dumps.
+
+Usage:
+    python manage.py load_products DUMP [DUMP ...] [--format csv|json|jsonl]
+        [--chunk-size ROWS]
+'''
+
+class Command(BaseCommand):
+    help = "Imports amazon products from CSV or JSON dumps."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", metavar="DUMP",
+                            help="CSV, JSON or JSON Lines file, optionally gzipped.")
+        parser.add_argument("--format", choices=PriceBackfill.FORMATS,
+                            help="Format of the dumps, if their extension does not tell.")
+        parser.add_argument("--chunk-size", type=int, default=5000,
+                            help="Rows written per transaction.")
+
+    def handle(self, *args, **options):
+        for path in options["paths"]:
+            try:
+                stats = ProductCatalog.import_file(path, options["format"], options["chunk_size"])
+            except (IOError, ValueError) as error:
+                raise CommandError("Could not import %s: %s" % (path, error))
+
+            self.stdout.write("%s: %d rows read, %d inserted, %d updated, %d unchanged, %d skipped"
+                              % (path, stats["read"], stats["inserted"], stats["updated"],
+                                 stats["unchanged"], stats["skipped"]))
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from playground.helpers.price_tracker import PriceTracker
+
+
+'''
+Scrapes the prices of every tracked product (the
+PLAYGROUND_TRACKED_PRODUCTS setting) every interval with a
+bounded pool of workers, storing them for request paths,
+until interrupted.
+
+Usage:
+    python manage.py track_prices [--once] [--interval SECONDS] [--workers N]
+'''
+
+class Command(BaseCommand):
+    help = "Tracks amazon product prices in the background."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+                            help="Scrape every tracked product once and exit.")
+        parser.add_argument("--interval", type=float,
+                            help="Seconds between scrapes of each product.")
+        parser.add_argument("--workers", type=int,
+                            help="Products scraped at the same time.")
+
+    def handle(self, *args, **options):
+        tracker = PriceTracker.shared()
+        if options["interval"]:
+            tracker.interval = options["interval"]
+        if options["workers"]:
+            tracker.workers = options["workers"]
+
+        if options["once"]:
+            tracker.track_all()
+            tracker.stop()
+            self.report(tracker.stats())
+            return
+
+        tracker.start()
+        try:
+            while True:
+                time.sleep(max(tracker.interval, 60))
+                self.report(tracker.stats())
+        except KeyboardInterrupt:
+            tracker.stop()
+
+    def report(self, stats):
+        self.stdout.write("%(scraped)d scraped, %(failed)d failed, %(dropped)d dropped, "
+                          "%(queue_depth)d queued, %(throughput).2f scrapes/sec" % stats)
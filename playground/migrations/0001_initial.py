@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoricalPrice',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=10)),
+                ('day', models.DateField()),
+                ('usd', models.FloatField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='historicalprice',
+            unique_together=set([('currency', 'day')]),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+PRODUCTS = {
+    "B01MQWUXZS" : 159.99,
+    "B00EMKLSSM" : 94.75,
+    "B06XDP7B71" : 9.99,
+    "B01LMHI37Q" : 689.00,
+    "B01J24C0TI" : 229.99,
+}
+
+
+def add_products(apps, schema_editor):
+    Product = apps.get_model("playground", "Product")
+    Product.objects.bulk_create([Product(amz_product_id=amz_product_id, price=price)
+                                 for (amz_product_id, price) in PRODUCTS.items()])
+
+
+def remove_products(apps, schema_editor):
+    Product = apps.get_model("playground", "Product")
+    Product.objects.filter(amz_product_id__in=PRODUCTS).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playground', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amz_product_id', models.CharField(max_length=20, unique=True)),
+                ('price', models.FloatField(db_index=True)),
+                ('title', models.CharField(blank=True, default='', max_length=200)),
+            ],
+        ),
+        migrations.RunPython(add_products, remove_products),
+    ]
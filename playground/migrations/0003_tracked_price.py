@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playground', '0002_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='tracked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='TrackedPrice',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amz_product_id', models.CharField(max_length=20)),
+                ('price', models.FloatField()),
+                ('tracked_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='trackedprice',
+            index_together=set([('amz_product_id', 'tracked_at')]),
+        ),
+    ]
@@ -1,3 +1,55 @@
 from django.db import models
 
-# Create your models here.
+
+'''
+Daily USD price of a cryptocurrency.
+
+Historical prices never change, so once a (currency, day)
+pair has been fetched from upstream it is kept here and
+read back instead of calling cryptocompare again.
+'''
+class HistoricalPrice(models.Model):
+    currency = models.CharField(max_length=10)
+    day = models.DateField()
+    usd = models.FloatField()
+
+    class Meta:
+        unique_together = ("currency", "day")
+
+    def __str__(self):
+        return "%s %s: %s USD" % (self.currency, self.day, self.usd)
+
+
+'''
+An amazon product and its USD price.
+
+The catalog is loaded into memory sorted by price (see
+ProductCatalog), so the price column is indexed to keep
+that load an index scan as the catalog grows.
+
+tracked_at is when PriceTracker last scraped the price,
+or None for prices that are not tracked.
+'''
+class Product(models.Model):
+    amz_product_id = models.CharField(max_length=20, unique=True)
+    price = models.FloatField(db_index=True)
+    title = models.CharField(max_length=200, blank=True, default="")
+    tracked_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "%s: %s USD" % (self.amz_product_id, self.price)
+
+
+'''
+A price of an amazon product scraped by PriceTracker.
+'''
+class TrackedPrice(models.Model):
+    amz_product_id = models.CharField(max_length=20)
+    price = models.FloatField()
+    tracked_at = models.DateTimeField()
+
+    class Meta:
+        index_together = ("amz_product_id", "tracked_at")
+
+    def __str__(self):
+        return "%s %s: %s USD" % (self.amz_product_id, self.tracked_at, self.price)
@@ -1,8 +1,51 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+import django
+import requests
+from django.core.cache import caches
+from django.core.management import call_command
+from django.http import JsonResponse
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from .apps import serving_requests
 from .helpers.cryptocurrencies_helper import *
+from .helpers import bulk_affordability
+from .helpers.affordability_export import AffordabilityExport
+from .helpers.amazon_parser import AmazonPriceParser
+from .helpers.bulk_affordability import BulkAffordability
+from .helpers.circuit_breaker import CircuitBreaker, CircuitOpenError, RetryBudget
+from .helpers.http_cache_helper import HttpCacheHelper
+from .helpers.http_client import HttpClient
+from .helpers.parser_pool import ParserPool
+from .helpers.price_backfill import PriceBackfill
+from .helpers.price_cache import ProductPriceCache, SpotPriceCache
+from .helpers.price_prewarmer import PricePrewarmer
+from .helpers.price_providers import CryptoCompareProvider, FakePriceProvider, PriceProviderRegistry
+from .helpers.price_series_index import PriceSeriesIndex
+from .helpers.price_tracker import PriceTracker, RateLimiter
+from .helpers.product_catalog import ProductCatalog
+from .helpers.request_metrics import RequestMetrics
+from .helpers.response_renderer import ResponseRenderer
+from .helpers.single_flight import SingleFlight
+from .models import HistoricalPrice, Product, TrackedPrice
 
 class CryptocurrenciesHelperMethodsTests(TestCase):
 
+    def setUp(self):
+        CryptocurrenciesHelper.spot_price_cache.clear()
+        CryptocurrenciesHelper.product_price_cache.clear()
+
     # Tests for handle_request_params
     def test_handle_request_params_with_no_params(self):
         """
@@ -39,6 +82,13 @@ class CryptocurrenciesHelperMethodsTests(TestCase):
         params = {"currency" : "BTC", "amz_product_id" : "B01MQWUXZS", "date" : "2015-08-12"}
         self.assertEqual(CryptocurrenciesHelper.handle_request_params(params), 'currency_date_product')
 
+    def test_handle_request_params_with_currency_and_range(self):
+        """
+        If request includes currency, start and end, should return currency_range
+        """
+        params = {"currency" : "BTC", "start" : "2015-08-01", "end" : "2015-08-12"}
+        self.assertEqual(CryptocurrenciesHelper.handle_request_params(params), 'currency_range')
+
 
     # tests for currency_from_request
     def test_get_currency_from_request_with_supported_currency(self):
@@ -226,3 +276,1590 @@ class CryptocurrenciesHelperMethodsTests(TestCase):
         self.assertEqual(price in CryptocurrenciesHelper.RANDOM_PRODUCTS.values(), True)
         self.assertEqual(amz_product_id in CryptocurrenciesHelper.RANDOM_PRODUCTS.keys(), True)
         self.assertEqual(price, CryptocurrenciesHelper.RANDOM_PRODUCTS.get(amz_product_id))
+
+    def test_get_currency_value_with_stored_historical_price(self):
+        """
+        If the price for the given day is stored,
+        it should be returned without calling upstream.
+        """
+        HistoricalPrice.objects.create(currency="BTC", day=datetime.date(2015, 10, 30), usd=328.2)
+        with mock.patch.object(CryptocurrenciesHelper, "fetch_currency_value") as fetch:
+            (value, msg) = CryptocurrenciesHelper.get_currency_value("BTC", 1446236702)
+        self.assertEqual((value, msg), (328.2, ""))
+        fetch.assert_not_called()
+
+    def test_get_currency_value_stores_fetched_historical_price(self):
+        """
+        If the price for the given day is not stored,
+        it should be fetched once and stored.
+        """
+        with mock.patch.object(CryptocurrenciesHelper, "fetch_currency_value",
+                               return_value=(328.2, "")) as fetch:
+            CryptocurrenciesHelper.get_currency_value("BTC", 1446236702)
+            (value, msg) = CryptocurrenciesHelper.get_currency_value("BTC", 1446236702)
+        self.assertEqual((value, msg), (328.2, ""))
+        self.assertEqual(fetch.call_count, 1)
+        self.assertTrue(HistoricalPrice.objects.filter(currency="BTC", day=datetime.date(2015, 10, 30)).exists())
+
+
+class SpotPriceCacheTests(TestCase):
+
+    def test_get_caches_fresh_value(self):
+        """
+        A fresh value should be loaded once and then served from the cache.
+        """
+        calls = []
+        def loader():
+            calls.append(1)
+            return (7540.35, "")
+
+        cache = SpotPriceCache(ttl=60, stale_ttl=60)
+        self.assertEqual(cache.get("BTC", loader), (7540.35, ""))
+        self.assertEqual(cache.get("BTC", loader), (7540.35, ""))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_get_does_not_cache_errors(self):
+        """
+        If the loader returns no value, the error should be returned
+        and the next call should try again.
+        """
+        cache = SpotPriceCache(ttl=60, stale_ttl=60)
+        error = (None, "There was an error getting the currency value.")
+        self.assertEqual(cache.get("BTC", lambda: error), error)
+        self.assertEqual(cache.get("BTC", lambda: (54.77, "")), (54.77, ""))
+        self.assertEqual(cache.stats()["errors"], 1)
+
+    def test_get_serves_stale_value_while_refreshing(self):
+        """
+        An expired value within stale_ttl should be returned immediately
+        and refreshed in the background.
+        """
+        cache = SpotPriceCache(ttl=0, stale_ttl=60)
+        cache.set("BTC", 7540.35)
+        self.assertEqual(cache.get("BTC", lambda: (7600.0, "")), (7540.35, ""))
+        self.assertEqual(cache.stats()["stale_hits"], 1)
+
+
+class ProductPriceCacheTests(TestCase):
+
+    def test_get_caches_failed_lookup(self):
+        """
+        A failed lookup should be cached too, so the next call does not load again.
+        """
+        calls = []
+        def loader():
+            calls.append(1)
+            return (None, "AAAAAAAAAA", "The price for the given product could not be found.")
+
+        cache = ProductPriceCache(ttl=60, negative_ttl=10)
+        cache.get("AAAAAAAAAA", loader)
+        (price, amz_product_id, msg) = cache.get("AAAAAAAAAA", loader)
+        self.assertEqual(price, None)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()["negative_hits"], 1)
+
+    def test_get_reloads_expired_failed_lookup(self):
+        """
+        A failed lookup should expire after negative_ttl.
+        """
+        cache = ProductPriceCache(ttl=60, negative_ttl=0)
+        cache.get("B003EM8008", lambda: (None, "B003EM8008", "The price for the given product could not be found."))
+        result = cache.get("B003EM8008", lambda: (8.39, "B003EM8008", ""))
+        self.assertEqual(result, (8.39, "B003EM8008", ""))
+
+    def test_set_evicts_least_recently_used(self):
+        """
+        Beyond max_entries, the least recently used entry should be evicted.
+        """
+        cache = ProductPriceCache(max_entries=2)
+        cache.set("B01MQWUXZS", (159.99, "B01MQWUXZS", ""))
+        cache.set("B00EMKLSSM", (94.75, "B00EMKLSSM", ""))
+        cache.get("B01MQWUXZS", lambda: None)
+        cache.set("B06XDP7B71", (9.99, "B06XDP7B71", ""))
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.get("B00EMKLSSM", lambda: (1.0, "B00EMKLSSM", "")), (1.0, "B00EMKLSSM", ""))
+
+    def test_cache_counters_are_exposed_as_metrics(self):
+        """
+        The counters of the spot and product price caches should be reported
+        at the metrics endpoint.
+        """
+        (spot, product) = (SpotPriceCache(ttl=60), ProductPriceCache(max_entries=1))
+        spot.get("BTC", lambda: (7540.35, ""))
+        spot.get("BTC", lambda: (7540.35, ""))
+        product.get("AAAAAAAAAA", lambda: (None, "AAAAAAAAAA", "The price for the given product could not be found."))
+        product.get("AAAAAAAAAA", lambda: None)
+        product.set("B01MQWUXZS", (159.99, "B01MQWUXZS", ""))
+
+        with mock.patch.object(CryptocurrenciesHelper, "spot_price_cache", spot), \
+             mock.patch.object(CryptocurrenciesHelper, "product_price_cache", product):
+            metrics = self.client.get(reverse("playground:metrics")).content.decode()
+
+        for line in ('playground_cache_hits_total{cache="spot"} 1',
+                     'playground_cache_misses_total{cache="spot"} 1',
+                     'playground_cache_entries{cache="spot"} 1',
+                     'playground_cache_negative_hits_total{cache="product"} 1',
+                     'playground_cache_evictions_total{cache="product"} 1'):
+            self.assertIn(line, metrics)
+        self.assertNotIn('playground_cache_evictions_total{cache="spot"}', metrics)
+
+
+class HttpClientTests(TestCase):
+
+    def test_session_for_reuses_session_per_host(self):
+        """
+        Urls on the same host should share one session,
+        and urls on other hosts should get their own.
+        """
+        client = HttpClient()
+        price = client.session_for("https://min-api.cryptocompare.com/data/price")
+        historical = client.session_for("https://min-api.cryptocompare.com/data/pricehistorical")
+        amazon = client.session_for("https://www.amazon.com/gp/product/B01MQWUXZS")
+        self.assertIs(price, historical)
+        self.assertIsNot(price, amazon)
+
+    def test_get_applies_default_timeout(self):
+        """
+        If no timeout is given, the configured (connect, read) timeout should be used.
+        """
+        client = HttpClient(connect_timeout=1, read_timeout=2)
+        url = "https://min-api.cryptocompare.com/data/price"
+        with mock.patch.object(client.session_for(url), "get") as get:
+            client.get(url)
+        get.assert_called_once_with(url, timeout=(1, 2))
+
+
+class AmazonPriceParserTests(TestCase):
+
+    PAGE = ('<html><body><div id="nav"><span>Deals</span></div>'
+            '<table><tr><td><span id="priceblock_ourprice" class="a-color-price">$8.39</span></td></tr></table>'
+            '<div id="reviews"><span>5.0 out of 5 stars</span></div></body></html>')
+
+    def test_find_price_string_fast(self):
+        """
+        The fast path should return the same text as the full parse.
+        """
+        self.assertEqual(AmazonPriceParser.find_price_string_fast(self.PAGE), "$8.39")
+        self.assertEqual(AmazonPriceParser.find_price_string_full(self.PAGE), "$8.39")
+
+    def test_find_price_string_fast_with_nested_elements(self):
+        """
+        Nested elements with the same tag should not end the price element early.
+        """
+        html = "<div id='priceblock_ourprice'><div>$</div>8.39</div><div>other</div>"
+        self.assertEqual(AmazonPriceParser.find_price_string_fast(html), "$8.39")
+
+    def test_find_price_string_without_price_element(self):
+        """
+        If the page has no price element, it should return None.
+        """
+        html = '<span id="priceblock_unavailable">Currently unavailable.</span>'
+        self.assertEqual(AmazonPriceParser.find_price_string(html), None)
+
+    def test_find_price_string_falls_back_to_full_parse(self):
+        """
+        If the fast path cannot locate the element, the full parse should be used.
+        """
+        html = '<span data-x="1" id=priceblock_ourprice>$8.39'
+        self.assertEqual(AmazonPriceParser.find_price_string_fast(html), None)
+        self.assertEqual(AmazonPriceParser.find_price_string(html), "$8.39")
+
+
+class ConcurrentFetchTests(TestCase):
+
+    def setUp(self):
+        self.barrier = threading.Barrier(2, timeout=5)
+
+        def get_currency_value(currency, timestamp=None):
+            self.barrier.wait()
+            return (7540.35, "")
+
+        def get_price_from_amazon(amz_product_id):
+            self.barrier.wait()
+            return (119.99, amz_product_id, "")
+
+        patches = [mock.patch.object(CryptocurrenciesHelper, "get_currency_value", side_effect=get_currency_value),
+                   mock.patch.object(CryptocurrenciesHelper, "get_price_from_amazon", side_effect=get_price_from_amazon)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_response_for_currency_product_fetches_concurrently(self):
+        """
+        The currency value and the product price should be fetched at the same time.
+        Otherwise the barrier in both fetches times out.
+        """
+        params = {"currency" : "BTC", "amz_product_id" : "B003EM8008"}
+        response = CryptocurrenciesHelper.response_for_currency_product(params)
+        self.assertEqual(response["response"], "ok")
+        self.assertEqual(response["data"]["units"], 62)
+
+    def test_response_for_currency_date_product_async_fetches_concurrently(self):
+        """
+        The async version should also fetch both at the same time.
+        """
+        params = {"currency" : "BTC", "amz_product_id" : "B003EM8008", "date" : "2015-08-12"}
+        response = asyncio.run(CryptocurrenciesHelper.response_for_currency_date_product_async(params))
+        self.assertEqual(response["response"], "ok")
+        self.assertEqual(response["data"]["msg"], "You could have bought 62 units of the product with 1 BTC on 2015-08-12.")
+
+    @unittest.skipUnless(django.VERSION >= (3, 1), "async views need Django 3.1+")
+    def test_cryptocurrencies_async_view(self):
+        """
+        The async view should return the same response as the sync one.
+        """
+        params = {"currency" : "BTC", "amz_product_id" : "B003EM8008"}
+        response = self.client.get(reverse("playground:cryptocurrencies_async"), params)
+        self.assertEqual(response.json()["data"]["units"], 62)
+        self.barrier.reset()
+        self.assertEqual(self.client.get(reverse("playground:cryptocurrencies"), params).json(), response.json())
+
+    @unittest.skipUnless(django.VERSION >= (3, 1), "async views need Django 3.1+")
+    @override_settings(ROOT_URLCONF="currencies.urls")
+    def test_async_route_is_served_by_the_asgi_application(self):
+        """
+        The project's URLconf should route /playground/cryptocurrencies/async
+        to the async view, and the ASGI application should serve it.
+        """
+        from django.test import AsyncClient
+
+        path = reverse("playground:cryptocurrencies_async")
+        self.assertEqual(path, "/playground/cryptocurrencies/async")
+
+        response = asyncio.run(AsyncClient().get(path + "?currency=BTC&amz_product_id=B003EM8008"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["units"], 62)
+
+
+class CryptocurrenciesBatchTests(TestCase):
+
+    def setUp(self):
+        patches = [mock.patch.object(CryptocurrenciesHelper, "get_currency_value", return_value=(7540.35, "")),
+                   mock.patch.object(CryptocurrenciesHelper, "get_price_from_amazon",
+                                     side_effect=lambda amz_product_id: (119.99, amz_product_id, ""))]
+        self.get_currency_value = patches[0].start()
+        self.get_price_from_amazon = patches[1].start()
+        for patch in patches:
+            self.addCleanup(patch.stop)
+
+    def post_batch(self, body):
+        return self.client.post(reverse("playground:cryptocurrencies_batch"),
+                                json.dumps(body), content_type="application/json").json()
+
+    def test_batch_deduplicates_upstream_lookups(self):
+        """
+        Identical lookups within a batch should only be done once,
+        and results should be returned in the order of the queries.
+        """
+        queries = [{"currency" : "BTC", "amz_product_id" : "B003EM8008"},
+                   {"currency" : "BTC", "amz_product_id" : "B003EM8008"},
+                   {"currency" : "BTC", "amz_product_id" : "B003EM8008", "date" : "2015-08-12"}]
+        response = self.post_batch({"queries" : queries})
+        self.assertEqual(response["response"], "ok")
+        self.assertEqual([result["data"]["units"] for result in response["results"]], [62, 62, 62])
+        self.assertEqual(response["results"][2]["data"]["msg"],
+                         "You could have bought 62 units of the product with 1 BTC on 2015-08-12.")
+        self.assertEqual(self.get_currency_value.call_count, 2)
+        self.assertEqual(self.get_price_from_amazon.call_count, 1)
+
+    def test_batch_returns_per_query_errors(self):
+        """
+        An invalid query should get its own error without failing the batch.
+        """
+        queries = [{"currency" : "AAAAA"}, {"date" : "2015-08-12"}, "BTC", {"currency" : "BTC"}]
+        results = self.post_batch({"queries" : queries})["results"]
+        self.assertEqual([result["response"] for result in results], ["error", "error", "error", "ok"])
+        self.assertEqual(results[1]["msg"], "The only parameter required is currency. Ex(currency=BTC)")
+
+    def test_batch_rejects_non_string_values(self):
+        """
+        A query with a parameter that is not a string should get its own
+        error without failing the batch.
+        """
+        queries = [{"currency" : "BTC", "amz_product_id" : ["x"]},
+                   {"currency" : "BTC", "amz_product_id" : {"id" : "x"}},
+                   {"currency" : "BTC", "amz_product_id" : None},
+                   {"currency" : "BTC", "amz_product_id" : "B003EM8008"}]
+        results = self.post_batch({"queries" : queries})["results"]
+        self.assertEqual([result["response"] for result in results], ["error", "error", "error", "ok"])
+        self.assertEqual(results[0]["msg"], "Every request parameter must be a string.")
+        self.assertEqual(self.get_price_from_amazon.call_count, 1)
+
+    def test_batch_without_queries(self):
+        """
+        If the body has no list of queries, it should return an error msg.
+        """
+        self.assertEqual(self.post_batch({"currency" : "BTC"})["response"], "error")
+
+
+class CurrencyRangeTests(TestCase):
+
+    START = 1438387200
+    END = 1439337600
+
+    def setUp(self):
+        self.urls = []
+
+        def get(url):
+            self.urls.append(url)
+            query = dict(part.split("=") for part in url.split("?")[1].split("&"))
+            to_timestamp = int(query["toTs"])
+            limit = int(query["limit"])
+            data = [dict(time=to_timestamp - 86400 * days, close=7540.35)
+                    for days in range(limit, -1, -1)]
+            return mock.Mock(json=mock.Mock(return_value=dict(Response="Success", Data=data)))
+
+        patch = mock.patch.object(CryptocurrenciesHelper.http, "get", side_effect=get)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_fetch_currency_history_paginates(self):
+        """
+        Ranges longer than HISTODAY_PAGE_SIZE should be fetched in several
+        histoday calls and return one value per day.
+        """
+        with mock.patch.object(CryptocurrenciesHelper, "HISTODAY_PAGE_SIZE", 5):
+            (history, msg) = CryptocurrenciesHelper.fetch_currency_history("BTC", self.START, self.END)
+        self.assertEqual(msg, "")
+        self.assertEqual([timestamp for (timestamp, value) in history],
+                         list(range(self.START, self.END + 1, 86400)))
+        self.assertEqual(len(self.urls), 2)
+
+    def test_fetch_currency_history_stops_when_upstream_does_not_page_back(self):
+        """
+        If upstream ignores toTs and keeps answering with the same days,
+        it should return an error msg instead of looping forever.
+        """
+        data = [dict(time=self.END - 86400 * days, close=7540.35) for days in range(4, -1, -1)]
+        response = mock.Mock(json=mock.Mock(return_value=dict(Response="Success", Data=data)))
+        with mock.patch.object(CryptocurrenciesHelper.http, "get", return_value=response) as get:
+            (history, msg) = CryptocurrenciesHelper.fetch_currency_history("BTC", self.START, self.END + 86400 * 10)
+        self.assertIsNone(history)
+        self.assertEqual(msg, "There was an error getting the currency value.")
+        self.assertEqual(get.call_count, 2)
+
+    def test_response_for_currency_range(self):
+        """
+        It should return one point per day, with the units computed
+        by compare_currency_value_and_product_price, and store the days.
+        """
+        params = {"currency" : "BTC", "start" : "2015-08-01", "end" : "2015-08-12"}
+        with mock.patch.object(CryptocurrenciesHelper, "get_price_from_amazon",
+                               return_value=(119.99, "B003EM8008", "")):
+            params["amz_product_id"] = "B003EM8008"
+            response = CryptocurrenciesHelper.response_for_currency_range(params)
+            self.assertEqual(len(self.urls), 1)
+
+            series = response["data"]["series"]
+            self.assertEqual(len(series), 12)
+            self.assertEqual(series[-1], dict(date="2015-08-12", currency_value=7540.35, units=62, change=100.97,
+                                              msg="You could have bought 62 units of the product with 1 BTC on 2015-08-12."))
+
+            self.assertEqual(CryptocurrenciesHelper.response_for_currency_range(params), response)
+            self.assertEqual(len(self.urls), 1)
+
+    def test_response_for_currency_range_with_start_after_end(self):
+        """
+        If start is after end, it should return an error msg.
+        """
+        params = {"currency" : "BTC", "start" : "2015-08-12", "end" : "2015-08-01"}
+        self.assertEqual(CryptocurrenciesHelper.response_for_currency_range(params),
+                         dict(msg="The start date cannot be after the end date.", response="error"))
+
+
+class SingleFlightTests(TestCase):
+
+    def run_concurrently(self, single_flight, key, func, callers=5):
+        results = []
+        errors = []
+
+        def call():
+            try:
+                results.append(single_flight.do(key, func))
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=call) for i in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return (results, errors)
+
+    def test_do_shares_one_call_between_concurrent_callers(self):
+        """
+        Concurrent callers with the same key should share one call and its result.
+        """
+        release = threading.Event()
+        calls = []
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return (7540.35, "")
+
+        single_flight = SingleFlight()
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        (results, errors) = self.run_concurrently(single_flight, ("currency", "BTC", None), fetch)
+        self.assertEqual(results, [(7540.35, "")] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(single_flight.stats(), dict(calls=1, shared=4, in_flight=0))
+
+    def test_do_shares_errors(self):
+        """
+        If the shared call raises, every caller should get the error.
+        """
+        release = threading.Event()
+        def fetch():
+            release.wait(5)
+            raise ValueError("upstream failed")
+
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        (results, errors) = self.run_concurrently(SingleFlight(), ("product", "B003EM8008"), fetch)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 5)
+
+    def test_do_calls_again_after_completion(self):
+        """
+        Once a call completes, the next caller should start a new one.
+        """
+        single_flight = SingleFlight()
+        self.assertEqual(single_flight.do("BTC", lambda: 1), 1)
+        self.assertEqual(single_flight.do("BTC", lambda: 2), 2)
+
+
+class PricePrewarmerTests(TestCase):
+
+    def setUp(self):
+        CryptocurrenciesHelper.spot_price_cache.clear()
+        CryptocurrenciesHelper.rate_matrix_cache.clear()
+        CryptocurrenciesHelper.product_price_cache.clear()
+
+    def test_refresh_all_fills_caches(self):
+        """
+        Every currency and product should be fetched and cached,
+        and its refresh time recorded.
+        """
+        with mock.patch.object(CryptocurrenciesHelper, "fetch_currency_value", return_value=(7540.35, "")), \
+             mock.patch.object(CryptocurrenciesHelper, "fetch_rate_matrix",
+                               return_value=(FiatTests.MATRIX, "")), \
+             mock.patch.object(CryptocurrenciesHelper, "fetch_price_from_amazon",
+                               side_effect=lambda amz_product_id: (119.99, amz_product_id, "")) as fetch_price:
+            status = PricePrewarmer(interval=20).refresh_all()
+            self.assertEqual(CryptocurrenciesHelper.get_currency_value("BTC"), (7540.35, ""))
+            self.assertEqual(CryptocurrenciesHelper.get_price_from_amazon("B01MQWUXZS"), (119.99, "B01MQWUXZS", ""))
+            self.assertEqual(fetch_price.call_count, len(CryptocurrenciesHelper.RANDOM_PRODUCTS))
+
+        self.assertEqual(len(status), len(PricePrewarmer.keys()))
+        for value_status in status.values():
+            self.assertIsNotNone(value_status["last_refreshed"])
+            self.assertEqual(value_status["failures"], 0)
+
+    def test_refresh_backs_off_after_failures(self):
+        """
+        After consecutive failures, the next refresh should be pushed back exponentially.
+        """
+        prewarmer = PricePrewarmer(interval=10, jitter=0, max_backoff=100)
+        error = (None, "There was an error getting the currency value.")
+        with mock.patch.object(CryptocurrenciesHelper, "fetch_currency_value", return_value=error):
+            before = time.time()
+            prewarmer.refresh(("currency", "BTC"))
+            status = prewarmer.refresh(("currency", "BTC"))
+
+        self.assertEqual(status["failures"], 2)
+        self.assertEqual(status["last_error"], error[1])
+        self.assertIsNone(status["last_refreshed"])
+        self.assertAlmostEqual(status["next_run"] - before, 40, delta=1)
+
+    def test_products_are_refreshed_once_per_price_ttl(self):
+        """
+        Product prices should be refreshed a bit more often than their cache
+        TTL, not on the much shorter interval of spot prices.
+        """
+        prewarmer = PricePrewarmer(interval=20, jitter=0.1)
+        with mock.patch.object(CryptocurrenciesHelper, "fetch_price_from_amazon",
+                               return_value=(119.99, "B01MQWUXZS", "")):
+            before = time.time()
+            status = prewarmer.refresh(("product", "B01MQWUXZS"))
+
+        ttl = CryptocurrenciesHelper.product_price_cache.ttl
+        self.assertEqual(prewarmer.product_interval, ttl * 0.9)
+        self.assertGreater(status["next_run"] - before, ttl * 0.8)
+        self.assertLess(status["next_run"] - before, ttl)
+        self.assertEqual(PricePrewarmer(product_interval=600).product_interval, 600)
+
+    def test_refresh_status_is_exposed_as_metrics(self):
+        """
+        When each value was last refreshed, and its failures, should be
+        reported at the metrics endpoint.
+        """
+        prewarmer = PricePrewarmer()
+        with mock.patch.object(CryptocurrenciesHelper, "fetch_currency_value", return_value=(7540.35, "")), \
+             mock.patch.object(PricePrewarmer, "shared_instance", prewarmer):
+            status = prewarmer.refresh(("currency", "BTC"))
+            metrics = self.client.get(reverse("playground:metrics")).content.decode()
+
+        self.assertIn('playground_prewarm_last_refreshed_timestamp_seconds{kind="currency",name="BTC"} %r'
+                      % status["last_refreshed"], metrics)
+        self.assertIn('playground_prewarm_failures{kind="currency",name="BTC"} 0', metrics)
+        self.assertNotIn('playground_prewarm_last_refreshed_timestamp_seconds{kind="currency",name="ETH"}', metrics)
+
+    def test_failed_refresh_keeps_the_cached_product_price(self):
+        """
+        A failed scrape should be recorded in the status without replacing
+        the price already cached for the product.
+        """
+        CryptocurrenciesHelper.product_price_cache.set("B01MQWUXZS", (119.99, "B01MQWUXZS", ""))
+        error = (None, "B01MQWUXZS", "The price of the product could not be found.")
+        with mock.patch.object(CryptocurrenciesHelper, "fetch_price_from_amazon", return_value=error):
+            status = PricePrewarmer().refresh(("product", "B01MQWUXZS"))
+
+        self.assertEqual(status["last_error"], error[2])
+        self.assertEqual(CryptocurrenciesHelper.get_price_from_amazon("B01MQWUXZS"), (119.99, "B01MQWUXZS", ""))
+
+    def test_only_serving_processes_start_background_work(self):
+        """
+        Background work should start in servers and in the runserver process that
+        handles requests, but not in its autoreloader or other management commands.
+        """
+        self.assertTrue(serving_requests(["gunicorn", "currencies.wsgi"], {}))
+        self.assertTrue(serving_requests(["manage.py", "runserver"], {"RUN_MAIN": "true"}))
+        self.assertTrue(serving_requests(["manage.py", "runserver", "--noreload"], {}))
+        self.assertFalse(serving_requests(["manage.py", "runserver"], {}))
+        self.assertFalse(serving_requests(["manage.py", "migrate"], {}))
+        self.assertFalse(serving_requests(["manage.py", "test"], {"RUN_MAIN": "true"}))
+        self.assertFalse(serving_requests(["/usr/bin/django-admin", "migrate"], {}))
+
+    @override_settings(PLAYGROUND_PREWARM_ON_STARTUP=True)
+    def test_ready_does_not_prewarm_outside_servers(self):
+        """
+        With PLAYGROUND_PREWARM_ON_STARTUP, a management command like migrate
+        should not start the prewarmer.
+        """
+        from django.apps import apps
+        with mock.patch("sys.argv", ["manage.py", "migrate"]), \
+             mock.patch.object(PricePrewarmer, "start") as start:
+            apps.get_app_config("playground").ready()
+        start.assert_not_called()
+
+
+class BulkAffordabilityTests(TestCase):
+
+    CURRENCY_VALUES = [7540.35, 54.77, 0, 2.675, 119.99, 1.005]
+    PRODUCT_PRICES = [119.99, 119.99, 119.99, 1.0, 119.99, 1.0]
+
+    def assert_results_match_scalar(self):
+        CH = CryptocurrenciesHelper
+        for timestamp in (None, 1346236702):
+            timestamps = None if timestamp is None else [timestamp] * len(self.CURRENCY_VALUES)
+            expected = [CH.compare_currency_value_and_product_price("BTC", value, price, timestamp)
+                        for (value, price) in zip(self.CURRENCY_VALUES, self.PRODUCT_PRICES)]
+            actual = BulkAffordability.results("BTC", self.CURRENCY_VALUES, self.PRODUCT_PRICES, timestamps)
+            self.assertEqual(actual, expected)
+            self.assertEqual([type(units) for (units, change, msg) in actual],
+                             [type(units) for (units, change, msg) in expected])
+
+    def test_results_match_scalar_function(self):
+        """
+        Results should be identical to compare_currency_value_and_product_price.
+        """
+        self.assert_results_match_scalar()
+
+    def test_results_match_scalar_function_without_numpy(self):
+        """
+        Without NumPy, results should still be identical.
+        """
+        with mock.patch.object(bulk_affordability, "np", None):
+            self.assert_results_match_scalar()
+
+    def test_compare_returns_units_change_and_units_needed(self):
+        """
+        It should return units, change and units needed without building messages.
+        """
+        (units, change, units_needed) = BulkAffordability.compare([7540.35, 54.77], 119.99)
+        self.assertEqual(list(units), [62, 0.46])
+        self.assertEqual(list(change), [100.97, 0])
+        self.assertNotEqual(units_needed[0], units_needed[0])
+        self.assertEqual(units_needed[1], 2.1907978821)
+
+
+class ResponseRendererTests(TestCase):
+
+    RESPONSES = [
+        CryptocurrenciesHelper.build_response("BTC", 7540.35, 119.99, "B01MQWUXZS"),
+        CryptocurrenciesHelper.build_response("LTC", 54.77, 119.99, "B01MQWUXZS", 1346236702),
+        CryptocurrenciesHelper.build_response("ETH", 0, 119.99, "B01MQWUXZS"),
+        dict(msg="The price for the given product could not be found.", response="error"),
+        dict(msg="Caf\u00e9 \"quoted\"\n", response="error"),
+        dict(msg="The only parameter required is currency. Ex(currency=BTC)"),
+        dict(response="ok", results=[dict(msg="error", response="error")]),
+    ]
+
+    def test_render_matches_json_response(self):
+        """
+        Rendered bodies should be byte for byte what JsonResponse produces,
+        including when served from the memoized bodies.
+        """
+        renderer = ResponseRenderer()
+        for response in self.RESPONSES * 2:
+            self.assertEqual(renderer.render(response), JsonResponse(response).content)
+
+    def test_render_memoizes_bodies(self):
+        """
+        Identical templated responses should return the same memoized body.
+        """
+        renderer = ResponseRenderer(max_entries=1)
+        response = CryptocurrenciesHelper.build_response("BTC", 7540.35, 119.99, "B01MQWUXZS")
+        body = renderer.render(response)
+        self.assertIs(renderer.render(dict(response)), body)
+
+    def test_cryptocurrencies_view_response(self):
+        """
+        The view should send the rendered body as application/json.
+        """
+        response = self.client.get(reverse("playground:cryptocurrencies"))
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.content, JsonResponse(
+            dict(msg="The only parameter required is currency. Ex(currency=BTC)")).content)
+
+
+class CryptocurrenciesHttpCacheTests(TestCase):
+
+    def setUp(self):
+        caches["default"].clear()
+        patches = [mock.patch.object(CryptocurrenciesHelper, "get_currency_value", return_value=(7540.35, "")),
+                   mock.patch.object(CryptocurrenciesHelper, "get_price_from_amazon",
+                                     side_effect=lambda amz_product_id: (119.99, amz_product_id, ""))]
+        self.get_currency_value = patches[0].start()
+        patches[1].start()
+        for patch in patches:
+            self.addCleanup(patch.stop)
+
+    def get(self, params, **headers):
+        return self.client.get(reverse("playground:cryptocurrencies"), params, **headers)
+
+    @override_settings(PLAYGROUND_SPOT_MAX_AGE=30, PLAYGROUND_DATED_MAX_AGE=86400)
+    def test_cache_control_for_spot_and_dated_queries(self):
+        """
+        Dated queries should get the long max-age, spot queries the short one,
+        and errors should have to be revalidated.
+        """
+        spot = self.get({"currency" : "BTC", "amz_product_id" : "B003EM8008"})
+        dated = self.get({"currency" : "BTC", "amz_product_id" : "B003EM8008", "date" : "2015-08-12"})
+        error = self.get({"currency" : "AAAAA"})
+        self.assertIn("max-age=30", spot["Cache-Control"])
+        self.assertIn("max-age=86400", dated["Cache-Control"])
+        self.assertIn("no-cache", error["Cache-Control"])
+
+    @override_settings(PLAYGROUND_SPOT_MAX_AGE=30, PLAYGROUND_DATED_MAX_AGE=86400)
+    def test_max_age_compares_dates_and_needs_a_product(self):
+        """
+        Only past dates with a given product should get the long max-age: a
+        random product can change, and dates are compared as dates, not text.
+        """
+        HC = HttpCacheHelper
+        ok = dict(response="ok")
+        self.assertEqual(HC.max_age_for({"date" : "2015-08-12"}, "currency_date_product", ok), 86400)
+        self.assertEqual(HC.max_age_for({"date" : "2015-08-12"}, "currency_date", ok), 30)
+        self.assertEqual(HC.max_age_for({"date" : "9999-1-1"}, "currency_date_product", ok), 30)
+        self.assertEqual(HC.max_age_for({"date" : datetime.date.today().isoformat()}, "currency_date_product", ok), 30)
+        self.assertEqual(HC.max_age_for({"end" : "2015-8-12", "amz_product_id" : "B003EM8008"},
+                                        "currency_range", ok), 86400)
+        self.assertEqual(HC.max_age_for({"end" : "2015-8-12"}, "currency_range", ok), 30)
+
+    def test_conditional_get_returns_304(self):
+        """
+        If If-None-Match matches the ETag of the response, it should return a 304.
+        """
+        params = {"currency" : "BTC", "amz_product_id" : "B003EM8008", "date" : "2015-08-12"}
+        response = self.get(params)
+        self.assertEqual(response.status_code, 200)
+        not_modified = self.get(params, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+
+    @override_settings(PLAYGROUND_RESPONSE_CACHE="default")
+    def test_server_side_response_cache(self):
+        """
+        With a response cache, identical queries in any parameter order
+        should be answered from the cache.
+        """
+        first = self.get({"currency" : "BTC", "amz_product_id" : "B003EM8008", "date" : "2015-08-12"})
+        second = self.client.get(reverse("playground:cryptocurrencies") +
+                                 "?date=2015-08-12&amz_product_id=B003EM8008&currency=BTC")
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+        self.assertEqual(self.get_currency_value.call_count, 1)
+
+
+class RequestMetricsTests(TestCase):
+
+    def setUp(self):
+        CryptocurrenciesHelper.spot_price_cache.clear()
+        CryptocurrenciesHelper.product_price_cache.clear()
+        CryptocurrenciesHelper.renderer.clear()
+        CryptocurrenciesHelper.metrics.clear()
+
+    @mock.patch.object(CryptocurrenciesHelper, "fetch_price_from_amazon",
+                       side_effect=lambda amz_product_id: (119.99, amz_product_id, ""))
+    @mock.patch.object(CryptocurrenciesHelper, "fetch_currency_value", return_value=(7540.35, ""))
+    def test_cryptocurrencies_view_sends_server_timing(self, fetch_currency_value, fetch_price_from_amazon):
+        """
+        The response should time every stage of the request, including the
+        currency fetch done on the executor, and the stages should be
+        aggregated at the metrics endpoint.
+        """
+        response = self.client.get(reverse("playground:cryptocurrencies"),
+                                   {"currency" : "BTC", "amz_product_id" : "B003EM8008"})
+        stages = [metric.split(";")[0] for metric in response["Server-Timing"].split(", ")]
+        self.assertEqual(stages, ["currency_fetch", "product_fetch", "compute", "serialize", "total"])
+
+        metrics = self.client.get(reverse("playground:metrics")).content.decode()
+        self.assertIn('playground_stage_duration_seconds_count{stage="currency_fetch"} 1', metrics)
+        self.assertIn('playground_stage_duration_seconds_bucket{stage="serialize",le="+Inf"} 1', metrics)
+
+    def test_http_client_counts_calls_and_errors_per_host(self):
+        """
+        HttpClient should count calls per host, counting exceptions and
+        5xx responses as errors.
+        """
+        metrics = RequestMetrics()
+        client = HttpClient(metrics=metrics)
+        session = mock.Mock()
+        session.get.side_effect = [mock.Mock(status_code=200), mock.Mock(status_code=503),
+                                   requests.ConnectionError()]
+        with mock.patch.object(client, "session_for", return_value=session):
+            client.get("https://min-api.cryptocompare.com/data/price?fsym=BTC&tsyms=USD")
+            client.get("https://min-api.cryptocompare.com/data/price?fsym=BTC&tsyms=USD")
+            with self.assertRaises(requests.ConnectionError):
+                client.get("https://www.amazon.com/gp/product/B003EM8008")
+
+        self.assertEqual(metrics.upstream_stats(), {
+            "min-api.cryptocompare.com" : dict(requests=2, errors=1),
+            "www.amazon.com" : dict(requests=1, errors=1),
+        })
+        rendered = metrics.render_prometheus()
+        self.assertIn('playground_upstream_requests_total{host="min-api.cryptocompare.com"} 2', rendered)
+        self.assertIn('playground_upstream_errors_total{host="www.amazon.com"} 1', rendered)
+
+    def test_histogram_buckets_are_cumulative(self):
+        """
+        Observations should land in the first bucket they fit in, and the
+        rendered bucket counts should be cumulative.
+        """
+        metrics = RequestMetrics(buckets=(0.1, 1))
+        for seconds in (0.05, 0.5, 5):
+            metrics.observe("compute", seconds)
+        (bucket_counts, total, count) = metrics.stage_stats()["compute"]
+        self.assertEqual(bucket_counts, [1, 2])
+        self.assertAlmostEqual(total, 5.55)
+        self.assertEqual(count, 3)
+
+
+class CircuitBreakerTests(TestCase):
+
+    def test_breaker_opens_probes_and_closes(self):
+        """
+        The breaker should open once the failure rate is reached, reject
+        calls while open, then let trial calls through and close if they
+        succeed.
+        """
+        breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, window=30,
+                                 open_seconds=10, half_open_trials=2)
+        with mock.patch("time.time", return_value=1000):
+            for success in (True, False, True, False):
+                self.assertTrue(breaker.allow())
+                breaker.record(success)
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            self.assertFalse(breaker.allow())
+
+        with mock.patch("time.time", return_value=1011):
+            self.assertTrue(breaker.allow())
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            breaker.record(True)
+            breaker.record(True)
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.status()["rejected"], 2)
+
+    def test_failed_trial_reopens_breaker(self):
+        """
+        A failed trial call should open the breaker again.
+        """
+        breaker = CircuitBreaker(failure_rate=0.5, min_calls=1, open_seconds=10)
+        with mock.patch("time.time", return_value=1000):
+            breaker.allow()
+            breaker.record(False)
+        with mock.patch("time.time", return_value=1011):
+            self.assertTrue(breaker.allow())
+            breaker.record(False)
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            self.assertFalse(breaker.allow())
+
+    def test_retry_budget_limits_retries(self):
+        """
+        Once the budget is spent, retries should be denied until calls
+        or time earn more.
+        """
+        with mock.patch("time.time", return_value=1000):
+            budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=2)
+            self.assertTrue(budget.try_retry())
+            self.assertTrue(budget.try_retry())
+            self.assertFalse(budget.try_retry())
+            budget.record_call()
+            budget.record_call()
+            self.assertTrue(budget.try_retry())
+        self.assertEqual(budget.status(), dict(retries=3, exhausted=1))
+
+    def test_open_breaker_fails_fast_with_existing_message(self):
+        """
+        While the breaker for cryptocompare is open, get_currency_value should
+        return the usual error message without calling upstream.
+        """
+        client = HttpClient(breaker_options=dict(min_calls=2, open_seconds=60), max_retries=1,
+                            retry_budget_options=dict(ratio=0, min_per_second=0, max_tokens=1))
+        session = mock.Mock()
+        session.get.side_effect = requests.Timeout()
+        with mock.patch.object(client, "session_for", return_value=session), \
+             mock.patch.object(CryptocurrenciesHelper, "http", client):
+            CryptocurrenciesHelper.spot_price_cache.clear()
+            (value, msg) = CryptocurrenciesHelper.get_currency_value("BTC")
+            self.assertEqual(session.get.call_count, 2)
+            self.assertEqual(client.status()["min-api.cryptocompare.com"]["state"], CircuitBreaker.OPEN)
+
+            CryptocurrenciesHelper.spot_price_cache.clear()
+            (value, msg) = CryptocurrenciesHelper.get_currency_value("BTC")
+            self.assertIsNone(value)
+            self.assertEqual(msg, "There was an error getting the currency value.")
+            self.assertEqual(session.get.call_count, 2)
+            with self.assertRaises(CircuitOpenError):
+                client.get("https://min-api.cryptocompare.com/data/price?fsym=BTC&tsyms=USD")
+
+
+class PriceProviderTests(TestCase):
+
+    def setUp(self):
+        CryptocurrenciesHelper.spot_price_cache.clear()
+
+    def fake(self, name, **kwargs):
+        provider = FakePriceProvider(**kwargs)
+        provider.name = name
+        return provider
+
+    def test_slow_primary_is_hedged(self):
+        """
+        If the primary has not answered within the hedge delay, the secondary
+        should be asked too, and its answer returned without waiting.
+        """
+        primary = self.fake("primary", prices={"BTC" : 1.0}, delay=0.5)
+        secondary = self.fake("secondary", prices={"BTC" : 2.0})
+        registry = PriceProviderRegistry([primary, secondary], hedge_delay=0.05)
+        start = time.time()
+        self.assertEqual(registry.get_value(None, "BTC"), 2.0)
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual(registry.stats(), dict(lookups=1, hedges=1, failures=0, wins={"secondary" : 1}))
+
+    def test_single_provider_is_asked_inline(self):
+        """
+        With a single provider, even with a hedge delay, it should be asked
+        in the calling thread instead of through the hedge pool.
+        """
+        registry = PriceProviderRegistry([self.fake("primary", prices={"BTC" : 1.0})], hedge_delay=0.5)
+        with mock.patch.object(registry.executor, "submit") as submit:
+            self.assertEqual(registry.get_value(None, "BTC"), 1.0)
+        submit.assert_not_called()
+        self.assertEqual(registry.stats(), dict(lookups=1, hedges=0, failures=0, wins={"primary" : 1}))
+
+    def test_fast_primary_is_not_hedged(self):
+        """
+        If the primary answers within the hedge delay, the secondary should
+        not be asked.
+        """
+        primary = self.fake("primary", prices={"BTC" : 1.0})
+        secondary = self.fake("secondary", prices={"BTC" : 2.0})
+        registry = PriceProviderRegistry([primary, secondary], hedge_delay=0.5)
+        self.assertEqual(registry.get_value(None, "BTC"), 1.0)
+        self.assertEqual(secondary.calls, 0)
+
+    def test_failed_providers_fall_over(self):
+        """
+        With or without hedging, a failed provider should fall over to the
+        next one, and None should be returned if all of them fail.
+        """
+        for hedge_delay in (None, 0.5):
+            registry = PriceProviderRegistry([self.fake("primary", error=ValueError()),
+                                              self.fake("secondary", prices={"BTC" : 2.0})],
+                                             hedge_delay=hedge_delay)
+            self.assertEqual(registry.get_value(None, "BTC"), 2.0)
+            self.assertIsNone(registry.get_value(None, "ETH"))
+
+    def test_cryptocompare_provider_parses_responses(self):
+        """
+        CryptoCompareProvider should build cryptocompare URLs and read the USD
+        value of spot and historical responses.
+        """
+        provider = CryptoCompareProvider("https://min-api.cryptocompare.com")
+        http = mock.Mock()
+        http.get.return_value.json.side_effect = [{"USD" : 7540.35}, {"BTC" : {"USD" : 119.99}}]
+        self.assertEqual(provider.get_value(http, "BTC"), 7540.35)
+        self.assertEqual(provider.get_value(http, "BTC", 1346236702), 119.99)
+        http.get.assert_called_with("https://min-api.cryptocompare.com/data/pricehistorical"
+                                    "?fsym=BTC&tsyms=USD&ts=1346236702")
+
+    def test_get_currency_value_uses_providers(self):
+        """
+        get_currency_value should answer from the registered providers, and
+        return the usual error message if none of them answers.
+        """
+        registry = PriceProviderRegistry([self.fake("fake")])
+        with mock.patch.object(CryptocurrenciesHelper, "price_providers", registry):
+            self.assertEqual(CryptocurrenciesHelper.get_currency_value("BTC"), (7540.35, ""))
+            registry.providers[0].error = ValueError()
+            CryptocurrenciesHelper.spot_price_cache.clear()
+            self.assertEqual(CryptocurrenciesHelper.get_currency_value("BTC"),
+                             (None, "There was an error getting the currency value."))
+
+
+class PriceBackfillTests(TestCase):
+
+    CSV = ("currency,date,usd\n"
+           "BTC,2015-08-12,264.47\n"
+           "eth,2015-08-12,1.85\n"
+           "BTC,not a date,1\n"
+           "BTC,2015-08-13,267.05\n")
+
+    def setUp(self):
+        HistoricalPrice.objects.all().delete()
+
+    def write_dump(self, name, content):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(lambda: [os.remove(os.path.join(directory, f)) for f in os.listdir(directory)])
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_import_is_idempotent(self):
+        """
+        Importing a dump should insert its valid rows in chunks, skipping bad
+        ones, and importing it again should change nothing.
+        """
+        path = self.write_dump("prices.csv", self.CSV)
+        stats = PriceBackfill(chunk_size=2).import_file(path)
+        self.assertEqual((stats["read"], stats["inserted"], stats["skipped"]), (4, 3, 1))
+        self.assertEqual(HistoricalPrice.objects.get(currency="ETH").usd, 1.85)
+
+        stats = PriceBackfill(chunk_size=2).import_file(path)
+        self.assertEqual((stats["inserted"], stats["unchanged"]), (0, 3))
+        self.assertEqual(HistoricalPrice.objects.count(), 3)
+
+    def test_update_overwrites_changed_prices(self):
+        """
+        With update, stored prices that differ from the dump should be overwritten.
+        """
+        HistoricalPrice.objects.create(currency="BTC", day="2015-08-12", usd=1)
+        path = self.write_dump("prices.csv", self.CSV)
+        stats = PriceBackfill(update=True).import_file(path)
+        self.assertEqual((stats["inserted"], stats["updated"]), (2, 1))
+        self.assertEqual(HistoricalPrice.objects.get(currency="BTC", day="2015-08-12").usd, 264.47)
+
+    def test_malformed_json_lines_are_skipped(self):
+        """
+        Lines that are not valid JSON, and values that are null or not
+        strings, should be counted as skipped without aborting the import.
+        """
+        path = self.write_dump("prices.jsonl", "\n".join([
+            json.dumps(dict(currency="BTC", date="2015-08-12", usd=264.47)),
+            '{"currency": "BTC", "date": ',
+            json.dumps(dict(currency=None, date="2015-08-13", usd=1)),
+            json.dumps(dict(currency="BTC", date=20150813, usd=1)),
+            json.dumps(dict(currency=["BTC"], day="2015-08-13", usd=1)),
+            json.dumps(["BTC", "2015-08-13", 1]),
+            json.dumps(dict(currency="ETH", day="2015-08-12", usd=1.85)),
+        ]))
+        stats = PriceBackfill().import_file(path)
+        self.assertEqual((stats["read"], stats["inserted"], stats["skipped"]), (7, 2, 5))
+
+    def test_read_json_array_streams_items(self):
+        """
+        read_json_array should yield every item, even when items are split
+        across blocks.
+        """
+        items = [dict(currency="BTC", date="2015-08-%02d" % day, usd=day * 1.5) for day in range(1, 30)]
+        rows = list(PriceBackfill.read_json_array(io.StringIO(json.dumps(items, indent=1)), block_size=7))
+        self.assertEqual(rows, items)
+
+    def test_command_backfills_dated_lookups(self):
+        """
+        After backfill_prices, dated lookups should be answered from the
+        table without calling upstream, and the import rate should be reported.
+        """
+        path = self.write_dump("prices.json", json.dumps([dict(currency="BTC", date="2015-08-12", usd=264.47)]))
+        out = io.StringIO()
+        call_command("backfill_prices", path, stdout=out)
+        self.assertIn("1 inserted", out.getvalue())
+        self.assertIn("rows/sec", out.getvalue())
+
+        timestamp = time.mktime(datetime.date(2015, 8, 12).timetuple())
+        with mock.patch.object(CryptocurrenciesHelper, "fetch_currency_value") as fetch_currency_value:
+            self.assertEqual(CryptocurrenciesHelper.get_currency_value("BTC", timestamp), (264.47, ""))
+        fetch_currency_value.assert_not_called()
+
+
+class FiatTests(TestCase):
+
+    MATRIX = {"BTC" : {"USD" : 8000.0, "EUR" : 6400.0, "GBP" : 5600.0},
+              "LTC" : {"USD" : 100.0, "EUR" : 80.0, "GBP" : 70.0},
+              "ETH" : {"USD" : 400.0, "EUR" : 320.0, "GBP" : 280.0}}
+
+    def setUp(self):
+        CryptocurrenciesHelper.rate_matrix_cache.clear()
+        CryptocurrenciesHelper.product_price_cache.clear()
+
+    def test_request_rate_matrix_fetches_every_pair_at_once(self):
+        """
+        The rate matrix should come from a single pricemulti request for every
+        supported cryptocurrency and fiat currency.
+        """
+        http = mock.Mock()
+        http.get.return_value.json.return_value = self.MATRIX
+        with mock.patch.object(CryptocurrenciesHelper, "http", http):
+            self.assertEqual(CryptocurrenciesHelper.request_rate_matrix(), (self.MATRIX, ""))
+        http.get.assert_called_once_with("https://min-api.cryptocompare.com/data/pricemulti"
+                                         "?fsyms=BTC,LTC,ETH&tsyms=USD,EUR,GBP")
+
+    @mock.patch.object(CryptocurrenciesHelper, "fetch_price_from_amazon",
+                       side_effect=lambda amz_product_id: (119.99, amz_product_id, ""))
+    def test_response_in_fiat_converts_product_price(self, fetch_price_from_amazon):
+        """
+        With a fiat parameter, the currency value should come from the matrix
+        and the product's USD price should be converted with the cross rate,
+        sharing one matrix fetch between currencies.
+        """
+        with mock.patch.object(CryptocurrenciesHelper, "fetch_rate_matrix",
+                               return_value=(self.MATRIX, "")) as fetch_rate_matrix:
+            btc = CryptocurrenciesHelper.response_for_currency_product(
+                {"currency" : "BTC", "amz_product_id" : "B003EM8008", "fiat" : "EUR"})
+            eth = CryptocurrenciesHelper.response_for_currency_product(
+                {"currency" : "ETH", "amz_product_id" : "B003EM8008", "fiat" : "EUR"})
+        self.assertEqual(fetch_rate_matrix.call_count, 1)
+        self.assertEqual(btc["data"]["currency_value"], 6400.0)
+        self.assertEqual(btc["data"]["product_price"], 95.99)
+        self.assertEqual(btc["data"]["fiat"], "EUR")
+        self.assertEqual(eth["data"]["currency_value"], 320.0)
+
+    def test_random_product_price_is_converted(self):
+        """
+        Without a product, a random product's price should be converted too.
+        """
+        with mock.patch.object(CryptocurrenciesHelper, "fetch_rate_matrix", return_value=(self.MATRIX, "")):
+            response = CryptocurrenciesHelper.response_for_currency({"currency" : "LTC", "fiat" : "GBP"})
+        usd_price = CryptocurrenciesHelper.RANDOM_PRODUCTS[response["data"]["amz_product_id"]]
+        self.assertEqual(response["data"]["product_price"], round(usd_price * 0.7, 2))
+
+    @unittest.skipUnless(django.VERSION >= (3, 1), "async views need Django 3.1+")
+    def test_async_fiat_requests_do_not_starve_the_executor(self):
+        """
+        Concurrent async requests in a fiat currency should all finish, even
+        when there are more of them than CryptocurrenciesHelper.executor workers.
+        """
+        from django.test import RequestFactory
+        from . import views
+
+        def fetch_rate_matrix():
+            time.sleep(0.1)
+            return (self.MATRIX, "")
+
+        executor = ThreadPoolExecutor(max_workers=2)
+        patches = [
+            mock.patch.object(CryptocurrenciesHelper, "executor", executor),
+            mock.patch.object(CryptocurrenciesHelper, "fetch_rate_matrix", side_effect=fetch_rate_matrix),
+            mock.patch.object(CryptocurrenciesHelper, "fetch_price_from_amazon",
+                              side_effect=lambda amz_product_id: (119.99, amz_product_id, "")),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        # Unblocks any deadlocked worker, so a failure does not hang the run.
+        self.addCleanup(executor.shutdown, wait=False, cancel_futures=True)
+
+        async def requests():
+            factory = RequestFactory()
+            return await asyncio.wait_for(asyncio.gather(*[
+                views.cryptocurrencies_async(factory.get("/", {"currency" : "BTC", "fiat" : "EUR"}))
+                for n in range(4)]), timeout=5)
+
+        responses = asyncio.run(requests())
+        self.assertEqual([json.loads(response.content.decode("utf-8"))["data"]["fiat"] for response in responses],
+                         ["EUR"] * 4)
+
+    def test_fiat_validation(self):
+        """
+        Unsupported fiat currencies, and fiat currencies other than USD with
+        a date, should return an error.
+        """
+        CH = CryptocurrenciesHelper
+        self.assertEqual(CH.response_for_currency({"currency" : "BTC", "fiat" : "JPY"})["response"], "error")
+        response = CH.response_for_currency_date({"currency" : "BTC", "date" : "2015-08-12", "fiat" : "EUR"})
+        self.assertEqual(response, dict(msg=CH.MSG_FIAT_NOT_DATED, response="error"))
+
+
+class AffordabilityExportTests(TestCase):
+
+    def setUp(self):
+        self.pages = []
+
+        def get_currency_history(currency, start_timestamp, end_timestamp):
+            self.pages.append((currency, datetime.date.fromtimestamp(start_timestamp),
+                               datetime.date.fromtimestamp(end_timestamp)))
+            day = datetime.date.fromtimestamp(start_timestamp)
+            history = []
+            while day <= datetime.date.fromtimestamp(end_timestamp):
+                history.append((time.mktime(day.timetuple()), 100.0 if currency == "LTC" else 7540.35))
+                day += datetime.timedelta(days=1)
+            return (history, "")
+
+        patches = [
+            mock.patch.object(CryptocurrenciesHelper, "get_currency_history", side_effect=get_currency_history),
+            mock.patch.object(CryptocurrenciesHelper, "get_price_from_amazon",
+                              side_effect=lambda amz_product_id: (119.99, amz_product_id, "")),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def export(self, **params):
+        response = self.client.get(reverse("playground:cryptocurrencies_export"), params)
+        return (response, b"".join(response.streaming_content).decode("utf-8"))
+
+    def test_ndjson_rows_per_currency_day_and_product(self):
+        """
+        It should stream one NDJSON row per currency, day and product, with
+        the values computed like the range endpoint does.
+        """
+        (response, body) = self.export(currency="BTC,LTC", start="2015-08-01", end="2015-08-03",
+                                       amz_product_id=["B003EM8008", "B01MQWUXZS"])
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 2 * 3 * 2)
+        self.assertEqual(rows[0], dict(currency="BTC", date="2015-08-01", amz_product_id="B003EM8008",
+                                       product_price=119.99, currency_value=7540.35, units=62, change=100.97))
+        self.assertEqual([(row["currency"], row["date"]) for row in rows[6:8]],
+                         [("LTC", "2015-08-01"), ("LTC", "2015-08-01")])
+        self.assertEqual((rows[6]["units"], rows[6]["change"]), (0.83, 0))
+
+    def test_csv_history_is_read_page_by_page(self):
+        """
+        Ranges longer than HISTODAY_PAGE_SIZE should be read in pages that
+        cover every day once, and CSV should start with a header.
+        """
+        with mock.patch.object(CryptocurrenciesHelper, "HISTODAY_PAGE_SIZE", 5):
+            (response, body) = self.export(currency="ETH", start="2015-08-01", end="2015-08-12",
+                                           amz_product_id="B003EM8008", format="csv")
+        self.assertEqual(response["Content-Type"], "text/csv")
+
+        lines = body.splitlines()
+        self.assertEqual(lines[0], ",".join(AffordabilityExport.FIELDS))
+        self.assertEqual(len(lines), 1 + 12)
+        self.assertEqual(lines[-1], "ETH,2015-08-12,B003EM8008,119.99,7540.35,62,100.97")
+        self.assertEqual([(start.day, end.day) for (currency, start, end) in self.pages],
+                         [(1, 5), (6, 10), (11, 12)])
+
+    def test_default_products_use_known_prices(self):
+        """
+        Without amz_product_id, every product in RANDOM_PRODUCTS should be
+        exported at the price the catalog knows, without scraping amazon.
+        """
+        CH = CryptocurrenciesHelper
+        catalog = ProductCatalog(fallback=CH.RANDOM_PRODUCTS)
+        catalog.load()
+        catalog.set_tracked("B06XDP7B71", 12.5, time.time())
+
+        with mock.patch.object(CH, "product_catalog", catalog), \
+             mock.patch.object(CH, "fetch_price_from_amazon") as fetch_price:
+            (response, body) = self.export(currency="BTC", start="2015-08-01", end="2015-08-01")
+        fetch_price.assert_not_called()
+
+        prices = dict((row["amz_product_id"], row["product_price"]) for row in map(json.loads, body.splitlines()))
+        expected = dict(CH.RANDOM_PRODUCTS, B06XDP7B71=12.5)
+        self.assertEqual(prices, expected)
+
+    def test_history_error_ends_the_stream(self):
+        """
+        If a page of history cannot be loaded, an error line should be
+        streamed instead of its rows.
+        """
+        with mock.patch.object(CryptocurrenciesHelper, "get_currency_history",
+                               return_value=(None, "Could not get the history.")):
+            (response, body) = self.export(currency="BTC", start="2015-08-01", end="2015-08-03")
+        self.assertEqual(json.loads(body), dict(msg="Could not get the history.", response="error"))
+
+    def test_invalid_parameters(self):
+        """
+        Invalid parameters should return a regular error response before
+        anything is streamed.
+        """
+        for params in [dict(currency="BTC,XRP", start="2015-08-01", end="2015-08-03"),
+                       dict(currency="BTC", start="2015-08-03", end="2015-08-01"),
+                       dict(currency="BTC", start="2015-08-01", end="2015-08-03", format="xml"),
+                       dict(currency="BTC", start="2015-08-01", end="2015-08-03", fiat="EUR")]:
+            response = self.client.get(reverse("playground:cryptocurrencies_export"), params)
+            self.assertEqual(json.loads(response.content.decode("utf-8"))["response"], "error")
+
+
+class ProductCatalogTests(TestCase):
+
+    def setUp(self):
+        Product.objects.all().delete()
+        Product.objects.bulk_create([Product(amz_product_id="P%04d" % n, price=float(n)) for n in range(1, 1001)])
+        self.catalog = ProductCatalog(fallback=CryptocurrenciesHelper.RANDOM_PRODUCTS)
+
+    def test_affordable_uses_the_sorted_prices(self):
+        """
+        It should count every product priced at most the budget and list
+        the most expensive ones first, up to the limit.
+        """
+        self.assertEqual(self.catalog.affordable(250.5, 3), (250, [("P0250", 250.0), ("P0249", 249.0),
+                                                                  ("P0248", 248.0)]))
+        (count, products) = self.catalog.affordable(10)
+        self.assertEqual((count, len(products), products[-1]), (10, 10, ("P0001", 1.0)))
+        self.assertEqual(self.catalog.affordable(0.5), (0, []))
+
+    def test_catalog_is_loaded_once_and_reloaded_when_old(self):
+        """
+        The catalog should be read from the table once, until it is older
+        than max_age, and fall back to the given products if the table is empty.
+        """
+        self.catalog.max_age = 60
+        with mock.patch.object(self.catalog, "load", wraps=self.catalog.load) as load:
+            self.assertEqual(len(self.catalog), 1000)
+            self.catalog.random()
+            self.assertEqual(load.call_count, 1)
+
+            Product.objects.all().delete()
+            with mock.patch("time.time", return_value=time.time() + 61):
+                self.assertEqual(len(self.catalog), len(CryptocurrenciesHelper.RANDOM_PRODUCTS))
+            self.assertEqual(load.call_count, 2)
+
+    def test_only_one_thread_reloads_an_old_catalog(self):
+        """
+        While one thread reloads an old catalog, other threads should get
+        the old one right away instead of loading it again.
+        """
+        self.catalog.max_age = 60
+        self.catalog.load()
+        old = self.catalog.snapshot()
+        (loading, release) = (threading.Event(), threading.Event())
+
+        def load():
+            loading.set()
+            release.wait(5)
+            with self.catalog._lock:
+                self.catalog._snapshot = ([], [], {})
+                self.catalog._loaded_at = time.time()
+
+        self.catalog._loaded_at -= 61
+        with mock.patch.object(self.catalog, "load", side_effect=load) as slow_load:
+            reloader = threading.Thread(target=self.catalog.snapshot)
+            reloader.start()
+            self.assertTrue(loading.wait(5))
+            self.assertIs(self.catalog.snapshot(), old)
+            release.set()
+            reloader.join(5)
+
+        self.assertEqual(slow_load.call_count, 1)
+        self.assertEqual(self.catalog.snapshot(), ([], [], {}))
+
+    def test_response_for_currency_affordable(self):
+        """
+        It should list the products 1 unit of the currency can buy, with
+        the units and change of each one.
+        """
+        with mock.patch.object(CryptocurrenciesHelper, "product_catalog", self.catalog), \
+             mock.patch.object(CryptocurrenciesHelper, "get_currency_value", return_value=(61.47, "")):
+            response = CryptocurrenciesHelper.response_for_currency_affordable({"currency" : "LTC",
+                                                                                "affordable" : "2"})
+
+        self.assertEqual(response["data"]["count"], 61)
+        self.assertEqual(response["data"]["msg"], "You can buy 61 of the products with 1 LTC.")
+        self.assertEqual([(product["amz_product_id"], product["units"], product["change"])
+                          for product in response["data"]["products"]],
+                         [("P0061", 1, 0.47), ("P0060", 1, 1.47)])
+
+    def test_affordable_validation(self):
+        """
+        It should reject invalid affordable values, other fiat currencies
+        and batch queries.
+        """
+        CH = CryptocurrenciesHelper
+        self.assertEqual(CH.handle_request_params({"currency" : "BTC", "affordable" : "all"}), "currency_affordable")
+        for affordable in ("0", "-3", "some"):
+            response = CH.response_for_currency_affordable({"currency" : "BTC", "affordable" : affordable})
+            self.assertEqual(response["response"], "error")
+        response = CH.response_for_currency_affordable({"currency" : "BTC", "affordable" : "all", "fiat" : "EUR"})
+        self.assertEqual(response["response"], "error")
+        self.assertEqual(CH.response_for_batch([{"currency" : "BTC", "affordable" : "all"}])[0]["response"], "error")
+
+    def test_import_file(self):
+        """
+        Importing a dump should add new products, update changed ones and
+        skip invalid rows.
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            f.write("amz_product_id,price,title\nP0001,1.0,\nP0002,3.5,Mug\nNEW0001,12.5,Lamp\nBAD,-1,\n")
+        self.addCleanup(os.remove, f.name)
+
+        stats = ProductCatalog.import_file(f.name)
+        self.assertEqual(stats, dict(read=4, inserted=1, updated=1, unchanged=1, skipped=1))
+        self.assertEqual(Product.objects.get(amz_product_id="P0002").title, "Mug")
+        self.assertEqual(Product.objects.count(), 1001)
+
+    def test_import_file_skips_malformed_json_rows(self):
+        """
+        Null or non-string values and lines that are not JSON should be
+        counted as skipped without aborting the import.
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            f.write("\n".join([json.dumps(dict(amz_product_id="NEW0001", price=12.5, title="Lamp")),
+                               json.dumps(dict(amz_product_id=None, price=1)),
+                               json.dumps(dict(amz_product_id=1234, price=1)),
+                               json.dumps(dict(amz_product_id="NEW0002", price=1, title=7)),
+                               '{"amz_product_id": "NEW0003", ',
+                               json.dumps(dict(amz_product_id="NEW0004", price=3))]))
+        self.addCleanup(os.remove, f.name)
+
+        stats = ProductCatalog.import_file(f.name)
+        self.assertEqual((stats["read"], stats["inserted"], stats["skipped"]), (6, 2, 4))
+
+
+class PriceSeriesIndexTests(TestCase):
+
+    VALUES = [0, 0, 50, 120, 80, 200, 90, 150, 130]
+
+    def history(self, values):
+        start = datetime.date(2017, 1, 1)
+        return [(time.mktime((start + datetime.timedelta(days=n)).timetuple()), float(value))
+                for (n, value) in enumerate(values)]
+
+    def setUp(self):
+        CryptocurrenciesHelper.price_series_indexes.clear()
+        self.index = PriceSeriesIndex(self.history(self.VALUES))
+
+    def test_search_matches_a_linear_scan(self):
+        """
+        For every threshold, the index should find the same days as
+        scanning the series.
+        """
+        days = self.index.days
+        for threshold in [0, 1, 49, 50, 100, 120, 121, 130, 150, 199, 200, 201]:
+            at_least = [day for (day, value) in zip(days, self.VALUES) if value >= threshold]
+            below = [day for (day, value) in zip(days, self.VALUES) if value < threshold]
+            self.assertEqual(self.index.first_at_least(threshold), at_least[0] if at_least else None)
+            self.assertEqual(self.index.last_at_least(threshold), at_least[-1] if at_least else None)
+            self.assertEqual(self.index.last_below(threshold), below[-1] if below else None)
+
+    def test_empty_series(self):
+        """
+        An empty series should never qualify.
+        """
+        index = PriceSeriesIndex([])
+        self.assertEqual((index.first_at_least(1), index.last_at_least(1), index.last_below(1)),
+                         (None, None, None))
+
+    @mock.patch.object(CryptocurrenciesHelper, "get_price_from_amazon",
+                       side_effect=lambda amz_product_id: (40.0, amz_product_id, ""))
+    def test_response_for_currency_units(self, get_price_from_amazon):
+        """
+        It should return the first and last days 1 unit of the currency could
+        buy the units, and load the series once for every query of the day.
+        """
+        with mock.patch.object(CryptocurrenciesHelper, "get_currency_history",
+                               return_value=(self.history(self.VALUES), "")) as get_currency_history:
+            params = {"currency" : "BTC", "amz_product_id" : "B003EM8008", "units" : "3"}
+            response = CryptocurrenciesHelper.response_for_currency_units(params)
+            CryptocurrenciesHelper.response_for_currency_units(dict(params, units="6"))
+        self.assertEqual(get_currency_history.call_count, 1)
+
+        data = response["data"]
+        self.assertEqual((data["target_value"], data["first_date"], data["last_date"], data["affordable_since"]),
+                         (120.0, "2017-01-04", "2017-01-09", "2017-01-08"))
+        self.assertEqual(data["msg"], "You could first buy 3 units of the product with 1 BTC "
+                                      "on 2017-01-04, and last on 2017-01-09.")
+
+        with mock.patch.object(CryptocurrenciesHelper, "get_currency_history",
+                               return_value=(self.history(self.VALUES), "")):
+            response = CryptocurrenciesHelper.response_for_currency_units(dict(params, units="6"))
+        self.assertEqual((response["data"]["first_date"], response["data"]["affordable_since"]), (None, None))
+        self.assertEqual(response["data"]["msg"], "You could never buy 6 units of the product with 1 BTC.")
+
+    def test_units_validation(self):
+        """
+        It should reject invalid units and batch queries.
+        """
+        CH = CryptocurrenciesHelper
+        self.assertEqual(CH.handle_request_params({"currency" : "BTC", "units" : "2"}), "currency_units")
+        for units in ("0", "-1", "many"):
+            self.assertEqual(CH.response_for_currency_units({"currency" : "BTC", "units" : units})["response"],
+                             "error")
+        self.assertEqual(CH.response_for_batch([{"currency" : "BTC", "units" : "2"}])[0]["response"], "error")
+
+
+class PriceTrackerTests(TestCase):
+
+    def setUp(self):
+        self.catalog = ProductCatalog(fallback=CryptocurrenciesHelper.RANDOM_PRODUCTS)
+        patches = [
+            mock.patch.object(CryptocurrenciesHelper, "product_catalog", self.catalog),
+            mock.patch.object(CryptocurrenciesHelper, "fetch_price_from_amazon",
+                              side_effect=lambda amz_product_id: (42.5, amz_product_id, "")),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        CryptocurrenciesHelper.product_price_cache.clear()
+
+    def test_rate_limiter_spaces_requests_per_host(self):
+        """
+        Requests to a host beyond the burst should be given increasing waits,
+        independently of other hosts.
+        """
+        limiter = RateLimiter(rate=2, burst=1)
+        with mock.patch("time.time", return_value=1000.0):
+            self.assertEqual([limiter.reserve("www.amazon.com") for n in range(3)], [0.0, 0.5, 1.0])
+            self.assertEqual(limiter.reserve("www.amazon.co.uk"), 0.0)
+        with mock.patch("time.time", return_value=1010.0):
+            self.assertEqual(limiter.reserve("www.amazon.com"), 0.0)
+
+    def test_queue_is_bounded(self):
+        """
+        Jobs beyond the queue size should be dropped, and ASINs already queued
+        should not be queued again.
+        """
+        tracker = PriceTracker(["A1", "A2", "A3", "A4"], queue_size=2)
+        self.assertEqual(tracker.enqueue_all(), 2)
+        self.assertEqual(tracker.enqueue("A1"), False)
+
+        stats = tracker.stats()
+        self.assertEqual((stats["enqueued"], stats["dropped"], stats["queue_depth"], stats["queue_size"]),
+                         (2, 2, 2, 2))
+
+    def test_tracked_price_is_stored_and_served_without_scraping(self):
+        """
+        A tracked price should be added to the history and the catalog, and
+        get_price_from_amazon should then answer without scraping.
+        """
+        tracker = PriceTracker(["B01MQWUXZS", "NEW0000001"], rate_per_host=1000)
+        for amz_product_id in tracker.amz_product_ids:
+            self.assertEqual(tracker.track(amz_product_id), (42.5, amz_product_id, ""))
+
+        self.assertEqual(TrackedPrice.objects.filter(price=42.5).count(), 2)
+        self.assertEqual(Product.objects.get(amz_product_id="NEW0000001").price, 42.5)
+        self.assertIsNotNone(Product.objects.get(amz_product_id="B01MQWUXZS").tracked_at)
+
+        CryptocurrenciesHelper.fetch_price_from_amazon.reset_mock()
+        self.assertEqual(CryptocurrenciesHelper.get_price_from_amazon("B01MQWUXZS"), (42.5, "B01MQWUXZS", ""))
+        self.assertEqual(CryptocurrenciesHelper.fetch_price_from_amazon.call_count, 0)
+
+        self.catalog.load()
+        self.assertEqual(self.catalog.tracked_price("NEW0000001"), 42.5)
+        self.assertIsNone(self.catalog.tracked_price("B06XDP7B71"))
+
+    def test_track_all_uses_the_worker_pool(self):
+        """
+        track_all should scrape every ASIN with the workers and report it in
+        the stats and the metrics endpoint.
+        """
+        tracker = PriceTracker(["A%d" % n for n in range(10)], workers=3, rate_per_host=1000)
+        with mock.patch.object(tracker, "record") as record:
+            tracker.track_all()
+        tracker.stop()
+        self.assertEqual(record.call_count, 10)
+
+        stats = tracker.stats()
+        self.assertEqual((stats["scraped"], stats["failed"], stats["queue_depth"], stats["in_flight"]),
+                         (10, 0, 0, 0))
+        self.assertGreater(stats["throughput"], 0)
+
+        with mock.patch.object(PriceTracker, "shared_instance", tracker):
+            metrics = self.client.get(reverse("playground:metrics")).content.decode()
+        self.assertIn("playground_tracker_scraped_total 10", metrics)
+        self.assertIn("playground_tracker_queue_depth 0", metrics)
+
+
+class ParserPoolTests(TestCase):
+
+    PAGE = AmazonPriceParserTests.PAGE.encode("utf-8")
+
+    def test_pool_parses_in_worker_processes(self):
+        """
+        An enabled pool should start warm workers and parse pages in them.
+        """
+        pool = ParserPool(processes=1)
+        self.addCleanup(pool.stop)
+
+        self.assertEqual(pool.find_price_string(self.PAGE, "utf-8"), "$8.39")
+        self.assertNotEqual(pool.executor.submit(AmazonPriceParser.warm_up).result(), os.getpid())
+        self.assertEqual((pool.stats()["offloaded"], pool.stats()["inline"]), (1, 0))
+
+    def test_disabled_or_saturated_pool_parses_inline(self):
+        """
+        A disabled pool, or one with every slot taken, should parse in the
+        calling thread without starting any process.
+        """
+        pool = ParserPool(processes=0)
+        self.assertEqual(pool.find_price_string(self.PAGE), "$8.39")
+
+        pool = ParserPool(processes=2, max_pending=1)
+        pool._slots.acquire()
+        self.assertEqual(pool.find_price_string(self.PAGE), "$8.39")
+        self.assertIsNone(pool.executor)
+        self.assertEqual(pool.stats()["inline"], 1)
+
+    def test_broken_pool_falls_back_and_restarts(self):
+        """
+        If the worker processes died, the page should be parsed inline and
+        the next call should start a new pool.
+        """
+        pool = ParserPool(processes=1)
+        broken = mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool()
+        pool.executor = broken
+
+        self.assertEqual(pool.find_price_string(self.PAGE), "$8.39")
+        self.assertIsNone(pool.executor)
+        self.assertEqual((pool.stats()["broken"], pool.stats()["inline"]), (1, 1))
+
+    def test_pool_that_breaks_while_starting_falls_back(self):
+        """
+        If the workers die while warming up, the page should still be
+        parsed inline and the broken pool should be discarded.
+        """
+        pool = ParserPool(processes=1)
+        broken = mock.Mock()
+        broken.submit.return_value.result.side_effect = BrokenProcessPool()
+
+        with mock.patch("playground.helpers.parser_pool.ProcessPoolExecutor", return_value=broken):
+            self.assertEqual(pool.find_price_string(self.PAGE), "$8.39")
+        self.assertIsNone(pool.executor)
+        broken.shutdown.assert_called_once_with(wait=False)
+        self.assertEqual((pool.stats()["broken"], pool.stats()["inline"]), (1, 1))
+
+    def test_request_price_from_amazon_uses_the_pool(self):
+        """
+        With the pool enabled, the raw page bytes should be handed to it.
+        """
+        pool = mock.Mock(enabled=True)
+        pool.find_price_string.return_value = "$8.39"
+        page = mock.Mock(content=self.PAGE, encoding="utf-8")
+        with mock.patch.object(CryptocurrenciesHelper, "parser_pool", pool), \
+             mock.patch.object(CryptocurrenciesHelper.http, "get", return_value=page):
+            self.assertEqual(CryptocurrenciesHelper.request_price_from_amazon("B003EM8008"),
+                             (8.39, "B003EM8008", ""))
+        pool.find_price_string.assert_called_once_with(self.PAGE, "utf-8", True)
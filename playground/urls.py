@@ -1,8 +1,19 @@
+import django
 from django.conf.urls import url
 
 from . import views
 
+app_name = 'playground'
+
 urlpatterns = [
     url(r'^$', views.index, name='index'),
     url(r'^cryptocurrencies$', views.cryptocurrencies, name='cryptocurrencies'),
-]
\ No newline at end of file
+    url(r'^cryptocurrencies/export$', views.cryptocurrencies_export, name='cryptocurrencies_export'),
+    url(r'^cryptocurrencies/batch$', views.cryptocurrencies_batch, name='cryptocurrencies_batch'),
+    url(r'^metrics$', views.metrics, name='metrics'),
+]
+
+if django.VERSION >= (3, 1):
+    urlpatterns += [
+        url(r'^cryptocurrencies/async$', views.cryptocurrencies_async, name='cryptocurrencies_async'),
+    ]
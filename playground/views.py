@@ -1,8 +1,50 @@
-from django.http import HttpResponse
+import asyncio
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
 from .helpers.cryptocurrencies_helper import *
+from .helpers.affordability_export import AffordabilityExport
+from .helpers.http_cache_helper import HttpCacheHelper
+from .helpers.price_prewarmer import PricePrewarmer
+from .helpers.price_tracker import PriceTracker
+
+'''
+Returns a JSON response with the body rendered by
+CryptocurrenciesHelper.renderer, which matches what
+JsonResponse would send but is faster for the
+common response shapes.
+'''
+def json_response(response):
+    CH = CryptocurrenciesHelper
+
+    with CH.metrics.stage("serialize"):
+        body = CH.renderer.render(response)
+
+    return HttpResponse(body, content_type="application/json")
+
+
+'''
+Returns the rendered JSON response with its HTTP
+caching headers, and stores it in the server-side
+response cache if one is configured.
+'''
+def cached_json_response(request, params, response_type, response):
+    CH = CryptocurrenciesHelper
+    HC = HttpCacheHelper
+
+    with CH.metrics.stage("serialize"):
+        body = CH.renderer.render(response)
+    max_age = HC.max_age_for(params, response_type, response)
+    HC.set_cached(params, body, max_age)
+
+    return HC.conditional_response(request, body, max_age)
+
 
 '''
 Shows welcome page
@@ -17,7 +59,12 @@ An endpoint for requests about cryptocurrencies
 A request can have parameters such as:
 currency=BTC
 date=YYYY-MM-DD
+start=YYYY-MM-DD
+end=YYYY-MM-DD
 amz_product_id=B01MQWUXZS
+fiat=EUR
+affordable=all or affordable=10
+units=3
 
 The only parameter required is currency.
 
@@ -33,16 +80,40 @@ currency + date
         product that can be bought from amazon
         considering the currency's value at
         the given date.
+currency + start + end
+    -> returns the number of units of a random
+        product that could be bought from amazon
+        on every day from start to end.
 if amz_product_id is provided,
 the endpoint will return results with respect
 to that product.
+if fiat is provided, prices are given in that
+fiat currency instead of USD (current prices only).
+currency + affordable
+    -> returns every product of the catalog (or the
+        N most expensive ones) that can be bought
+        with one unit of the currency.
+currency + units
+    -> returns the first and last dates on which
+        one unit of the currency could buy that many
+        units of a random product (or amz_product_id).
+
+Responses carry ETag and Cache-Control headers
+(see HttpCacheHelper), and a Server-Timing header
+with the time spent in each stage (see RequestMetrics).
 '''
+@CryptocurrenciesHelper.metrics.server_timing
 def cryptocurrencies(request):
     CH = CryptocurrenciesHelper
+    HC = HttpCacheHelper
 
     response = {}
     params = request.GET
 
+    cached = HC.get_cached(params)
+    if cached is not None:
+        return HC.conditional_response(request, *cached)
+
     response_type = CH.handle_request_params(params)
 
     if response_type == "currency":
@@ -53,8 +124,164 @@ def cryptocurrencies(request):
         response = CH.response_for_currency_product(params)
     elif response_type == "currency_date_product":
         response = CH.response_for_currency_date_product(params)
+    elif response_type == "currency_range":
+        response = CH.response_for_currency_range(params)
+    elif response_type == "currency_affordable":
+        response = CH.response_for_currency_affordable(params)
+    elif response_type == "currency_units":
+        response = CH.response_for_currency_units(params)
+    else:
+        response = dict(msg="The only parameter required is currency. Ex(currency=BTC)")
+
+    return cached_json_response(request, params, response_type, response)
+
+
+'''
+Async version of the cryptocurrencies endpoint.
+
+Takes the same parameters and returns the same responses.
+When both a currency value and a product price have to be
+fetched, they are fetched at the same time, and no upstream
+call blocks the event loop.
+
+Async views need Django 3.1 or later, so this view is only
+routed on those versions (see playground/urls.py).
+'''
+@CryptocurrenciesHelper.metrics.server_timing
+async def cryptocurrencies_async(request):
+    CH = CryptocurrenciesHelper
+    HC = HttpCacheHelper
+
+    response = {}
+    params = request.GET
+
+    cached = HC.get_cached(params)
+    if cached is not None:
+        return HC.conditional_response(request, *cached)
+
+    response_type = CH.handle_request_params(params)
+    loop = asyncio.get_running_loop()
+
+    if response_type == "currency":
+        response = await loop.run_in_executor(None, CH.metrics.bind(CH.response_for_currency), params)
+    elif response_type == "currency_date":
+        response = await loop.run_in_executor(CH.executor, CH.metrics.bind(CH.response_for_currency_date),
+                                              params)
+    elif response_type == "currency_product":
+        response = await CH.response_for_currency_product_async(params)
+    elif response_type == "currency_date_product":
+        response = await CH.response_for_currency_date_product_async(params)
+    elif response_type == "currency_range":
+        response = await loop.run_in_executor(None, CH.metrics.bind(CH.response_for_currency_range), params)
+    elif response_type == "currency_affordable":
+        response = await loop.run_in_executor(CH.executor, CH.metrics.bind(CH.response_for_currency_affordable),
+                                              params)
+    elif response_type == "currency_units":
+        response = await loop.run_in_executor(None, CH.metrics.bind(CH.response_for_currency_units), params)
     else:
         response = dict(msg="The only parameter required is currency. Ex(currency=BTC)")
 
-    return JsonResponse(response)
+    return cached_json_response(request, params, response_type, response)
+
+
+'''
+A batch endpoint for requests about cryptocurrencies
+
+Expects a POST with a JSON body such as:
+{
+    "queries": [
+        {"currency": "BTC"},
+        {"currency": "ETH", "date": "2017-08-12", "amz_product_id": "B01MQWUXZS"}
+    ]
+}
+
+Each query takes the same parameters as the cryptocurrencies
+endpoint. Identical upstream lookups are only done once, and
+the rest run concurrently.
+
+Responds with one result per query, in the same order, each
+one shaped like a cryptocurrencies response:
+{
+    "response": "ok",
+    "results": [{"response": "ok", "data": {...}}, {"response": "error", "msg": "..."}]
+}
+'''
+@csrf_exempt
+@require_POST
+@CryptocurrenciesHelper.metrics.server_timing
+def cryptocurrencies_batch(request):
+    CH = CryptocurrenciesHelper
+
+    max_queries = getattr(settings, "PLAYGROUND_BATCH_MAX_QUERIES", 100)
+
+    try:
+        queries = json.loads(request.body.decode("utf-8")).get("queries")
+    except Exception:
+        queries = None
+
+    if not isinstance(queries, list):
+        return json_response(dict(msg="Please send a JSON object with a list of queries. "
+                                 "Ex({\"queries\": [{\"currency\": \"BTC\"}]})",
+                                 response="error"))
+
+    if len(queries) > max_queries:
+        return json_response(dict(msg="A batch can have at most %s queries." % max_queries,
+                                 response="error"))
+
+    return json_response(dict(response="ok", results=CH.response_for_batch(queries)))
+
+
+'''
+An endpoint that exports affordability series
+
+A request can have parameters such as:
+currency=BTC,ETH (or currency=BTC&currency=ETH)
+start=YYYY-MM-DD
+end=YYYY-MM-DD
+amz_product_id=B01MQWUXZS,B01J24C0TI
+format=ndjson or format=csv
+
+currency, start and end are required. Without
+amz_product_id, the RANDOM_PRODUCTS are exported.
+
+Streams one row per currency, day and product, with
+the currency and product values and the units and
+change on that day, as NDJSON (the default) or CSV.
+Rows are sent as each page of history is loaded, so
+any range can be exported (see AffordabilityExport).
+'''
+def cryptocurrencies_export(request):
+    (export, msg) = AffordabilityExport.from_request(request.GET)
+
+    if export is None:
+        return json_response(dict(msg=msg, response="error"))
+
+    response = StreamingHttpResponse(export.stream(), content_type=export.content_type)
+    if export.format == "csv":
+        response["Content-Disposition"] = 'attachment; filename="affordability.csv"'
+    return response
+
+
+'''
+Exposes the request stage timings, the upstream
+call and error counts per host, the circuit
+breaker and retry status of each host, and the
+price tracker pool counters if it runs in this
+process, in the Prometheus text format.
+'''
+def metrics(request):
+    CH = CryptocurrenciesHelper
+
+    tracker = PriceTracker.shared_instance
+    tracker_stats = tracker.stats() if tracker is not None else None
+
+    prewarmer = PricePrewarmer.shared_instance
+    prewarmer_status = prewarmer.status() if prewarmer is not None else None
+
+    cache_stats = dict(spot=CH.spot_price_cache.stats(),
+                       rates=CH.rate_matrix_cache.stats(),
+                       product=CH.product_price_cache.stats())
 
+    return HttpResponse(CH.metrics.render_prometheus(CH.http.status(), tracker_stats, prewarmer_status,
+                                                     cache_stats),
+                        content_type="text/plain; version=0.0.4; charset=utf-8")